@@ -0,0 +1,433 @@
+# ASGI entry point
+# Token streams for `POST /chats` and `POST /chats/<id>/turns` are served natively on
+# the event loop with the async Ollama client, so an open stream costs a coroutine instead of a pinned worker thread.
+# So are the streams that follow a generation again, GET /generations/<id> and
+# GET /chats/<id>/generation. POST /import is served natively too: the WSGI adapter reads
+# a request body whole before calling Flask, while an import of any size should be read as
+# it arrives. Every other request is handed to the Flask app through hypercorn's WSGI adapter.
+#
+# hypercorn spawns its workers, so each one imports this module and builds its own Flask
+# app. With PRELOAD_MODELS (the default) a worker loads the Ollama client and the
+# embedding model during lifespan startup, before it accepts connections, instead of
+# making its first chat wait for them.
+#
+# Run with: hypercorn app.asgi:app
+
+import asyncio
+import io
+import json
+import logging
+import re
+import time
+from typing import Optional
+from urllib.parse import parse_qs
+
+from flask_jwt_extended import decode_token
+from hypercorn.middleware import AsyncioWSGIMiddleware
+
+from app.main import (
+    PRELOAD_MODELS,
+    chat_replies,
+    create_app,
+    generations,
+    import_chats,
+    load_chat_history_repo,
+    model_router,
+    preload_models,
+)
+from app.generations import GENERATION_HEADER, Generation, last_event_id
+from app.metrics import observe_request
+from app.scheduler import SchedulerBusy
+from app.streaming import SSE_HEADERS
+
+TURNS_PATH = re.compile(r"^/chats/([^/]+)/turns$")
+GENERATION_PATH = re.compile(r"^/generations/([^/]+)$")
+CHAT_GENERATION_PATH = re.compile(r"^/chats/([^/]+)/generation$")
+
+# Chat requests carry the whole transcript, so the WSGI adapter's 64KiB default is too small
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+STREAM_HEADERS = [
+    (name.lower().encode(), value.encode()) for name, value in SSE_HEADERS.items()
+] + [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-expose-headers", GENERATION_HEADER.encode()),
+]
+
+logger = logging.getLogger(__name__)
+
+
+def with_empty_chunk(wsgi):
+    """Give responses without a body (304, 204, HEAD) one empty chunk.
+
+    hypercorn's WSGI adapter sends the status line along with the first chunk of the body,
+    so for a response without any it fails with a 500 instead.
+    """
+    def app(environ, start_response):
+        body = wsgi(environ, start_response)
+        try:
+            empty = True
+            for chunk in body:
+                empty = False
+                yield chunk
+            if empty:
+                yield b""
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+
+    return app
+
+
+flask_app = create_app()
+wsgi_app = AsyncioWSGIMiddleware(with_empty_chunk(flask_app), max_body_size=MAX_BODY_SIZE)
+
+_ollama_client = None
+
+
+def get_ollama_client():
+    # Created lazily so the underlying connection pool binds to the running event loop
+    global _ollama_client
+    if _ollama_client is None:
+        import ollama
+
+        _ollama_client = ollama.AsyncClient()
+    return _ollama_client
+
+
+async def send_json(send, status: int, payload: dict, headers: Optional[dict] = None):
+    body = json.dumps(payload).encode()
+    extra_headers = [(name.lower().encode(), str(value).encode()) for name, value in (headers or {}).items()]
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"access-control-allow-origin", b"*"),
+        ] + extra_headers,
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def read_body(receive) -> Optional[bytes]:
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body.extend(message.get("body", b""))
+        if len(body) > MAX_BODY_SIZE:
+            raise ValueError("Request body too large")
+        if not message.get("more_body", False):
+            return bytes(body)
+
+
+class RequestBody(io.RawIOBase):
+    """A request body read from a worker thread, one ASGI message at a time.
+
+    Every read waits for the event loop to receive the next message, so the client is
+    only read from as fast as the thread consumes the body.
+    """
+
+    def __init__(self, receive, loop: asyncio.AbstractEventLoop):
+        self.receive = receive
+        self.loop = loop
+        self.pending = b""
+        self.more_body = True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.pending and self.more_body:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message["type"] == "http.disconnect":
+                raise ConnectionAbortedError("Client disconnected")
+            self.pending = message.get("body", b"")
+            self.more_body = message.get("more_body", False)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def authenticate(scope) -> Optional[str]:
+    """Return the user id of a valid bearer token, mirroring `@jwt_required()`."""
+    headers = dict(scope["headers"])
+    authorization = headers.get(b"authorization", b"").decode()
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        with flask_app.app_context():
+            claims = decode_token(token)
+            if claims.get("type") != "access":
+                return None
+            return claims[flask_app.config["JWT_IDENTITY_CLAIM"]]
+    except Exception:
+        return None
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_generation(generation: Generation, prompt: list, messages: list, ticket):
+    """Generate the reply of `generation` on the event loop, see app/replies.py."""
+    run = chat_replies.run(flask_app, generation, prompt, messages, ticket)
+    try:
+        response = await get_ollama_client().chat(**run.request())
+        async for part in response:
+            if run.add(part):
+                break
+        await asyncio.get_running_loop().run_in_executor(None, run.finish)
+    except asyncio.CancelledError:
+        # Nobody followed it any more, cancelling closes the HTTP stream to Ollama
+        generation.close()
+        raise
+    except Exception:
+        run.fail()
+    finally:
+        run.close()
+
+
+def start_generation(generation: Generation, producer):
+    """Run `producer` on the event loop, cancelled when the generation is."""
+    task = asyncio.ensure_future(producer)
+    loop = asyncio.get_running_loop()
+    generation.on_cancel = lambda: loop.call_soon_threadsafe(task.cancel)
+
+
+async def follow_generation(receive, send, generation: Generation, after: int = 0, disconnect=None):
+    """Stream the events of `generation` after event `after` until it ends or the client leaves.
+
+    A client leaving doesn't stop the generation, see app/generations.py.
+    """
+    disconnect = disconnect or asyncio.create_task(wait_for_disconnect(receive))
+
+    async def forward():
+        await send({"type": "http.response.start", "status": 200, "headers": STREAM_HEADERS + [
+            (GENERATION_HEADER.lower().encode(), generation.id.encode()),
+        ]})
+        # Each `send` waits for the transport to drain, a slow reader falls behind in the buffer
+        async for frames in generation.follow_async(after):
+            await send({"type": "http.response.body", "body": frames.encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    forwarding = asyncio.create_task(forward())
+    done, pending = await asyncio.wait({forwarding, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def stream_chat(scope, receive, send):
+    user_id = authenticate(scope)
+    if not user_id:
+        await send_json(send, 401, {"msg": "Missing or invalid Authorization header"})
+        return
+
+    try:
+        body = await read_body(receive)
+        if body is None:
+            return
+        data = json.loads(body or b"{}")
+        messages = data.get("messages", [])
+        if not isinstance(messages, list):
+            messages = [messages]
+        chat_id = data.get("chat_id")
+    except (ValueError, AttributeError) as e:
+        logger.exception("Error processing request")
+        await send_json(send, 400, {"error": "Error processing request"})
+        return
+
+    await stream_reply(receive, send, messages, chat_id, user_id)
+
+
+def load_chat_history(chat_id: str, user_id: str) -> Optional[list]:
+    with flask_app.app_context():
+        return load_chat_history_repo(chat_id, user_id)
+
+
+async def stream_turn(scope, receive, send, chat_id: str):
+    user_id = authenticate(scope)
+    if not user_id:
+        await send_json(send, 401, {"msg": "Missing or invalid Authorization header"})
+        return
+
+    try:
+        body = await read_body(receive)
+        if body is None:
+            return
+        content = json.loads(body or b"{}").get("content", "")
+    except (ValueError, AttributeError) as e:
+        logger.exception("Error processing request")
+        await send_json(send, 400, {"error": "Error processing request"})
+        return
+    if not isinstance(content, str) or not content.strip():
+        await send_json(send, 400, {"error": "content is required"})
+        return
+
+    try:
+        history = await asyncio.get_running_loop().run_in_executor(None, load_chat_history, chat_id, user_id)
+    except Exception:
+        logger.exception("Error loading chat history")
+        await send_json(send, 500, {"error": "Error processing request"})
+        return
+    if history is None:
+        await send_json(send, 404, {"error": "Chat not found"})
+        return
+
+    await stream_reply(receive, send, history + [{"role": "user", "content": content}], chat_id, user_id)
+
+
+async def stream_reply(receive, send, messages: list, chat_id: Optional[str], user_id: str):
+    """Start generating the reply to `messages` and stream it, see app/generations.py.
+
+    The new turns of `chat_id` are stored once the reply finishes, even if the client left.
+    """
+    # Embedding the question, searching the index and reading the chat summary block, keep them off the event loop
+    loop = asyncio.get_running_loop()
+    try:
+        cached, prompt = await loop.run_in_executor(None, chat_replies.prepare, flask_app, messages, chat_id, user_id)
+    except Exception:
+        logger.exception("Error building prompt")
+        await send_json(send, 500, {"error": "Error processing request"})
+        return
+    if cached is not None:
+        generation = chat_replies.start(user_id, chat_id)
+        start_generation(generation, loop.run_in_executor(None, chat_replies.replay, flask_app, generation, cached, messages))
+        await follow_generation(receive, send, generation)
+        return
+
+    disconnect = asyncio.create_task(wait_for_disconnect(receive))
+    try:
+        # A client that goes away while queued gives up its place in the queue
+        admission = asyncio.create_task(chat_replies.admit_async(user_id, prompt))
+        await asyncio.wait({admission, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        if not admission.done():
+            admission.cancel()
+            await asyncio.gather(admission, return_exceptions=True)
+            return
+        ticket = admission.result()
+    except SchedulerBusy as e:
+        disconnect.cancel()
+        await send_json(send, 429, {"error": str(e)}, headers={"Retry-After": e.retry_after})
+        return
+
+    generation = chat_replies.start(user_id, chat_id)
+    start_generation(generation, run_generation(generation, prompt, messages, ticket))
+    await follow_generation(receive, send, generation, disconnect=disconnect)
+
+
+async def resume_generation(scope, receive, send, generation_id: str):
+    """Follow a generation again after a dropped connection, from the event after `Last-Event-ID`."""
+    user_id = authenticate(scope)
+    if not user_id:
+        await send_json(send, 401, {"msg": "Missing or invalid Authorization header"})
+        return
+    generation = generations.get(generation_id, user_id)
+    if generation is None:
+        await send_json(send, 404, {"error": "Generation not found"})
+        return
+    header = dict(scope["headers"]).get(b"last-event-id", b"").decode()
+    query = parse_qs(scope.get("query_string", b"").decode())
+    await follow_generation(receive, send, generation, last_event_id(header or query.get("last_event_id", [""])[0]))
+
+
+async def follow_chat_generation(scope, receive, send, chat_id: str):
+    """Follow the latest generation of a chat from its start, e.g. from another tab."""
+    user_id = authenticate(scope)
+    if not user_id:
+        await send_json(send, 401, {"msg": "Missing or invalid Authorization header"})
+        return
+    generation = generations.for_chat(chat_id, user_id)
+    if generation is None:
+        await send_json(send, 404, {"error": "Generation not found"})
+        return
+    await follow_generation(receive, send, generation)
+
+
+async def import_user_chats(scope, receive, send):
+    """Add the chats of an NDJSON export to the user's, reading the body as it arrives."""
+    user_id = authenticate(scope)
+    if not user_id:
+        await send_json(send, 401, {"msg": "Missing or invalid Authorization header"})
+        return
+    loop = asyncio.get_running_loop()
+    body = io.BufferedReader(RequestBody(receive, loop))
+    try:
+        counts = await loop.run_in_executor(None, import_chats, flask_app, body, user_id)
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+    except ConnectionAbortedError:
+        return
+    if counts is None:
+        await send_json(send, 500, {"error": "An error occurred while importing chats"})
+        return
+    await send_json(send, 201, counts)
+
+
+def timed(handler, route: str):
+    """Wrap a native handler so it reports the request metrics Flask records for its own routes."""
+    async def timed_handler(scope, receive, send, *args):
+        started = time.perf_counter()
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                observe_request(scope["method"], route, message["status"], time.perf_counter() - started)
+            await send(message)
+
+        await handler(scope, receive, send_timed, *args)
+
+    return timed_handler
+
+
+timed_stream_chat = timed(stream_chat, "/chats")
+timed_stream_turn = timed(stream_turn, "/chats/<string:chat_id>/turns")
+timed_resume_generation = timed(resume_generation, "/generations/<string:generation_id>")
+timed_follow_chat_generation = timed(follow_chat_generation, "/chats/<string:chat_id>/generation")
+timed_import_user_chats = timed(import_user_chats, "/import")
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Loads the routed models on Ollama in the background, see app/routing.py
+            model_router.start_keepalive()
+            if PRELOAD_MODELS:
+                await asyncio.get_running_loop().run_in_executor(None, preload_models)
+                get_ollama_client()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(scope, receive, send)
+        return
+    streaming = scope["type"] == "http" and scope["method"] == "POST"
+    following = scope["type"] == "http" and scope["method"] == "GET"
+    turn = TURNS_PATH.match(scope["path"]) if streaming else None
+    resumed = GENERATION_PATH.match(scope["path"]) if following else None
+    followed = CHAT_GENERATION_PATH.match(scope["path"]) if following else None
+    if streaming and scope["path"] == "/chats":
+        await timed_stream_chat(scope, receive, send)
+    elif streaming and scope["path"] == "/import":
+        await timed_import_user_chats(scope, receive, send)
+    elif turn:
+        await timed_stream_turn(scope, receive, send, turn.group(1))
+    elif resumed:
+        await timed_resume_generation(scope, receive, send, resumed.group(1))
+    elif followed:
+        await timed_follow_chat_generation(scope, receive, send, followed.group(1))
+    else:
+        await wsgi_app(scope, receive, send)
@@ -0,0 +1,233 @@
+# Cache module
+# A bounded in-process LRU, optionally backed by a cache shared between worker processes.
+#
+# The LRU answers most lookups without leaving the process. On a local miss the shared
+# backend is asked before giving up, and whatever it returns is kept locally. The only
+# shared backend is Redis (set CACHE_URL=redis://...). `LocalBackend` is an in-process
+# stand-in with the same interface, for tests and single-process runs.
+#
+# Values must be JSON-serializable so they can go through the shared backend unchanged.
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+CACHE_URL = os.getenv("CACHE_URL")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", 3600))
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Set `key` unless it is already set. Returns whether it was."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def _set(self, key: str, value: Any, ttl: Optional[float]):
+        ttl = ttl if ttl is not None else self.ttl
+        self._entries[key] = (value, time.monotonic() + ttl if ttl else None)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class LocalBackend:
+    """In-process stand-in for a shared cache backend."""
+
+    def __init__(self):
+        self._cache = LRUCache(max_entries=100_000)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None):
+        self._cache.set(key, value, ttl=ttl)
+
+    def add(self, key: str, value: str, ttl: Optional[int] = None) -> bool:
+        return self._cache.add(key, value, ttl=ttl)
+
+    def delete(self, key: str):
+        self._cache.delete(key)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_URL points at Redis but the `redis` package is not installed") from e
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None):
+        self.client.set(key, value, ex=ttl)
+
+    def add(self, key: str, value: str, ttl: Optional[int] = None) -> bool:
+        return bool(self.client.set(key, value, ex=ttl, nx=True))
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+
+def backend_from_env(url: Optional[str] = CACHE_URL):
+    if not url:
+        return None
+    if url == "local":
+        return LocalBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise RuntimeError(f"Unsupported CACHE_URL: {url}")
+
+
+class TieredCache:
+    """An LRU in front of an optional shared backend, with hit/miss counters for sizing.
+
+    With `keep_local=False`, values that other processes may change are only kept in the
+    shared backend when there is one, so a write in any process is seen by the next read.
+    """
+
+    def __init__(self, name: str, max_entries: int = 1024, ttl: int = CACHE_TTL_SECONDS, backend=None,
+                 keep_local: bool = True):
+        self.name = name
+        self.ttl = ttl
+        self.local = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.backend = backend
+        self.keep_local = keep_local or backend is None
+        self.shared_hits = 0
+        self.shared_errors = 0
+
+    def _key(self, key: str) -> str:
+        return f"org-pedia:{self.name}:{key}"
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None or self.backend is None:
+            return value
+        try:
+            raw = self.backend.get(self._key(key))
+        except Exception as e:
+            self.shared_errors += 1
+            logger.exception("Error reading from shared cache")
+            return None
+        if raw is None:
+            return None
+        value = json.loads(raw)
+        self.shared_hits += 1
+        if self.keep_local:
+            self.local.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any):
+        if self.keep_local:
+            self.local.set(key, value)
+        if self.backend is not None:
+            try:
+                self.backend.set(self._key(key), json.dumps(value), ttl=self.ttl)
+            except Exception as e:
+                self.shared_errors += 1
+                logger.exception("Error writing to shared cache")
+
+    def add(self, key: str, value: Any) -> bool:
+        """Set `key` unless it is already set, so a value read before a concurrent `set`
+        can't replace the newer one. Returns whether it was."""
+        if self.backend is None:
+            return self.local.add(key, value)
+        try:
+            added = self.backend.add(self._key(key), json.dumps(value), ttl=self.ttl)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.exception("Error writing to shared cache")
+            return False
+        if added and self.keep_local:
+            self.local.set(key, value)
+        return added
+
+    def delete(self, key: str):
+        self.local.delete(key)
+        if self.backend is not None:
+            try:
+                self.backend.delete(self._key(key))
+            except Exception as e:
+                self.shared_errors += 1
+                logger.exception("Error deleting from shared cache")
+
+    def clear_local(self):
+        self.local.clear()
+
+    def stats(self) -> dict:
+        stats = self.local.stats()
+        stats["shared_hits"] = self.shared_hits
+        stats["shared_errors"] = self.shared_errors
+        stats["backend"] = type(self.backend).__name__ if self.backend is not None else None
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["hits"] + self.shared_hits) / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,132 @@
+# Conversation context window
+# Decides which part of a conversation is sent to the model, so the prompt of a long
+# chat stays within a fixed token budget instead of growing with every turn.
+#
+# The prompt is made of the leading system messages, a rolling summary of the older
+# turns (stored on the chat) and as many of the most recent turns as fit in
+# CONTEXT_TOKEN_BUDGET. Turns that fall out of the window and aren't covered by the
+# summary yet are folded into it in the background, after the reply has been sent.
+#
+# Token counts are estimated from the text length (about four characters per token for
+# English with llama-family tokenizers), which is close enough for budgeting and needs
+# neither the model's tokenizer nor a round trip to Ollama.
+
+import os
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+# Recent turns that are always kept, even when they alone exceed the budget
+CONTEXT_MIN_TURNS = int(os.getenv("CONTEXT_MIN_TURNS", 2))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 400))
+# A summary folds in enough turns that the rest fit in this share of the budget, leaving
+# room for the next few turns before another summary is needed
+SUMMARY_LOW_WATERMARK = 0.5
+CHARS_PER_TOKEN = 4
+# Role markers and separators the chat template adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Rewrite the summary so it also covers the new turns. Keep names, numbers, decisions "
+    "and open questions; drop small talk. Reply with the summary only, in at most "
+    f"{SUMMARY_MAX_TOKENS * 3 // 4} words."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def message_tokens(message: dict) -> int:
+    return estimate_tokens(str(message.get("content", ""))) + MESSAGE_OVERHEAD_TOKENS
+
+
+def summary_message(summary: str) -> dict:
+    return {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+
+
+@dataclass
+class ContextWindow:
+    messages: List[dict]
+    # Index of the oldest turn of the transcript that is sent as is
+    first_kept: int
+    tokens: int
+    # Turns to fold into the summary, and the transcript index the new summary reaches
+    unsummarized: List[dict] = field(default_factory=list)
+    summarize_upto: int = 0
+
+    @property
+    def needs_summary(self) -> bool:
+        return bool(self.unsummarized)
+
+
+def build_context(
+    messages: list,
+    summary: Optional[str] = None,
+    summary_upto: int = 0,
+    budget: int = CONTEXT_TOKEN_BUDGET,
+) -> ContextWindow:
+    """Fit `messages` into `budget` tokens.
+
+    `summary` covers the turns before index `summary_upto` of the transcript. It is
+    ignored when the transcript is shorter than that, e.g. after the user edited it.
+    """
+    messages = [message for message in messages if isinstance(message, dict)]
+    leading = 0
+    while leading < len(messages) and messages[leading].get("role") == "system":
+        leading += 1
+    system, turns = messages[:leading], messages[leading:]
+
+    if summary and not 0 < summary_upto - leading <= len(turns):
+        summary, summary_upto = None, 0
+    summarized = max(summary_upto - leading, 0)
+
+    base = sum(message_tokens(message) for message in system)
+    if summary:
+        base += message_tokens(summary_message(summary))
+
+    # Turns the summary already covers are never sent again
+    first, used = fit_turns(turns, summarized, base, budget)
+
+    # Turns that no longer fit are summarized in the background, down to the low watermark
+    fold_to = first
+    if first > summarized:
+        fold_to, _ = fit_turns(turns, first, base, budget * SUMMARY_LOW_WATERMARK)
+
+    prompt = list(system)
+    if summary:
+        prompt.append(summary_message(summary))
+    prompt.extend(turns[first:])
+    return ContextWindow(
+        messages=prompt,
+        first_kept=leading + first,
+        tokens=used,
+        unsummarized=turns[summarized:fold_to],
+        summarize_upto=leading + fold_to,
+    )
+
+
+def fit_turns(turns: list, stop: int, used: int, budget: float) -> tuple:
+    """Walk back from the newest turn, but not past `stop`, until the budget runs out.
+
+    Returns the index of the oldest turn that fits, and the tokens used with it.
+    """
+    first = len(turns)
+    while first > stop:
+        cost = message_tokens(turns[first - 1])
+        if len(turns) - first >= CONTEXT_MIN_TURNS and used + cost > budget:
+            break
+        used += cost
+        first -= 1
+    return first, used
+
+
+def summary_prompt(previous: Optional[str], turns: List[dict]) -> List[dict]:
+    transcript = "\n\n".join(f"{turn.get('role', 'user')}: {turn.get('content', '')}" for turn in turns)
+    content = f"Current summary:\n{previous or '(none yet)'}\n\nNew turns:\n{transcript}"
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": content},
+    ]
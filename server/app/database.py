@@ -0,0 +1,209 @@
+# Database engine settings and pool metrics
+# Every hypercorn worker is a separate process with its own connection pool, so the
+# number of Postgres connections the server can open is
+#     workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# and has to stay below the server's max_connections. With DB_PGBOUNCER=true the
+# app keeps no pool of its own (NullPool) and leaves pooling to PgBouncer, which is the
+# way to run many workers against a small Postgres.
+#
+# The pool and the engine are instrumented with SQLAlchemy event hooks: checkouts,
+# time spent waiting for a connection, overflow connections, checkout timeouts and
+# statements slower than DB_SLOW_QUERY_MS. Numbers are per process.
+
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 5))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# Recycle connections before Postgres, a proxy or a firewall drops them as idle
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+# Percentiles are computed over this many of the most recent samples
+METRICS_WINDOW = 1024
+SLOW_QUERY_LOG_SIZE = 50
+
+
+def percentile(samples, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class PoolMetrics:
+    def __init__(self, slow_query_ms: float = DB_SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.overflow_events = 0
+        self.timeouts = 0
+        # Lifetime totals; the deques only hold the latest samples, for percentiles
+        self.waited = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.waits = deque(maxlen=METRICS_WINDOW)
+        self.queries = 0
+        self.query_ms_total = 0.0
+        self.query_times = deque(maxlen=METRICS_WINDOW)
+        self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+    def record_wait(self, wait_ms: float, overflowed: bool):
+        with self._lock:
+            self.waited += 1
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+            self.waits.append(wait_ms)
+            if overflowed:
+                self.overflow_events += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_query(self, statement: str, elapsed_ms: float):
+        with self._lock:
+            self.queries += 1
+            self.query_ms_total += elapsed_ms
+            self.query_times.append(elapsed_ms)
+            if elapsed_ms >= self.slow_query_ms:
+                self.slow_queries.append({
+                    "statement": " ".join(statement.split())[:500],
+                    "duration_ms": round(elapsed_ms, 2),
+                    "at": time.time(),
+                })
+
+    def count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = list(self.waits)
+            query_times = list(self.query_times)
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "overflow_events": self.overflow_events,
+                "checkout_timeouts": self.timeouts,
+                "checkout_wait_ms": {
+                    "avg": round(self.wait_ms_total / self.waited, 3) if self.waited else 0.0,
+                    "p95": round(percentile(waits, 0.95), 3),
+                    "max": round(self.wait_ms_max, 3),
+                },
+                "queries": self.queries,
+                "query_ms": {
+                    "total": round(self.query_ms_total, 2),
+                    "p50": round(percentile(query_times, 0.5), 3),
+                    "p95": round(percentile(query_times, 0.95), 3),
+                    "p99": round(percentile(query_times, 0.99), 3),
+                },
+                "slow_query_ms": self.slow_query_ms,
+                "slow_queries": list(self.slow_queries),
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that times how long each checkout waits for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # QueuePool._do_get retries by calling itself, only the outermost call is timed
+        self._checkout_state = threading.local()
+
+    def _do_get(self):
+        state = self._checkout_state
+        if getattr(state, "active", False):
+            return super()._do_get()
+
+        state.active, state.overflowed = True, False
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record_timeout()
+            raise
+        finally:
+            state.active = False
+        pool_metrics.record_wait((time.perf_counter() - started) * 1000, state.overflowed)
+        return connection
+
+    def _inc_overflow(self) -> bool:
+        opened = super()._inc_overflow()
+        if opened and self._overflow > 0:
+            self._checkout_state.overflowed = True
+        return opened
+
+
+def engine_options(database_url: str) -> dict:
+    """Engine options for SQLALCHEMY_ENGINE_OPTIONS, from the DB_* environment variables."""
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if DB_PGBOUNCER:
+        options["poolclass"] = NullPool
+    elif not database_url.startswith("sqlite"):
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return options
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine.pool, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        pool_metrics.count("connects")
+
+    @event.listens_for(engine.pool, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_metrics.count("checkouts")
+
+    @event.listens_for(engine.pool, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        pool_metrics.count("checkins")
+
+    @event.listens_for(engine.pool, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        pool_metrics.count("invalidations")
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started_at"].pop()
+        pool_metrics.record_query(statement, (time.perf_counter() - started) * 1000)
+
+
+def pool_status(engine) -> dict:
+    pool = engine.pool
+    status = {"class": type(pool).__name__, "pid": os.getpid()}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,
+            timeout=pool.timeout(),
+        )
+    return status
@@ -1,40 +1,223 @@
 # Document ingestion module
-# This module is responsible for ingesting documents into the system
-# It provides a function to ingest a document and store it in the system
-# It also provides a function to retrieve a document from the system
-# It uses the document storage module to store and retrieve documents
+# This module is responsible for turning uploaded documents into text chunks
+# that can be embedded and retrieved.
+#
+# Pages are extracted in parallel by a process pool, a few pages per task, and
+# streamed into the text splitter one page at a time in page order. Only a bounded
+# window of tasks is in flight at once, so peak memory depends on the window size
+# rather than on the number of pages in the document.
+#
+# pypdf and the text splitter are imported on first use, so importing this module to
+# reach its helpers doesn't load them.
+#
+# Usage: python -m app.document_ingestion ./app/data/*.pdf [--index]
+#
+# With --index the files are synced into the vector index like uploads are, through the
+# document manifest, so only new or changed pages are embedded.
 
-# from langchain_community.document_loaders import UnstructuredPDFLoader
+import argparse
+import hashlib
+import logging
+import multiprocessing
 import os
-from langchain_community.document_loaders import PyPDFLoader, UnstructuredPDFLoader
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Sequence, Tuple
 
+from app.logs import configure_logging
 
-doc_path = "./data/Fair Credit Reporting Acts summary of rights.pdf"
-model = "llama3.2"
 
+DATA_DIR = os.getenv("DOCUMENTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+PAGES_PER_TASK = 8
 
-def load_pdf(file_path):
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Chunk:
+    source: str
+    page: int
+    index: int
+    text: str
+
+
+def count_pages(file_path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(file_path).pages)
+
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def object_digest(obj, digests: dict) -> bytes:
+    """A digest of a PDF object and everything it references.
+
+    Objects shared between pages (fonts, images) are hashed once per document, through
+    `digests`, which maps indirect object numbers to their digest.
+    """
+    from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+    if isinstance(obj, IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key not in digests:
+            # Placeholder, so an object that references itself doesn't recurse forever
+            digests[key] = b""
+            digests[key] = object_digest(obj.get_object(), digests)
+        return digests[key]
+    digest = hashlib.sha256()
+    if isinstance(obj, DictionaryObject):
+        for name in sorted(obj):
+            digest.update(name.encode())
+            digest.update(object_digest(obj.raw_get(name), digests))
+        if isinstance(obj, StreamObject):
+            digest.update(obj.get_data())
+    elif isinstance(obj, ArrayObject):
+        for item in obj:
+            digest.update(object_digest(item, digests))
+    else:
+        digest.update(repr(obj).encode())
+    return digest.digest()
+
+
+def page_hashes(file_path: str) -> List[str]:
+    """Hash every page's content stream and the resources it draws with, without extracting any text.
+
+    The text of a page depends on its fonts (their encodings and ToUnicode maps) as much as
+    on its content stream, so a page whose fonts changed hashes differently too.
+    """
+    from pypdf import PdfReader
+
+    hashes, digests = [], {}
+    for page in PdfReader(file_path).pages:
+        contents = page.get_contents()
+        digest = hashlib.sha256(contents.get_data() if contents is not None else b"")
+        if "/Resources" in page:
+            digest.update(object_digest(page.raw_get("/Resources"), digests))
+        hashes.append(digest.hexdigest())
+    return hashes
+
+
+def extract_pages(file_path: str, numbers: List[int]) -> List[Tuple[int, str]]:
+    """Extract the text of the given pages. Runs inside a pool worker."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    return [(number, reader.pages[number].extract_text() or "") for number in numbers]
+
+
+def iter_pages(
+    file_path: str,
+    workers: Optional[int] = None,
+    pages_per_task: int = PAGES_PER_TASK,
+    pages: Optional[Sequence[int]] = None,
+) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) for every page (or only `pages`), in order, parsing pages in parallel."""
+    numbers = sorted(pages) if pages is not None else list(range(count_pages(file_path)))
+    if not numbers:
+        return
+    workers = workers or min(os.cpu_count() or 1, max(1, len(numbers) // pages_per_task))
+    tasks = deque(numbers[start:start + pages_per_task] for start in range(0, len(numbers), pages_per_task))
+
+    # Spawned workers don't inherit the server's threads, locks or database connections
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        in_flight = deque()
+        while tasks or in_flight:
+            while tasks and len(in_flight) < workers * 2:
+                in_flight.append(pool.submit(extract_pages, file_path, tasks.popleft()))
+            yield from in_flight.popleft().result()
+
+
+def iter_chunks(
+    file_path: str,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    workers: Optional[int] = None,
+    pages: Optional[Sequence[int]] = None,
+) -> Iterator[Chunk]:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    source = os.path.basename(file_path)
+    for page_number, text in iter_pages(file_path, workers=workers, pages=pages):
+        for index, piece in enumerate(splitter.split_text(text)):
+            yield Chunk(source=source, page=page_number, index=index, text=piece)
+
+
+def load_pdf(file_path: str, **kwargs) -> Optional[Iterator[Chunk]]:
     # Check if file exists
     if not os.path.exists(file_path):
-        print(f"Error: File not found at path: {file_path}")
-        print(f"Current working directory: {os.getcwd()}")
+        logger.error("File not found", extra={"path": file_path, "cwd": os.getcwd()})
+        return None
+    return iter_chunks(file_path, **kwargs)
+
+
+def ingest_pdf(file_path: str, **kwargs) -> Optional[dict]:
+    """Parse and chunk one PDF, returning a summary of what was produced."""
+    chunks = load_pdf(file_path, **kwargs)
+    if chunks is None:
         return None
-    
+
     try:
-        loader = PyPDFLoader(file_path=file_path)
-        data = loader.load()
-        print("Done loading...")
-        return data
+        pages = set()
+        chunk_count = 0
+        for chunk in chunks:
+            pages.add(chunk.page)
+            chunk_count += 1
+        return {
+            "source": os.path.basename(file_path),
+            "pages": count_pages(file_path),
+            "pages_with_text": len(pages),
+            "chunks": chunk_count,
+        }
     except Exception as e:
-        print(f"Error loading PDF: {str(e)}")
+        logger.exception("Error loading PDF")
         return None
 
-if doc_path:
-    data = load_pdf(doc_path)
-    if data:
-        # PyPDFLoader returns a list of documents, one per page
-        content = data[0].page_content
-        print("First page content:")
-        print(content[:1000])
-else:
-    print("Please provide a PDF file path")
\ No newline at end of file
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parse and chunk PDF documents.")
+    parser.add_argument("paths", nargs="+", help="PDF files to ingest")
+    parser.add_argument("--chunk-size", type=int, default=None, help=f"default: {CHUNK_SIZE}")
+    parser.add_argument("--chunk-overlap", type=int, default=None, help=f"default: {CHUNK_OVERLAP}")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument("--index", action="store_true", help="Sync the files into the vector index")
+    args = parser.parse_args(argv)
+    if args.index and (args.chunk_size, args.chunk_overlap, args.workers) != (None, None, None):
+        # The manifest assumes every indexed page was chunked the same way
+        parser.error("--chunk-size, --chunk-overlap and --workers can't be used with --index")
+    configure_logging()
+
+    if args.index:
+        from app.main import create_app, sync_document_repo
+
+        with create_app().app_context():
+            for path in args.paths:
+                summary = sync_document_repo(path)
+                if summary:
+                    print(f"{summary['source']}: {summary['status']}, {summary['pages_changed']} pages changed, "
+                          f"{summary['pages_removed']} removed, {summary['chunks']} chunks embedded")
+        return
+
+    options = {
+        "chunk_size": args.chunk_size or CHUNK_SIZE,
+        "chunk_overlap": args.chunk_overlap if args.chunk_overlap is not None else CHUNK_OVERLAP,
+        "workers": args.workers,
+    }
+    for path in args.paths:
+        summary = ingest_pdf(path, **options)
+        if summary:
+            print(f"{summary['source']}: {summary['pages']} pages, {summary['chunks']} chunks")
+
+
+if __name__ == "__main__":
+    main()
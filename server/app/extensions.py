@@ -0,0 +1,13 @@
+# Flask extensions
+# Created without an app and bound to one by `create_app` (app/main.py), so models and
+# helpers can import them without building an app or opening a database connection.
+#
+# Flask-Migrate isn't here: it pulls in Alembic, which only `flask db` needs, so
+# `create_app` sets it up when it runs under the flask command.
+
+from flask_jwt_extended import JWTManager
+from flask_sqlalchemy import SQLAlchemy
+
+
+db = SQLAlchemy()
+jwt = JWTManager()
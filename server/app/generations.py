@@ -0,0 +1,264 @@
+# Resumable generations
+# A chat reply is generated in the background, apart from the HTTP response that asked
+# for it, and the response only follows it. Every event of a generation is numbered (the
+# SSE `id:` field) and the last GENERATION_BUFFER_EVENTS of them are kept in a ring
+# buffer. A client whose connection dropped follows it again from GET /generations/<id>
+# with `Last-Event-ID`, and gets the events it missed without the reply being generated
+# again. Any number of clients can follow one generation; GET /chats/<id>/generation
+# follows a chat's latest one, for other tabs open on the chat.
+#
+# A client that fell further behind than the buffer first gets the whole reply so far,
+# as one event with `"replace": true`. A generation that nobody has followed for
+# GENERATION_ORPHAN_SECONDS is cancelled, so Ollama doesn't keep generating for nobody.
+# A finished one can be followed for GENERATION_RETENTION_SECONDS more.
+#
+# Generations live in the server process that runs them: with several workers, resuming
+# needs the load balancer to send a generation's requests to the same worker. Anywhere
+# else it is not found, and the client reloads the chat, whose reply is saved either way.
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from app.streaming import SSE_HEARTBEAT, StreamAccumulator, sse_event, sse_frame
+
+
+GENERATION_BUFFER_EVENTS = int(os.getenv("GENERATION_BUFFER_EVENTS", 1024))
+GENERATION_ORPHAN_SECONDS = float(os.getenv("GENERATION_ORPHAN_SECONDS", 30))
+GENERATION_RETENTION_SECONDS = float(os.getenv("GENERATION_RETENTION_SECONDS", 120))
+# Response header of a chat stream, naming the generation to resume
+GENERATION_HEADER = "X-Generation-Id"
+# Longest a follower goes without receiving anything
+HEARTBEAT_SECONDS = 15
+REAP_INTERVAL_SECONDS = 1
+
+
+def last_event_id(value: Optional[str]) -> int:
+    """The event number a client resumes after, from its `Last-Event-ID`."""
+    try:
+        return max(int(value or 0), 0)
+    except ValueError:
+        return 0
+
+
+class Generation:
+    """One reply being generated, with the events published for it so far."""
+
+    def __init__(self, user_id: str, chat_id: Optional[str], buffer_events: int = GENERATION_BUFFER_EVENTS):
+        self.id = uuid4().hex
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.reply = StreamAccumulator()
+        self.events = deque(maxlen=buffer_events)
+        self.last_id = 0
+        # Number of the last event that carried reply text
+        self.content_id = 0
+        self.finished_at: Optional[float] = None
+        self.cancelled = False
+        self.on_cancel: Optional[Callable[[], None]] = None
+        self.followers = 0
+        self.unfollowed_at = time.monotonic()
+        self._condition = threading.Condition()
+        self._waiters = set()
+
+    def _publish(self, data: str) -> int:
+        self.last_id += 1
+        self.events.append((self.last_id, sse_frame(data, self.last_id)))
+        self._notify()
+        return self.last_id
+
+    def _notify(self):
+        self._condition.notify_all()
+        for loop, event in list(self._waiters):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The follower's event loop is closed
+                self._waiters.discard((loop, event))
+
+    def add(self, part) -> str:
+        """Add a chunk of the Ollama stream to the reply and publish its text."""
+        with self._condition:
+            content = self.reply.add(part)
+            self.content_id = self._publish(json.dumps({"content": content}))
+        return content
+
+    def complete(self):
+        """End the generation with [DONE], once its reply is stored."""
+        self._finish("[DONE]")
+
+    def fail(self, message: str):
+        self._finish(json.dumps({"error": message}))
+
+    def close(self):
+        """End the generation without a final event, e.g. when it was cancelled."""
+        self._finish(None)
+
+    def _finish(self, data: Optional[str]):
+        with self._condition:
+            if self.finished_at is not None:
+                return
+            if data is not None:
+                self._publish(data)
+            self.finished_at = time.monotonic()
+            self._notify()
+
+    def cancel(self):
+        """Ask whatever produces the reply to stop."""
+        self.cancelled = True
+        if self.on_cancel is not None:
+            self.on_cancel()
+
+    def _frames_after(self, after: int) -> Tuple[List[str], int, bool]:
+        frames = []
+        oldest = self.events[0][0] if self.events else self.last_id + 1
+        if after + 1 < oldest:
+            # The events after `after` are gone: the reply so far replaces what the client has
+            frames.append(sse_event({"content": self.reply.content, "replace": True}, self.content_id))
+            after = self.content_id
+        frames.extend(frame for event_id, frame in self.events if event_id > after)
+        return frames, max(after, self.last_id), self.finished_at is not None
+
+    def frames_after(self, after: int) -> Tuple[List[str], int, bool]:
+        """The SSE frames of the events after event `after`, the last event number, and whether it finished."""
+        with self._condition:
+            return self._frames_after(after)
+
+    def _follow(self, waiter=None):
+        with self._condition:
+            self.followers += 1
+            if waiter is not None:
+                self._waiters.add(waiter)
+
+    def _unfollow(self, waiter=None):
+        with self._condition:
+            self.followers -= 1
+            self._waiters.discard(waiter)
+            if not self.followers:
+                self.unfollowed_at = time.monotonic()
+
+    def follow(self, after: int = 0) -> Iterator[str]:
+        """Yield the events after event `after` as they are published, until the generation ends."""
+        self._follow()
+        try:
+            while True:
+                with self._condition:
+                    if self.last_id <= after and self.finished_at is None:
+                        self._condition.wait(HEARTBEAT_SECONDS)
+                    frames, after, finished = self._frames_after(after)
+                if frames:
+                    yield "".join(frames)
+                elif not finished:
+                    yield SSE_HEARTBEAT
+                if finished:
+                    return
+        finally:
+            self._unfollow()
+
+    async def follow_async(self, after: int = 0) -> AsyncIterator[str]:
+        """Like `follow`, for a follower on an event loop."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        self._follow(waiter)
+        try:
+            while True:
+                waiter[1].clear()
+                frames, after, finished = self.frames_after(after)
+                if frames:
+                    yield "".join(frames)
+                if finished:
+                    return
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield SSE_HEARTBEAT
+        finally:
+            self._unfollow(waiter)
+
+
+class GenerationRegistry:
+    """The generations of this process, by id and by chat."""
+
+    def __init__(
+        self,
+        buffer_events: int = GENERATION_BUFFER_EVENTS,
+        orphan_seconds: float = GENERATION_ORPHAN_SECONDS,
+        retention_seconds: float = GENERATION_RETENTION_SECONDS,
+    ):
+        self.buffer_events = buffer_events
+        self.orphan_seconds = orphan_seconds
+        self.retention_seconds = retention_seconds
+        self._generations: Dict[str, Generation] = {}
+        self._chats: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._reaper_pid: Optional[int] = None
+        self.cancelled = 0
+
+    def start(self, user_id: str, chat_id: Optional[str]) -> Generation:
+        """Register a new generation. Whoever produces its reply must end it."""
+        self.start_reaper()
+        generation = Generation(user_id, chat_id, self.buffer_events)
+        with self._lock:
+            self._generations[generation.id] = generation
+            if chat_id:
+                self._chats[chat_id] = generation.id
+        return generation
+
+    def get(self, generation_id: str, user_id: str) -> Optional[Generation]:
+        generation = self._generations.get(generation_id)
+        return generation if generation is not None and generation.user_id == user_id else None
+
+    def for_chat(self, chat_id: str, user_id: str) -> Optional[Generation]:
+        """The latest generation of a chat, if it is still around."""
+        generation_id = self._chats.get(chat_id)
+        return self.get(generation_id, user_id) if generation_id else None
+
+    def reap(self):
+        """Cancel the generations nobody follows and forget the ones that finished long enough ago."""
+        now = time.monotonic()
+        with self._lock:
+            generations = list(self._generations.values())
+        for generation in generations:
+            if generation.finished_at is not None:
+                if now - generation.finished_at > self.retention_seconds:
+                    with self._lock:
+                        self._generations.pop(generation.id, None)
+                        if generation.chat_id and self._chats.get(generation.chat_id) == generation.id:
+                            del self._chats[generation.chat_id]
+            elif (
+                not generation.followers
+                and not generation.cancelled
+                and now - generation.unfollowed_at > self.orphan_seconds
+            ):
+                self.cancelled += 1
+                generation.cancel()
+
+    def start_reaper(self):
+        """Start this process' reaper thread, once per process."""
+        if self._reaper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._reaper_pid == os.getpid():
+                return
+            self._reaper_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(REAP_INTERVAL_SECONDS)
+                self.reap()
+
+        threading.Thread(target=run, name="generation-reaper", daemon=True).start()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            generations = list(self._generations.values())
+        return {
+            "active": sum(1 for generation in generations if generation.finished_at is None),
+            "retained": sum(1 for generation in generations if generation.finished_at is not None),
+            "followers": sum(generation.followers for generation in generations),
+            "cancelled": self.cancelled,
+        }
@@ -0,0 +1,392 @@
+# Background jobs
+# Work that shouldn't hold up a request (parsing and embedding uploaded documents, chat
+# summaries) is stored as a row of the `jobs` table and run by job workers, so request
+# latency doesn't depend on it and queued work survives a restart.
+#
+# - Workers claim the oldest due job with SELECT ... FOR UPDATE SKIP LOCKED, so any number
+#   of them can poll the same table without a job being handed out twice. SQLite has no
+#   row locks; there the claim is guarded by a conditional UPDATE instead.
+# - A job that raises is retried with exponential backoff and jitter (tenacity's wait
+#   strategy) until its attempts are used up, then it is marked failed. Handlers raise
+#   `PermanentJobError` for failures that retrying can't fix.
+# - A running job holds a lease, renewed by its progress reports. If its worker dies, the
+#   lease runs out and another worker picks the job up again.
+# - Enqueueing with a `dedupe_key` while a job with the same key is still queued returns
+#   the queued job instead of adding another one. A failed job that would be retried while
+#   a job with its key is queued is marked superseded instead, the queued job does its work.
+#
+# `flask run-jobs --processes N` runs a pool of worker processes. Until one is deployed,
+# every server process also runs JOB_INLINE_WORKERS worker threads (default 1), started
+# when it first enqueues a job; set it to 0 once `run-jobs` is running.
+
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, NamedTuple, Optional
+from uuid import uuid4
+
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from tenacity import RetryCallState, wait_exponential_jitter
+
+
+JOB_INLINE_WORKERS = int(os.getenv("JOB_INLINE_WORKERS", 1))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 1))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 300))
+JOB_RETRY_WAIT = wait_exponential_jitter(
+    multiplier=float(os.getenv("JOB_RETRY_INITIAL_SECONDS", 2)),
+    max=float(os.getenv("JOB_RETRY_MAX_SECONDS", 300)),
+)
+# Progress is written at most this often; every write also renews the lease
+PROGRESS_INTERVAL = 1.0
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, SUPERSEDED = "queued", "running", "succeeded", "failed", "superseded"
+
+logger = logging.getLogger(__name__)
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying the job would fail the same way."""
+
+
+class JobHandler(NamedTuple):
+    run: Callable
+    max_attempts: int
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def retry_delay(attempt: int) -> float:
+    """Seconds to wait before running a job again after its `attempt`-th failure."""
+    state = RetryCallState(retry_object=None, fn=None, args=(), kwargs={})
+    state.attempt_number = attempt
+    return JOB_RETRY_WAIT(state)
+
+
+class JobProgress:
+    """Passed to handlers as `progress(fraction, message=None)`."""
+
+    def __init__(self, queue: "JobQueue", job_id: str, worker_id: str):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self._reported_at = 0.0
+
+    def __call__(self, fraction: float, message: Optional[str] = None):
+        now = time.monotonic()
+        if now - self._reported_at < PROGRESS_INTERVAL:
+            return
+        self._reported_at = now
+        try:
+            self.queue.update(
+                self.job_id,
+                self.worker_id,
+                progress=min(max(fraction, 0.0), 1.0),
+                progress_message=message,
+                locked_at=utcnow(),
+            )
+        except Exception:
+            logger.exception("Error reporting job progress")
+
+
+class JobQueue:
+    def __init__(self, db, model, inline_workers: int = JOB_INLINE_WORKERS):
+        self.app = None
+        self.db = db
+        self.table = model.__table__
+        self.inline_workers = inline_workers
+        self.handlers: Dict[str, JobHandler] = {}
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._inline_pid: Optional[int] = None
+
+    def init_app(self, app):
+        """Run jobs against `app`'s database and inside its app context."""
+        self.app = app
+        app.extensions["jobs"] = self
+
+    @property
+    def engine(self):
+        with self.app.app_context():
+            return self.db.engine
+
+    def handler(self, kind: str, max_attempts: int = JOB_MAX_ATTEMPTS):
+        """Register `run(payload, progress)` for jobs of `kind`. Its return value is stored as the result."""
+        def register(run):
+            self.handlers[kind] = JobHandler(run, max_attempts)
+            return run
+        return register
+
+    def enqueue(self, kind: str, payload: dict, user_id: Optional[str] = None, dedupe_key: Optional[str] = None) -> str:
+        """Store a job and return its id, or the id of the queued job with the same `dedupe_key`."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = utcnow()
+        row = {
+            "id": str(uuid4()),
+            "kind": kind,
+            "status": QUEUED,
+            "payload": payload,
+            "user_id": user_id,
+            "dedupe_key": dedupe_key,
+            "attempts": 0,
+            "max_attempts": self.handlers[kind].max_attempts,
+            "progress": 0.0,
+            "run_at": now,
+            "created_at": now,
+        }
+        table = self.table
+        with self.engine.begin() as connection:
+            dialect = connection.dialect.name
+            if dedupe_key and dialect in ("postgresql", "sqlite"):
+                statement = (postgresql.insert if dialect == "postgresql" else sqlite.insert)(table).values(row)
+                statement = statement.on_conflict_do_nothing(
+                    index_elements=[table.c.dedupe_key],
+                    index_where=table.c.status == QUEUED,
+                )
+            else:
+                statement = insert(table).values(row)
+            job_id = row["id"]
+            if not connection.execute(statement).rowcount:
+                queued = connection.execute(
+                    select(table.c.id).where(and_(table.c.dedupe_key == dedupe_key, table.c.status == QUEUED))
+                ).scalar()
+                if queued is not None:
+                    job_id = queued
+                else:
+                    # The queued job was claimed in the meantime
+                    connection.execute(insert(table).values(row))
+
+        self.start_inline_workers()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.engine.connect() as connection:
+            row = connection.execute(select(self.table).where(self.table.c.id == job_id)).mappings().first()
+        return dict(row) if row else None
+
+    def update(self, job_id: str, worker_id: str, **values) -> bool:
+        """Update a running job, unless its lease was taken over by another worker."""
+        table = self.table
+        with self.engine.begin() as connection:
+            updated = connection.execute(
+                update(table)
+                .where(and_(table.c.id == job_id, table.c.locked_by == worker_id, table.c.status == RUNNING))
+                .values(**values)
+            ).rowcount
+        return updated == 1
+
+    def queued_duplicate(self, job: dict) -> Optional[str]:
+        """The id of another queued job with `job`'s dedupe key, if there is one."""
+        if not job.get("dedupe_key"):
+            return None
+        table = self.table
+        with self.engine.connect() as connection:
+            return connection.execute(
+                select(table.c.id).where(
+                    and_(table.c.dedupe_key == job["dedupe_key"], table.c.status == QUEUED, table.c.id != job["id"])
+                )
+            ).scalar()
+
+    def claim(self, worker_id: str) -> Optional[dict]:
+        """Lease the oldest due job to `worker_id`, or return None when there is nothing to do."""
+        table = self.table
+        now = utcnow()
+        due = or_(
+            and_(table.c.status == QUEUED, table.c.run_at <= now),
+            # Its worker stopped renewing the lease, most likely it died
+            and_(table.c.status == RUNNING, table.c.locked_at < now - timedelta(seconds=JOB_LEASE_SECONDS)),
+        )
+        with self.engine.begin() as connection:
+            job_id = connection.execute(
+                select(table.c.id).where(due).order_by(table.c.run_at).limit(1).with_for_update(skip_locked=True)
+            ).scalar()
+            if job_id is None:
+                return None
+            job = connection.execute(
+                update(table)
+                .where(and_(table.c.id == job_id, due))
+                .values(
+                    status=RUNNING,
+                    attempts=table.c.attempts + 1,
+                    locked_by=worker_id,
+                    locked_at=now,
+                    started_at=func.coalesce(table.c.started_at, now),
+                )
+                .returning(*table.c)
+            ).mappings().first()
+        return dict(job) if job else None
+
+    def run(self, job: dict, worker_id: str):
+        handler = self.handlers.get(job["kind"])
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise PermanentJobError(f"No handler for job kind {job['kind']}")
+            if job["attempts"] > job["max_attempts"]:
+                raise PermanentJobError("Gave up after the workers running it stopped")
+            with self.app.app_context():
+                result = handler.run(job["payload"] or {}, JobProgress(self, job["id"], worker_id))
+        except Exception as e:
+            self.fail(job, worker_id, e)
+        else:
+            self.update(
+                job["id"],
+                worker_id,
+                status=SUCCEEDED,
+                result=result,
+                error=None,
+                progress=1.0,
+                finished_at=utcnow(),
+                locked_by=None,
+                locked_at=None,
+            )
+            logger.info(
+                "job succeeded",
+                extra={"job_id": job["id"], "kind": job["kind"], "attempt": job["attempts"],
+                       "duration_ms": round((time.perf_counter() - started) * 1000, 2)},
+            )
+
+    def fail(self, job: dict, worker_id: str, error: Exception):
+        log = {"job_id": job["id"], "kind": job["kind"], "attempt": job["attempts"]}
+        if not isinstance(error, PermanentJobError) and job["attempts"] < job["max_attempts"]:
+            # Only one job per key may be queued, a retry would break the unique index
+            duplicate = self.queued_duplicate(job)
+            if duplicate is None:
+                delay = retry_delay(job["attempts"])
+                logger.warning("job failed, retrying", exc_info=error, extra={**log, "retry_in_s": round(delay, 1)})
+                try:
+                    self.update(
+                        job["id"],
+                        worker_id,
+                        status=QUEUED,
+                        error=str(error),
+                        run_at=utcnow() + timedelta(seconds=delay),
+                        locked_by=None,
+                        locked_at=None,
+                    )
+                    return
+                except IntegrityError:
+                    # A job with the same key was queued in the meantime
+                    duplicate = self.queued_duplicate(job)
+            logger.info("job failed, superseded by a queued job", extra={**log, "superseded_by": duplicate})
+            self.update(
+                job["id"],
+                worker_id,
+                status=SUPERSEDED,
+                result={"superseded_by": duplicate},
+                error=str(error),
+                finished_at=utcnow(),
+                locked_by=None,
+                locked_at=None,
+            )
+        else:
+            logger.error("job failed", exc_info=error, extra=log)
+            self.update(
+                job["id"],
+                worker_id,
+                status=FAILED,
+                error=str(error),
+                finished_at=utcnow(),
+                locked_by=None,
+                locked_at=None,
+            )
+
+    def work(self, worker_id: str, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                job = self.claim(worker_id)
+            except Exception:
+                logger.exception("Error claiming a job")
+                job = None
+            if job is None:
+                self._wake.wait(JOB_POLL_SECONDS)
+                self._wake.clear()
+                continue
+            try:
+                self.run(job, worker_id)
+            except Exception:
+                # The job couldn't be marked done or failed, its lease runs out and it is retried
+                logger.exception("Error finishing a job", extra={"job_id": job["id"], "kind": job["kind"]})
+
+    def start_inline_workers(self):
+        """Start this process' worker threads, once per process (a forked process doesn't inherit its parent's threads)."""
+        if self.inline_workers <= 0 or self._inline_pid == os.getpid():
+            return
+        with self._lock:
+            if self._inline_pid == os.getpid():
+                return
+            self._inline_pid = os.getpid()
+            stop = threading.Event()
+            for number in range(self.inline_workers):
+                worker_id = f"{socket.gethostname()}:{os.getpid()}:inline-{number}"
+                threading.Thread(target=self.work, args=(worker_id, stop), name=f"job-worker-{number}", daemon=True).start()
+
+    def serve(self, threads: int = 1):
+        """Run `threads` workers in this process until SIGINT or SIGTERM, finishing the jobs in hand."""
+        # Connections inherited from a parent process must not be used by both
+        self.engine.dispose(close=False)
+        stop = threading.Event()
+
+        def shutdown(signum, frame):
+            stop.set()
+            self._wake.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        workers = [
+            threading.Thread(target=self.work, args=(f"{socket.gethostname()}:{os.getpid()}:{number}", stop),
+                             name=f"job-worker-{number}")
+            for number in range(threads)
+        ]
+        for worker in workers:
+            worker.start()
+        logger.info("job workers started", extra={"threads": threads})
+        # Joining with a timeout keeps the main thread responsive to signals
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=0.5)
+
+    def run_workers(self, processes: int = 1, threads: int = 1, preload: Optional[Callable] = None):
+        """Run a pool of `processes` worker processes with `threads` workers each, in the foreground.
+
+        `preload()`, if given, runs once before the workers start. Whatever it imports is
+        then shared by the forked workers instead of being loaded by each of them.
+        """
+        if preload is not None:
+            preload()
+        if processes <= 1:
+            self.serve(threads)
+            return
+        # Keep the collector from writing to the objects loaded so far, so the pages
+        # holding them stay shared with the children instead of being copied on write
+        gc.freeze()
+        context = multiprocessing.get_context("fork")
+        children = [
+            context.Process(target=self.serve, args=(threads,), name=f"job-worker-{number}")
+            for number in range(processes)
+        ]
+        for child in children:
+            child.start()
+
+        def forward(signum, frame):
+            for child in children:
+                if child.is_alive():
+                    os.kill(child.pid, signal.SIGTERM)
+
+        # Ctrl-C reaches the children directly, a SIGTERM to the parent is passed on
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for child in children:
+            child.join()
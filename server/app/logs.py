@@ -0,0 +1,50 @@
+# Structured logging
+# Log records are written to stderr as one JSON object per line, so they can be shipped
+# and queried without parsing free text. Anything passed through `extra=` ends up as a
+# top-level field:
+#
+#     logger.info("request", extra={"route": "/chats", "duration_ms": 12.5})
+#
+# The level is set with LOG_LEVEL (default INFO).
+
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Attributes every LogRecord has, anything else was passed in `extra`
+RESERVED_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["error"] = str(record.exc_info[1])
+            entry["traceback"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = LOG_LEVEL):
+    root = logging.getLogger()
+    if any(isinstance(handler.formatter, JSONFormatter) for handler in root.handlers):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter())
+    root.addHandler(handler)
+    root.setLevel(level)
+    # The Ollama client logs every HTTP request it makes
+    logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -1,164 +1,589 @@
+from collections import Counter
+from contextlib import closing
 from datetime import datetime, timedelta, timezone
-from operator import index
-from optparse import Option
+import importlib
+import io
+import logging
 import os
-from re import L
-from typing import Collection, Optional, List
+import threading
+import time
+from typing import Optional, List
 from uuid import uuid4
-from xml.dom import ValidationErr
-from flask import Flask, jsonify, request, Response
+from flask import Blueprint, Flask, current_app, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from flask_sqlalchemy import SQLAlchemy
-from pydantic import BaseModel
-from flask_migrate import Migrate
-import ollama
+from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
+from pydantic import BaseModel, ValidationError
+import click
 import json
-from pydantic import BaseModel
-from sqlalchemy import and_
-from sqlalchemy.orm import joinedload
-from flask import jsonify
-
-
-from sqlalchemy import JSON, DateTime
-
-# Flask app initialization
-app = Flask(__name__)
-CORS(app)
-
-# Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = os.getenv("JWT_SECRET_KEY")
-app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
-
-# Verify that the keys are set
-if not app.config['JWT_SECRET_KEY']:
-    raise RuntimeError("JWT_SECRET_KEY is not set. Please set it as an environment variable.")
-if not app.config['SECRET_KEY']:
-    print("Warning: SECRET_KEY is not set. It's recommended to set it for enhanced security.")
-
-# check if database exist
-if not app.config['SQLALCHEMY_DATABASE_URI']:
-    raise RuntimeError("DATABASE_URL is not set. Please set it as an environment variable.")
-
-# check if database org_pedia is created
-
-# Extensions initialization
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-jwt = JWTManager(app)
-
-# Models
-class User(db.Model):
-    __tablename__ = "users"
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
-    display_name = db.Column(db.String, index=True)
-    user_google_id = db.Column(db.String)
-    email = db.Column(db.String, unique=True, index=True)
-    photo_url = db.Column(db.String)
-    access_token = db.Column(db.String)
-
-    def __init__(self, user_google_id=None, display_name=None, email=None, photo_url=None, access_token=None):
-        self.user_google_id = user_google_id
-        self.display_name = display_name
-        self.email = email
-        self.photo_url = photo_url
-        self.access_token = access_token
-
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "email": self.email,
-            "photo_url": self.photo_url,
-            "display_name": self.display_name,
-            "access_token": self.access_token,
-            "user_google_id": self.user_google_id,
-        }
+import base64
+from sqlalchemy import and_, bindparam, func, literal_column, or_, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+from app.cache import CACHE_TTL_SECONDS, LRUCache, TieredCache, backend_from_env
+from app.database import engine_options, instrument_engine, pool_metrics, pool_status
+from app import metrics
+from app.context import SUMMARY_MAX_TOKENS, build_context, summary_prompt
+from app.document_ingestion import DATA_DIR, file_hash, iter_chunks, page_hashes
+from app.extensions import db, jwt
+from app.generations import GENERATION_HEADER, Generation, GenerationRegistry, last_event_id
+from app.jobs import QUEUED, JobQueue, PermanentJobError
+from app.logs import configure_logging
+from app.models import Chat, ChatMessage, DocumentFile, DocumentPage, Job, User
+from app.replies import ChatReplies
+from app.response_cache import RESPONSE_CACHE_ENABLED, ResponseCache
+from app.retrieval import (
+    INDEX_DIR, RETRIEVAL_ENABLED, augment_messages, cache_stats, current_index_version, embed_query, get_embedder,
+    get_index,
+)
+from app.routing import ModelRouter, default_routes, routes_from_env
+from app.scheduler import InferenceScheduler, SchedulerBusy, prompt_size
+from app import search, transfer
+from app.streaming import SSE_HEADERS, StreamAccumulator
+from app.titles import NEW_CHAT_TITLE, TITLE_BATCH_SIZE, TITLE_CONTEXT_TURNS, TITLE_MAX_TOKENS, clean_title, fallback_title, title_prompt
+
+logger = logging.getLogger(__name__)
+
+# Sidebar listing
+CHATS_PAGE_SIZE = int(os.getenv("CHATS_PAGE_SIZE", 20))
+CHATS_MAX_PAGE_SIZE = 100
+CHAT_PREVIEW_LENGTH = 120
+# Transcript rows fetched per round trip when streaming GET /chats/<id>
+TRANSCRIPT_BATCH_SIZE = int(os.getenv("TRANSCRIPT_BATCH_SIZE", 500))
+# Longer transcripts are streamed from the database on every read rather than cached
+CHAT_CACHE_MAX_CHARS = int(os.getenv("CHAT_CACHE_MAX_CHARS", 128 * 1024))
+
+# Chat generation
+CHAT_MODEL = os.getenv("CHAT_MODEL", "llama3.2")
+CHAT_MAX_TOKENS = int(os.getenv("CHAT_MAX_TOKENS", 2000))
+CHAT_OPTIONS = {"temperature": 0.9, "num_predict": CHAT_MAX_TOKENS}
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", CHAT_MODEL)
+TITLE_MODEL = os.getenv("TITLE_MODEL", CHAT_MODEL)
+
+# Load the models when a server worker starts rather than on its first request, see preload_models
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "true").lower() == "true"
+# Libraries `flask run-jobs` imports once before forking its workers, see import_job_modules
+JOB_MODULES = ("ollama", "pypdf", "langchain_text_splitters", "fastembed", "chromadb")
+
+# Which model serves each generation, see app/routing.py
+model_router = ModelRouter(
+    routes_from_env(default_routes({"chat": CHAT_MODEL, "summary": SUMMARY_MODEL, "title": TITLE_MODEL})),
+    task_options={
+        "chat": CHAT_OPTIONS,
+        "summary": {"temperature": 0.2, "num_predict": SUMMARY_MAX_TOKENS},
+        "title": {"temperature": 0.2, "num_predict": TITLE_MAX_TOKENS},
+    },
+)
+
+# Admission control in front of Ollama, see app/scheduler.py
+inference_scheduler = InferenceScheduler(
+    max_concurrency=int(os.getenv("INFERENCE_MAX_CONCURRENCY", os.getenv("OLLAMA_NUM_PARALLEL", 2))),
+    max_queue_depth=int(os.getenv("INFERENCE_MAX_QUEUE_DEPTH", 64)),
+    max_queue_per_user=int(os.getenv("INFERENCE_MAX_QUEUE_PER_USER", 4)),
+    max_wait=float(os.getenv("INFERENCE_MAX_WAIT_SECONDS", 30)),
+    short_prompt_chars=int(os.getenv("INFERENCE_SHORT_PROMPT_CHARS", 2000)),
+)
+
+# Chat replies being generated, see app/generations.py
+generations = GenerationRegistry()
+
+# Profiles served by /me, refreshed whenever a sign-in changes them
+profile_cache = TieredCache(
+    "profile",
+    max_entries=int(os.getenv("PROFILE_CACHE_SIZE", 4096)),
+    ttl=CACHE_TTL_SECONDS,
+    backend=backend_from_env(),
+)
+
+# Transcripts of recently active chats, served to POST /chats/<id>/turns
+chat_history_cache = LRUCache(max_entries=int(os.getenv("CHAT_HISTORY_CACHE_SIZE", 256)))
 
+# Transcripts served by GET /chats/<id>, by user and chat. An entry is only served while
+# its version is the chat's current one, so a write in another worker can't make it stale.
+chat_cache = TieredCache(
+    "chat",
+    max_entries=int(os.getenv("CHAT_CACHE_SIZE", 256)),
+    ttl=CACHE_TTL_SECONDS,
+    backend=backend_from_env(),
+)
 
+# Transcript versions served by GET /chats/<id>, so revalidating a transcript the client
+# already has costs no query. Every write publishes the new version after its commit.
+# Versions are only kept in the shared backend, where every worker sees every write, so
+# without one they are read from the database.
+chat_version_backend = backend_from_env()
+chat_version_cache = TieredCache(
+    "chat_version",
+    max_entries=int(os.getenv("CHAT_VERSION_CACHE_SIZE", 4096)),
+    ttl=CACHE_TTL_SECONDS,
+    backend=chat_version_backend,
+    keep_local=False,
+) if chat_version_backend is not None else None
+
+# Opt-in replay of earlier replies to (nearly) identical prompts, see app/response_cache.py
+response_cache = ResponseCache(embed=embed_query) if RESPONSE_CACHE_ENABLED else None
+
+# Document ingestion, chat summaries and titles run as background jobs, see app/jobs.py
+job_queue = JobQueue(db, Job)
+
+# Routes and CLI commands, registered on the app by create_app
+api = Blueprint("api", __name__, cli_group=None)
+
+# Pydantic models
 # Define a Pydantic model for the incoming user data
 class GoogleUserModel(BaseModel):
     user_google_id: str
     display_name: str
     email: str
     photo_url: str
-    access_token: str
-
-class Chat(db.Model):
-    __tablename__ = "chat_history"
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
-    title = db.Column(db.String, index=True, nullable=False)
-    messages = db.Column(JSON)
-    created_at = db.Column(DateTime, index=True, default=lambda: datetime.now(timezone.utc))
-    
-    def __repr__(self):
-        return f"Message(id={self.id}, id={self.id}, title={self.title} messages='{str(self.messages)[:20]}...')"
-    
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "user_id": self.user_id,
-            "title": self.title,
-            "messages": self.messages,
-        }
+    # Sent by the client but never stored: the server doesn't call Google APIs on the user's behalf
+    access_token: Optional[str] = None
 
-# Pydantic models
 class ChatCreate(BaseModel):
     messages: list = []
 
+class ChatMessageIn(BaseModel):
+    role: str
+    content: str = ""
+
 # Helper functions
-def generate_jwt(user: User) -> str:
-    return create_access_token(
-        identity=user.id,
-        additional_claims={
-            "display_name": user.display_name,
-            "email": user.email,
-            "photo_url": user.photo_url,
-            "id": user.id,
-            "access_token": user.access_token,
-        },
-        expires_delta=timedelta(hours=45),
-    )
+PROFILE_FIELDS = ("user_google_id", "display_name", "photo_url")
+
+def generate_jwt(user_id: str) -> str:
+    return create_access_token(identity=user_id)
+
+def generate_refresh_token(user_id: str) -> str:
+    return create_refresh_token(identity=user_id)
     
 # Helper functions
-def update_user_repo(user, user_data):
-    user.user_google_id = user_data.user_google_id
-    user.display_name = user_data.display_name
-    user.photo_url = user_data.photo_url
-    user.access_token = user_data.access_token
-    db.session.commit()
-    
-def create_user_repo(user_data):
-    new_user = User(
-        user_google_id=user_data.user_google_id,
-        display_name=user_data.display_name,
-        email=user_data.email,
-        photo_url=user_data.photo_url,
-        access_token=user_data.access_token
-    )
-    db.session.add(new_user)
+def upsert_user_repo(user_data: GoogleUserModel) -> dict:
+    """Create or update the user signing in and return their profile.
+
+    A sign-in whose profile matches the cached one doesn't touch the database. Otherwise
+    it's a single INSERT ... ON CONFLICT (email) DO UPDATE that only rewrites the row
+    when one of the profile fields actually changed.
+    """
+    profile = {field: getattr(user_data, field) for field in PROFILE_FIELDS}
+    cached = profile_cache.get(f"email:{user_data.email}")
+    if cached is not None and all(cached.get(field) == value for field, value in profile.items()):
+        return cached
+
+    insert = postgresql.insert if db.engine.dialect.name == "postgresql" else sqlite.insert
+    statement = insert(User).values(id=str(uuid4()), email=user_data.email, **profile)
+    statement = statement.on_conflict_do_update(
+        index_elements=[User.email],
+        set_={field: statement.excluded[field] for field in PROFILE_FIELDS},
+        where=or_(*(getattr(User, field).is_distinct_from(statement.excluded[field]) for field in PROFILE_FIELDS)),
+    ).returning(User.id)
+
+    user_id = db.session.execute(statement).scalar()
     db.session.commit()
-    return new_user
+    if user_id is None:
+        # Nothing changed, so the conditional update returned no row
+        user_id = db.session.query(User.id).filter(User.email == user_data.email).scalar()
+
+    user = {"id": user_id, "email": user_data.email, **profile}
+    profile_cache.set(f"email:{user_data.email}", user)
+    profile_cache.set(f"id:{user_id}", user)
+    return user
 
-def update_chat_title(chat_id:str, title:str):
+def get_user_profile_repo(user_id: str) -> Optional[dict]:
+    user = profile_cache.get(f"id:{user_id}")
+    if user is None:
+        row = db.session.get(User, user_id)
+        if row is None:
+            return None
+        user = row.to_dict()
+        profile_cache.set(f"id:{user_id}", user)
+    return user
+
+def get_untitled_chats_repo(limit: int = TITLE_BATCH_SIZE) -> List[tuple]:
+    """Chats that still have the placeholder title and already got a reply, with their opening turns."""
+    has_reply = select(ChatMessage.id).where(
+        and_(
+            ChatMessage.chat_id == Chat.id,
+            ChatMessage.role == "assistant"
+        )
+    ).exists()
+    chats = db.session.query(Chat.id, Chat.user_id).filter(
+        and_(
+            Chat.title == NEW_CHAT_TITLE,
+            has_reply
+        )
+    ).order_by(Chat.created_at).limit(limit).all()
+    if not chats:
+        return []
+
+    turns = {chat.id: [] for chat in chats}
+    rows = db.session.query(ChatMessage.chat_id, ChatMessage.role, ChatMessage.content).filter(
+        and_(
+            ChatMessage.chat_id.in_(turns),
+            ChatMessage.role.in_(("user", "assistant"))
+        )
+    ).order_by(ChatMessage.chat_id, ChatMessage.seq)
+    for row in rows:
+        if len(turns[row.chat_id]) < TITLE_CONTEXT_TURNS:
+            turns[row.chat_id].append({"role": row.role, "content": row.content})
+    return [(chat.id, chat.user_id, turns[chat.id]) for chat in chats]
+
+def update_chat_titles_repo(titles: dict) -> int:
+    """Write generated titles with one UPDATE of the title column per chat, in a single round trip.
+
+    Chats the user renamed in the meantime are left alone.
+    """
     try:
-        chat = db.session.query(Chat).where(Chat.id == chat_id)
-        
-        return chat.to_dict()
+        table = Chat.__table__
+        result = db.session.execute(
+            update(table)
+            .where(and_(table.c.id == bindparam("chat_id"), table.c.title == NEW_CHAT_TITLE))
+            .values(title=bindparam("new_title")),
+            [{"chat_id": chat_id, "new_title": title} for chat_id, title in titles.items()],
+        )
+        db.session.commit()
+        return result.rowcount
+    except Exception as e:
+        logger.exception("Error updating chat titles")
+        db.session.rollback()
+        return 0
+
+def count_chat_messages_repo(chat_id: str) -> int:
+    # Served from the (chat_id, seq) unique index, so it never touches message bodies
+    last_seq = db.session.query(func.max(ChatMessage.seq)).filter(ChatMessage.chat_id == chat_id).scalar()
+    return 0 if last_seq is None else last_seq + 1
+
+def bump_chat_version(chat_id: str) -> int:
+    """Give a chat's transcript a new version, in the transaction that changes it, and
+    return it. Pass it to `chat_changed` once the transaction is committed."""
+    return db.session.execute(
+        update(Chat).where(Chat.id == chat_id).values(version=Chat.version + 1).returning(Chat.version)
+    ).scalar_one()
+
+def chat_cache_key(chat_id: str, user_id: str) -> str:
+    return f"{user_id}:{chat_id}"
+
+def chat_changed(chat_id: str, user_id: str, version: int):
+    """Drop the cached transcript of a chat and publish its new version."""
+    key = chat_cache_key(chat_id, user_id)
+    chat_cache.delete(key)
+    if chat_version_cache is not None:
+        chat_version_cache.set(key, version)
+
+def insert_chat_messages(rows: list, on_conflict_set: tuple = ()):
+    """Insert chat_messages rows, leaving any (chat_id, seq) that is already stored alone.
+
+    A streamed turn is stored by the server while the client may be saving the same
+    transcript, so both writers can race for the same positions. `on_conflict_set` columns
+    are copied onto a stored row that has the same role and content.
+    """
+    insert = postgresql.insert if db.engine.dialect.name == "postgresql" else sqlite.insert
+    statement = insert(ChatMessage).values(rows)
+    if on_conflict_set:
+        statement = statement.on_conflict_do_update(
+            index_elements=[ChatMessage.chat_id, ChatMessage.seq],
+            set_={column: statement.excluded[column] for column in on_conflict_set},
+            where=and_(
+                ChatMessage.role == statement.excluded.role,
+                ChatMessage.content == statement.excluded.content
+            ),
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=[ChatMessage.chat_id, ChatMessage.seq])
+    db.session.execute(statement)
+
+def add_chat_messages(chat_id: str, messages: list, start_seq: int) -> int:
+    rows = []
+    for offset, message in enumerate(messages):
+        turn = ChatMessageIn(**message)
+        rows.append({"chat_id": chat_id, "seq": start_seq + offset, "role": turn.role, "content": turn.content})
+    if rows:
+        insert_chat_messages(rows)
+    return start_seq + len(rows)
+
+def append_chat_messages_repo(chat_id: str, user_id: str, messages: list) -> Optional[int]:
+    """Append `messages` to the end of a chat and return the new message count."""
+    try:
+        owned = db.session.query(Chat.id).filter(
+            and_(
+                Chat.id == chat_id,
+                Chat.user_id == user_id
+            )
+        ).first()
+        if not owned:
+            return None
+
+        message_count = add_chat_messages(chat_id, messages, count_chat_messages_repo(chat_id))
+        version = bump_chat_version(chat_id)
+        db.session.commit()
+        chat_changed(chat_id, user_id, version)
+        return message_count
     except Exception as e:
+        logger.exception("Error appending chat messages")
+        db.session.rollback()
         return None
-    
-    
+
+def load_chat_history_repo(chat_id: str, user_id: str) -> Optional[list]:
+    """The stored transcript of a chat, or None if the user doesn't own it.
+
+    Transcripts are cached per process under the chat's version, which every write to its
+    messages bumps (in this or another worker). While it is current a turn costs one small
+    query however long the chat is, otherwise the whole transcript is read again.
+    """
+    version = db.session.query(Chat.version).filter(
+        and_(
+            Chat.id == chat_id,
+            Chat.user_id == user_id
+        )
+    ).scalar()
+    if version is None:
+        return None
+
+    cached = chat_history_cache.get(chat_id)
+    if cached is not None and cached["version"] == version:
+        return list(cached["messages"])
+
+    stored = db.session.query(ChatMessage.role, ChatMessage.content).filter(
+        ChatMessage.chat_id == chat_id
+    ).order_by(ChatMessage.seq).all()
+    messages = [{"role": row.role, "content": row.content} for row in stored]
+    chat_history_cache.set(chat_id, {"messages": messages, "version": version})
+    return list(messages)
+
+def persist_chat_turn_repo(chat_id: str, user_id: str, messages: list, reply: StreamAccumulator) -> Optional[int]:
+    """Store the turns of a finished generation in one write.
+
+    `messages` is the transcript the reply was generated from; whatever part of it isn't
+    stored yet (normally the new user turn) is written together with the assistant turn.
+    Like a saved transcript, it replaces the stored turns from the first one it disagrees with.
+    """
+    try:
+        chat = db.session.query(Chat).filter(
+            and_(
+                Chat.id == chat_id,
+                Chat.user_id == user_id
+            )
+        ).first()
+        if not chat:
+            return None
+        untitled = chat.title == NEW_CHAT_TITLE
+
+        history = load_chat_history_repo(chat_id, user_id)
+        keep = first_difference(history, messages)
+        stored = len(history)
+        if keep < min(stored, len(messages)):
+            db.session.query(ChatMessage).filter(
+                and_(ChatMessage.chat_id == chat_id, ChatMessage.seq >= keep)
+            ).delete(synchronize_session=False)
+            chat_history_cache.delete(chat_id)
+            if keep < chat.summary_upto:
+                # The summary covers turns that are gone
+                chat.summary, chat.summary_upto = None, 0
+            stored = keep
+        add_chat_messages(chat_id, messages[keep:], keep)
+        stored = max(stored, len(messages))
+        # The reply directly follows the transcript it was generated from. If the client
+        # already saved it there, only the generation stats are added to that row. Any other
+        # turn stored there since is left alone and the reply goes to the end of the chat.
+        seq = len(messages)
+        if stored > seq:
+            saved = db.session.query(ChatMessage.role, ChatMessage.content).filter(
+                and_(
+                    ChatMessage.chat_id == chat_id,
+                    ChatMessage.seq == seq
+                )
+            ).first()
+            if saved is None or saved.role != "assistant" or saved.content != reply.content:
+                seq = stored
+        insert_chat_messages(
+            [{
+                "chat_id": chat_id,
+                "seq": seq,
+                "role": "assistant",
+                "content": reply.content,
+                "prompt_tokens": reply.prompt_tokens,
+                "completion_tokens": reply.completion_tokens,
+                "latency_ms": reply.latency_ms,
+            }],
+            on_conflict_set=("prompt_tokens", "completion_tokens", "latency_ms"),
+        )
+        version = bump_chat_version(chat_id)
+        db.session.commit()
+        chat_changed(chat_id, user_id, version)
+        if untitled:
+            submit_title_generation()
+        return max(stored, seq + 1)
+    except Exception as e:
+        logger.exception("Error persisting chat turn")
+        db.session.rollback()
+        return None
+
+def persist_chat_turn(app: Flask, chat_id: str, user_id: str, messages: list, reply: StreamAccumulator):
+    with app.app_context():
+        persist_chat_turn_repo(chat_id, user_id, messages, reply)
+
+def get_chat_summary_repo(chat_id: str, user_id: str) -> tuple:
+    row = db.session.query(Chat.summary, Chat.summary_upto).filter(
+        and_(
+            Chat.id == chat_id,
+            Chat.user_id == user_id
+        )
+    ).first()
+    return (row.summary, row.summary_upto) if row else (None, 0)
+
+def update_chat_summary_repo(chat_id: str, summary: str, summary_upto: int, previous_upto: int) -> bool:
+    """Store a new summary, unless another one was stored since `previous_upto` was read."""
+    try:
+        updated = db.session.query(Chat).filter(
+            and_(
+                Chat.id == chat_id,
+                Chat.summary_upto == previous_upto
+            )
+        ).update({"summary": summary, "summary_upto": summary_upto}, synchronize_session=False)
+        db.session.commit()
+        return updated == 1
+    except Exception as e:
+        logger.exception("Error updating chat summary")
+        db.session.rollback()
+        return False
+
+def generate_text(task: str, prompt: list, user_id: str) -> str:
+    """Generate a whole reply to `prompt` on the model routed for `task`, queued as `user_id`."""
+    import ollama
+
+    ticket = inference_scheduler.acquire(user_id, prompt_size(prompt))
+    choice = model_router.route(task, prompt)
+    reply = StreamAccumulator()
+    failed = False
+    try:
+        reply.add(ollama.chat(model=choice.model, messages=prompt, options=choice.options, keep_alive=choice.keep_alive))
+    except Exception:
+        failed = True
+        raise
+    finally:
+        inference_scheduler.release(ticket)
+        model_router.observe(choice, reply, failed)
+    return reply.content
+
+@job_queue.handler("summarize_chat", max_attempts=3)
+def summarize_chat(payload: dict, progress) -> dict:
+    """Fold the turns that fell out of a chat's context window into its summary."""
+    chat_id, user_id = payload["chat_id"], payload["user_id"]
+    messages = load_chat_history_repo(chat_id, user_id)
+    if messages is None:
+        raise PermanentJobError("Chat not found")
+    summary, summary_upto = get_chat_summary_repo(chat_id, user_id)
+    # Worked out again from the stored transcript, an earlier job may have done it already
+    window = build_context(messages, summary, summary_upto)
+    if not window.needs_summary:
+        return {"summary_upto": summary_upto}
+
+    # Summaries queue for Ollama like any other generation, as the user who caused them.
+    # A busy scheduler fails the job, which is then retried later.
+    summary = generate_text("summary", summary_prompt(summary, window.unsummarized), user_id)
+    update_chat_summary_repo(chat_id, summary.strip(), window.summarize_upto, summary_upto)
+    return {"summary_upto": window.summarize_upto}
+
+def submit_chat_summary(chat_id: str, user_id: str):
+    # The key keeps a burst of turns from queueing the same chat's summary twice
+    try:
+        job_queue.enqueue("summarize_chat", {"chat_id": chat_id, "user_id": user_id},
+                          user_id=user_id, dedupe_key=f"summarize_chat:{chat_id}")
+    except Exception as e:
+        logger.exception("Error queueing chat summary")
+
+def generate_title(turns: list, user_id: str) -> str:
+    return clean_title(generate_text("title", title_prompt(turns), user_id)) or fallback_title(turns)
+
+@job_queue.handler("generate_titles", max_attempts=3)
+def generate_titles(payload: dict, progress) -> dict:
+    """Title every chat that is waiting for one, up to TITLE_BATCH_SIZE per run."""
+    chats = get_untitled_chats_repo(TITLE_BATCH_SIZE)
+    titles = {}
+    try:
+        for number, (chat_id, user_id, turns) in enumerate(chats):
+            progress(number / len(chats), f"Titling chat {number + 1} of {len(chats)}")
+            titles[chat_id] = generate_title(turns, user_id)
+    finally:
+        # Titles generated before a failure are kept, the retry only does the rest
+        updated = update_chat_titles_repo(titles) if titles else 0
+    if len(chats) == TITLE_BATCH_SIZE:
+        submit_title_generation()
+    return {"titled": updated}
+
+def submit_title_generation():
+    # One queued job at a time: chats that get their first reply while it waits join its batch
+    try:
+        job_queue.enqueue("generate_titles", {}, dedupe_key="generate_titles")
+    except Exception as e:
+        logger.exception("Error queueing chat titles")
+
+def build_prompt(app: Flask, messages: list, chat_id: Optional[str], user_id: str) -> list:
+    """The prompt for a turn: the chat's context window, with document excerpts added."""
+    summary, summary_upto = None, 0
+    if chat_id:
+        try:
+            with app.app_context():
+                summary, summary_upto = get_chat_summary_repo(chat_id, user_id)
+        except Exception as e:
+            logger.exception("Error loading chat summary")
+
+    window = build_context(messages, summary, summary_upto)
+    if chat_id and window.needs_summary:
+        submit_chat_summary(chat_id, user_id)
+    return augment_messages(window.messages)
+
+# What every chat reply goes through apart from its transport, see app/replies.py
+chat_replies = ChatReplies(
+    generations,
+    inference_scheduler,
+    model_router,
+    CHAT_OPTIONS,
+    build_prompt=build_prompt,
+    save_turn=persist_chat_turn,
+    response_cache=response_cache,
+    index_version=current_index_version,
+)
+
+def first_difference(stored: list, messages: list) -> int:
+    """Index of the first turn of `messages` that differs from the stored transcript."""
+    for seq, (kept, turn) in enumerate(zip(stored, messages)):
+        if kept["role"] != turn["role"] or kept["content"] != turn["content"]:
+            return seq
+    return min(len(stored), len(messages))
+
 def update_chat_repo(chat_id: str, user_id: str, update_data: dict) -> Optional[Chat]:
     try:
         # query the chat
-        chat = db.session.query(Chat).filter(Chat.id==chat_id).first()
+        chat = db.session.query(Chat).filter(
+            and_(
+                Chat.id == chat_id,
+                Chat.user_id == user_id
+            )
+        ).first()
         
         if not chat:
             return None
         
+        messages = update_data.pop("messages", None)
+        version = None
+        if messages is not None:
+            # Clients send the whole transcript. The stored turns it agrees with are kept, the
+            # rest is dropped from the first edited turn on and the new turns written after them.
+            messages = [ChatMessageIn(**message).model_dump() for message in messages]
+            stored = load_chat_history_repo(chat_id, user_id)
+            keep = first_difference(stored, messages)
+            if keep < len(stored):
+                db.session.query(ChatMessage).filter(
+                    and_(ChatMessage.chat_id == chat_id, ChatMessage.seq >= keep)
+                ).delete(synchronize_session=False)
+                chat_history_cache.delete(chat_id)
+                if keep < chat.summary_upto:
+                    # The summary covers turns that are gone
+                    chat.summary, chat.summary_upto = None, 0
+            add_chat_messages(chat_id, messages[keep:], keep)
+            if keep < len(stored) or keep < len(messages):
+                version = bump_chat_version(chat_id)
+                db.session.expire(chat, ["turns"])
+
         # update the fields with the values from `update_data`
         for key, value in update_data.items():
             if hasattr(chat, key):
@@ -166,9 +591,11 @@ def update_chat_repo(chat_id: str, user_id: str, update_data: dict) -> Optional[
                         
         # commit the changes
         db.session.commit()
+        if version is not None:
+            chat_changed(chat_id, user_id, version)
         return chat.to_dict()
     except Exception as e:
-        print(f"Error updating chat messages: {str(e)}")
+        logger.exception("Error updating chat messages")
         db.session.rollback()
         return None
 
@@ -184,101 +611,609 @@ def get_chat_repo(chat_id: str, user_id: str):
         return chat_dict
 
     except Exception as e:
-        print(f"Error fetching chat: {str(e)}")
+        logger.exception("Error fetching chat")
         return None
     
-def get_user_chats_repo(current_user: str) -> Optional[List[Chat]]:
+def chat_owned_repo(chat_id: str, user_id: str) -> bool:
+    return db.session.query(Chat.id).filter(
+        and_(
+            Chat.id == chat_id,
+            Chat.user_id == user_id
+        )
+    ).first() is not None
+
+def get_chat_version_repo(chat_id: str, user_id: str) -> Optional[int]:
+    """The version of a chat's transcript, or None if the user doesn't own it."""
+    key = chat_cache_key(chat_id, user_id)
+    version = chat_version_cache.get(key) if chat_version_cache is not None else None
+    if version is not None:
+        return version
+    version = db.session.query(Chat.version).filter(
+        and_(
+            Chat.id == chat_id,
+            Chat.user_id == user_id
+        )
+    ).scalar()
+    if version is not None and chat_version_cache is not None:
+        # A write committed since the query has published a newer version, which stays
+        chat_version_cache.add(key, version)
+    return version
+
+def read_chat_messages_repo(chat_id: str, user_id: str, version: int):
+    """Yield a chat's transcript like `stream_chat_messages_repo`, through the chat cache.
+
+    A transcript that isn't cached at `version` is streamed from the database and cached
+    once it has been read in full, unless it is longer than CHAT_CACHE_MAX_CHARS.
+    """
+    key = chat_cache_key(chat_id, user_id)
+    cached = chat_cache.get(key)
+    if cached is not None and cached["version"] == version:
+        yield cached["body"]
+        return
+
+    parts, size = [], 0
+    for part in stream_chat_messages_repo(chat_id):
+        yield part
+        if parts is not None:
+            parts.append(part)
+            size += len(part)
+            if size > CHAT_CACHE_MAX_CHARS:
+                parts = None
+    # A write after `version` was read may be in the body, which only makes the entry miss
+    if parts is not None:
+        chat_cache.set(key, {"version": version, "body": "".join(parts)})
+
+def stream_chat_messages_repo(chat_id: str):
+    """Yield a chat's transcript as a JSON array, one batch of rows at a time.
+
+    Rows come from a server-side cursor as plain tuples and are encoded as they arrive, so
+    neither the whole transcript nor ORM objects for it are ever held in memory.
+    """
+    rows = db.session.execute(
+        select(ChatMessage.role, ChatMessage.content)
+        .where(ChatMessage.chat_id == chat_id)
+        .order_by(ChatMessage.seq)
+        .execution_options(yield_per=TRANSCRIPT_BATCH_SIZE)
+    )
+    yield "["
+    separator = ""
+    for batch in rows.partitions():
+        yield separator + ",".join(
+            json.dumps({"role": role, "content": content}, separators=(",", ":")) for role, content in batch
+        )
+        separator = ","
+    yield "]"
+
+def encode_chat_cursor(created_at: datetime, chat_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), chat_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_chat_cursor(cursor: str):
+    try:
+        created_at, chat_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), chat_id
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def get_user_chats_repo(current_user: str, limit: int = CHATS_PAGE_SIZE, cursor: Optional[str] = None):
+    """Return one page of a user's chats, newest first, and the cursor of the next page.
+
+    Only the sidebar projection is read: the transcript itself is never loaded, just a
+    preview of the last message through a correlated subquery on (chat_id, seq).
+    """
     try:
-        chat = db.session.query(Chat).filter(Chat.user_id == current_user)
-        chats = chat.all()
-        messages_dict = [chat.to_dict() for chat in chats]
-        return messages_dict
+        preview = (
+            select(func.substr(ChatMessage.content, 1, CHAT_PREVIEW_LENGTH))
+            .where(ChatMessage.chat_id == Chat.id)
+            .order_by(ChatMessage.seq.desc())
+            .limit(1)
+            .correlate(Chat)
+            .scalar_subquery()
+        )
+        query = db.session.query(Chat.id, Chat.title, Chat.created_at, preview.label("preview")).filter(
+            Chat.user_id == current_user
+        )
+        if cursor:
+            created_at, chat_id = decode_chat_cursor(cursor)
+            query = query.filter(tuple_(Chat.created_at, Chat.id) < tuple_(created_at, chat_id))
+
+        # Fetch one extra row to know whether another page exists
+        rows = query.order_by(Chat.created_at.desc(), Chat.id.desc()).limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_chat_cursor(rows[-1].created_at, rows[-1].id)
+
+        chats = [
+            {
+                "id": row.id,
+                "title": row.title,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+                "preview": row.preview,
+            }
+            for row in rows
+        ]
+        return chats, next_cursor
+    except ValueError:
+        raise
     except Exception as e:
-        print(f"Error fetching chat: {str(e)}")
+        logger.exception("Error fetching chat")
         return None
 
-def generate_response(message, user, access_token, status_code):
+def encode_search_cursor(rank: float, message_id: int) -> str:
+    raw = json.dumps([rank, message_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_search_cursor(cursor: str):
+    try:
+        rank, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(message_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def search_chats_repo(user_id: str, text: str, limit: int = search.SEARCH_PAGE_SIZE, cursor: Optional[str] = None):
+    """Return one page of the user's messages that match `text`, best match first, and the next cursor.
+
+    Pages are keyed on (rank, message id), so a page is as cheap to fetch as the first one.
+    """
+    position = decode_search_cursor(cursor) if cursor else None
+    if db.engine.dialect.name == "postgresql":
+        query = search.ts_query(text)
+        # The GIN index finds the matches, only their ids and ranks are read here
+        matches = (
+            select(ChatMessage.id, search.ts_rank(query).label("rank"))
+            .join(Chat, Chat.id == ChatMessage.chat_id)
+            .where(and_(Chat.user_id == user_id, search.search_vector().op("@@")(query)))
+            .subquery()
+        )
+        page = select(matches)
+        if position:
+            page = page.where(tuple_(matches.c.rank, matches.c.id) < tuple_(*position))
+        page = page.order_by(matches.c.rank.desc(), matches.c.id.desc()).limit(limit + 1).subquery()
+        rows = db.session.execute(
+            select(
+                ChatMessage.id, ChatMessage.chat_id, ChatMessage.seq, ChatMessage.role, ChatMessage.created_at,
+                Chat.title, page.c.rank, search.ts_headline(ChatMessage.content, query).label("snippet"),
+            )
+            .join(ChatMessage, ChatMessage.id == page.c.id)
+            .join(Chat, Chat.id == ChatMessage.chat_id)
+            .order_by(page.c.rank.desc(), page.c.id.desc())
+        ).all()
+        snippets = [search.fragments(row.snippet) for row in rows]
+    else:
+        terms = search.query_terms(text)
+        if not terms:
+            return [], None
+        query = db.session.query(
+            ChatMessage.id, ChatMessage.chat_id, ChatMessage.seq, ChatMessage.role, ChatMessage.created_at,
+            ChatMessage.content, Chat.title, literal_column("0.0").label("rank"),
+        ).join(Chat, Chat.id == ChatMessage.chat_id).filter(
+            Chat.user_id == user_id,
+            *[ChatMessage.content.ilike(search.like_pattern(term), escape="\\") for term in terms],
+        )
+        if position:
+            query = query.filter(ChatMessage.id < position[1])
+        rows = query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+        snippets = [search.like_snippet(row.content, terms) for row in rows]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_search_cursor(rows[-1].rank, rows[-1].id)
+    results = [
+        {
+            "chat_id": row.chat_id,
+            "title": row.title,
+            "seq": row.seq,
+            "role": row.role,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "rank": round(float(row.rank), 4),
+            "snippet": snippet,
+        }
+        for row, snippet in zip(rows, snippets)
+    ]
+    return results, next_cursor
+
+def export_chats_repo(user_id: Optional[str] = None):
+    """Yield the chats of `user_id`, or of every user, as NDJSON lines, see app/transfer.py.
+
+    Chats and their messages come from one outer join, read from a server-side cursor, and
+    each batch of rows is written out as one chunk.
+    """
+    yield transfer.export_header("user" if user_id else "org")
+
+    users = select(*(getattr(User, field) for field in transfer.USER_FIELDS))
+    if user_id:
+        users = users.where(User.id == user_id)
+    rows = db.session.execute(users.execution_options(yield_per=TRANSCRIPT_BATCH_SIZE))
+    for batch in rows.partitions():
+        yield "".join(transfer.record("user", transfer.USER_FIELDS, row) for row in batch)
+
+    chat_columns = [getattr(Chat, field) for field in transfer.CHAT_FIELDS]
+    message_columns = [getattr(ChatMessage, field) for field in transfer.MESSAGE_FIELDS[1:]]
+    chats = select(*chat_columns, *message_columns).outerjoin(ChatMessage, ChatMessage.chat_id == Chat.id)
+    if user_id:
+        chats = chats.where(Chat.user_id == user_id)
+    rows = db.session.execute(
+        chats.order_by(Chat.user_id, Chat.created_at, Chat.id, ChatMessage.seq)
+        .execution_options(yield_per=TRANSCRIPT_BATCH_SIZE)
+    )
+    chat_id = None
+    width = len(chat_columns)
+    for batch in rows.partitions():
+        lines = []
+        for row in batch:
+            if row[0] != chat_id:
+                chat_id = row[0]
+                lines.append(transfer.record("chat", transfer.CHAT_FIELDS, row[:width]))
+            # A chat without messages comes with NULLs from the outer join
+            if row[width] is not None:
+                lines.append(transfer.record("message", transfer.MESSAGE_FIELDS, (chat_id,) + tuple(row[width:])))
+        yield "".join(lines)
+
+def import_user(item: dict, insert) -> str:
+    """The id of the stored user with the email of exported user `item`, who is added if needed."""
+    email = item.get("email")
+    stored = db.session.query(User.id).filter(User.email == email).scalar() if email else None
+    if stored is not None:
+        return stored
+    stored = item.get("id")
+    if not isinstance(stored, str) or db.session.query(User.id).filter(User.id == stored).first() is not None:
+        stored = str(uuid4())
+    db.session.execute(insert(User).values(id=stored, **{field: item.get(field) for field in transfer.USER_FIELDS[1:]}))
+    return stored
+
+def import_chats_repo(lines, user_id: Optional[str] = None) -> Optional[dict]:
+    """Import an NDJSON export, see app/transfer.py, and return how many records it held.
+
+    With `user_id` the chats get fresh ids and belong to that user, and users in the file
+    are ignored. Without it ids are kept, users are matched by email and rows that are
+    already stored are skipped. Either way the import is one transaction. Raises
+    ValueError for a malformed file, naming the line.
+    """
+    insert = postgresql.insert if db.engine.dialect.name == "postgresql" else sqlite.insert
+    insert_chats = insert(Chat).on_conflict_do_nothing(index_elements=[Chat.id])
+    insert_messages = insert(ChatMessage).on_conflict_do_nothing(index_elements=[ChatMessage.chat_id, ChatMessage.seq])
+    counts = {"users": 0, "chats": 0, "messages": 0}
+    # Exported user id -> stored user id
+    users = {}
+    chats, messages = [], []
+    # (exported id, stored id) of the chat whose messages are being read
+    current = None
+    # (chat id, owner, version) of stored chats the import adds messages to
+    changed = []
+
+    def flush():
+        # Chats first, their messages reference them
+        if chats:
+            db.session.execute(insert_chats, chats)
+            chats.clear()
+        if messages:
+            db.session.execute(insert_messages, messages)
+            messages.clear()
+
+    try:
+        for number, item in transfer.read_records(lines):
+            try:
+                if item["type"] == "user" and user_id is None:
+                    users[item.get("id")] = import_user(item, insert)
+                    counts["users"] += 1
+                elif item["type"] == "chat":
+                    if not isinstance(item.get("id"), str):
+                        raise ValueError("chat id must be a string")
+                    if user_id:
+                        current = (item["id"], str(uuid4()))
+                        owner = user_id
+                    else:
+                        current = (item["id"], item["id"])
+                        owner = import_chat_owner(item, users, changed)
+                    chats.append(transfer.chat_row(item, current[1], owner, NEW_CHAT_TITLE))
+                    counts["chats"] += 1
+                elif item["type"] == "message":
+                    if current is None or item.get("chat_id") != current[0]:
+                        raise ValueError("a message has to follow its chat")
+                    messages.append(transfer.message_row(item, current[1]))
+                    counts["messages"] += 1
+            except ValueError as e:
+                raise ValueError(f"line {number}: {e}") from e
+            if len(chats) + len(messages) >= transfer.IMPORT_BATCH_SIZE:
+                flush()
+        flush()
+        db.session.commit()
+        for chat_id, owner, version in changed:
+            chat_changed(chat_id, owner, version)
+        return counts
+    except (ValueError, OSError):
+        # A malformed file, or a body that stopped arriving
+        db.session.rollback()
+        raise
+    except Exception as e:
+        logger.exception("Error importing chats")
+        db.session.rollback()
+        return None
+
+def import_chat_owner(item: dict, users: dict, changed: list) -> str:
+    """The stored owner of exported chat `item`, when ids are kept. A chat that is already
+    stored gets a new version, added to `changed`."""
+    owner = users.get(item.get("user_id"))
+    if owner is None:
+        # Not in the file, the chat may belong to a user of this database
+        owner = db.session.query(User.id).filter(User.id == item.get("user_id")).scalar()
+        if owner is None:
+            raise ValueError(f"unknown user {item.get('user_id')!r}")
+        users[owner] = owner
+    stored_owner = db.session.query(Chat.user_id).filter(Chat.id == item["id"]).scalar()
+    if stored_owner is not None and stored_owner != owner:
+        raise ValueError(f"chat {item['id']} already belongs to another user")
+    if stored_owner is not None:
+        # Messages missing from the stored chat are added to it
+        changed.append((item["id"], owner, bump_chat_version(item["id"])))
+    return owner
+
+def import_chats(app: Flask, lines, user_id: Optional[str] = None) -> Optional[dict]:
+    with app.app_context():
+        return import_chats_repo(lines, user_id)
+
+def sync_document_repo(file_path: str, progress=None) -> Optional[dict]:
+    """Bring the vector index up to date with one document, re-embedding only what changed.
+
+    The whole file is hashed first, so an unchanged document costs one read. Otherwise
+    each page's content stream and resources are hashed against the manifest, and only new or changed
+    pages are parsed, chunked and embedded. Vectors of changed and removed pages are
+    deleted first, since a page can produce fewer chunks than it did before.
+
+    `progress(fraction, message)`, if given, is told about every page that is embedded.
+    """
+    try:
+        source = os.path.basename(file_path)
+        path = os.path.abspath(file_path)
+        digest = file_hash(file_path)
+        document = db.session.query(DocumentFile).filter(DocumentFile.source == source).first()
+        if document and document.content_hash == digest:
+            if document.path != path:
+                document.path = path
+                db.session.commit()
+            return {"source": source, "status": "unchanged", "pages_changed": 0, "pages_removed": 0, "chunks": 0}
+
+        hashes = page_hashes(file_path)
+        # An upload's manifest row is claimed before its first sync, without a hash
+        status = "updated" if document and document.content_hash else "added"
+        if document is None:
+            document = DocumentFile(source=source)
+            db.session.add(document)
+
+        existing = {page.page: page for page in document.pages}
+        changed = [number for number, page_hash in enumerate(hashes)
+                   if number not in existing or existing[number].content_hash != page_hash]
+        removed = [number for number in existing if number >= len(hashes)]
+
+        index = get_index()
+        index.delete_pages(source, changed + removed)
+        chunk_counts = Counter()
+
+        def counted(chunks):
+            for chunk in chunks:
+                if progress is not None and chunk.page not in chunk_counts:
+                    progress(len(chunk_counts) / len(changed), f"Embedding page {chunk.page + 1} of {len(hashes)}")
+                chunk_counts[chunk.page] += 1
+                yield chunk
+
+        added = index.add_chunks(counted(iter_chunks(file_path, pages=changed)))
+
+        # The manifest is only committed after the vectors are written, so an interrupted
+        # sync is simply redone on the next run
+        for number in changed:
+            page = existing.get(number)
+            if page is None:
+                page = DocumentPage(page=number)
+                document.pages.append(page)
+            page.content_hash = hashes[number]
+            page.chunk_count = chunk_counts[number]
+        for number in removed:
+            document.pages.remove(existing[number])
+        document.content_hash = digest
+        document.page_count = len(hashes)
+        document.path = path
+        db.session.commit()
+
+        return {"source": source, "status": status, "pages_changed": len(changed), "pages_removed": len(removed), "chunks": added}
+    except Exception as e:
+        logger.exception("Error syncing document")
+        db.session.rollback()
+        return None
+
+@job_queue.handler("sync_document", max_attempts=3)
+def sync_document(payload: dict, progress) -> dict:
+    if not os.path.exists(payload["path"]):
+        raise PermanentJobError(f"{payload['path']} no longer exists")
+    summary = sync_document_repo(payload["path"], progress=progress)
+    if summary is None:
+        raise RuntimeError(f"Failed to ingest {os.path.basename(payload['path'])}")
+    return summary
+
+def claim_document_repo(file_path: str, user_id: str) -> bool:
+    """Whether `user_id` may upload `file_path`: a name belongs to the user who first uploaded
+    it, and a file that wasn't uploaded (synced from the folder) can't be replaced at all."""
+    source = os.path.basename(file_path)
+    try:
+        document = db.session.query(DocumentFile).filter(DocumentFile.source == source).first()
+        if document is not None:
+            return document.uploaded_by == user_id
+        if os.path.exists(file_path):
+            return False
+        db.session.add(DocumentFile(source=source, content_hash="", uploaded_by=user_id, path=os.path.abspath(file_path)))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        # Claimed by another upload of the same name in the meantime
+        db.session.rollback()
+        return False
+
+def sync_directory_repo(folder: str) -> List[dict]:
+    """Sync every PDF in `folder` and drop the documents indexed from it that are no longer there."""
+    folder = os.path.abspath(folder)
+    file_names = sorted(name for name in os.listdir(folder) if name.lower().endswith(".pdf"))
+    summaries = [summary for summary in (sync_document_repo(os.path.join(folder, name)) for name in file_names) if summary]
+
+    try:
+        # Documents indexed from anywhere else, subfolders included, are left alone
+        gone = [document for document in db.session.query(DocumentFile).filter(
+            DocumentFile.path.startswith(os.path.join(folder, ""), autoescape=True),
+            DocumentFile.source.notin_(file_names),
+        ) if os.path.dirname(document.path) == folder]
+        for document in gone:
+            get_index().delete_source(document.source)
+            db.session.delete(document)
+            summaries.append({"source": document.source, "status": "removed", "pages_changed": 0,
+                              "pages_removed": document.page_count, "chunks": 0})
+        db.session.commit()
+    except Exception as e:
+        logger.exception("Error removing deleted documents")
+        db.session.rollback()
+    return summaries
+
+def generate_response(message, user, access_token, refresh_token, status_code):
     return jsonify({
         "message": message,
         "access_token": access_token,
-        "user": user.to_dict(),
+        "refresh_token": refresh_token,
+        "user": user,
     }), status_code
 
 
-@app.route("/auth", methods=["POST"])
+@api.route("/auth", methods=["POST"])
 def authentication():
     try:
         data = request.get_json()
         user_data = GoogleUserModel(**data)
-        user = User.query.filter_by(email=user_data.email).first()
-        if user:
-            update_user_repo(user, user_data)
-        else: 
-            user = create_user_repo(user_data)
-        access_token = generate_jwt(user)
-        return generate_response("Signed in successfully", user, access_token, 200 if user else 201)
+        user = upsert_user_repo(user_data)
+        access_token = generate_jwt(user["id"])
+        refresh_token = generate_refresh_token(user["id"])
+        return generate_response("Signed in successfully", user, access_token, refresh_token, 200)
     
-    except ValidationErr as e:
-        print(f"An error occurred: {str(e)}")
+    except ValidationError as e:
+        logger.exception("An error occurred")
         return jsonify({"message": "Failed to create user"}), 500
     except Exception as e:
-        print(f"An error occurered: {str(e)}")
+        logger.exception("An error occurered")
+        db.session.rollback()
         return jsonify({"message": "An error occurred during sign in"}), 500
 
-@app.route("/start-chat", methods=["POST"])
+@api.route("/auth/refresh", methods=["POST"])
+@jwt_required(refresh=True)
+def refresh_access_token():
+    return jsonify({"access_token": generate_jwt(get_jwt_identity())}), 200
+
+@api.route("/me", methods=["GET"])
+@jwt_required()
+def get_current_user():
+    try:
+        user = get_user_profile_repo(get_jwt_identity())
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+        return jsonify(user), 200
+    except Exception as e:
+        logger.exception("Error fetching user")
+        return jsonify({"error": "Error fetching user"}), 500
+
+@api.route("/start-chat", methods=["POST"])
 @jwt_required()
 def create_chat():
     try:
         data = request.json
         messages = data.get("messages", [])
         current_user = get_jwt_identity() 
-        new_message = Chat(user_id=current_user, messages=messages)
+        new_message = Chat(user_id=current_user, title=data.get("title") or NEW_CHAT_TITLE)
         db.session.add(new_message)
+        db.session.flush()
+        add_chat_messages(new_message.id, messages, 0)
         db.session.commit()
+        # The title is generated in the background once the chat has a reply
+        if new_message.title == NEW_CHAT_TITLE and any(
+            isinstance(message, dict) and message.get("role") == "assistant" for message in messages
+        ):
+            submit_title_generation()
         
         return jsonify({"message": "Chat created successfully", "chat_id": new_message.id}), 201
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
+        logger.exception("An error occurred")
         return jsonify({"message": "An error occurred during sign in"}), 500
     
-@app.route("/chats", methods=["GET"])
+@api.route("/chats", methods=["GET"])
 @jwt_required()
 def get_current_user_chats():
     try:
         current_user = get_jwt_identity()
-        messages = get_user_chats_repo(current_user)
-        return jsonify(messages)
+        limit = min(max(request.args.get("limit", CHATS_PAGE_SIZE, type=int), 1), CHATS_MAX_PAGE_SIZE)
+        cursor = request.args.get("cursor")
+
+        page = get_user_chats_repo(current_user, limit=limit, cursor=cursor)
+        if page is None:
+            return jsonify({"error": "An error occurred while fetching chats"}), 500
+
+        chats, next_cursor = page
+        return jsonify({"chats": chats, "next_cursor": next_cursor})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error":f"Something went wrong {e}"})
     
 
-@app.route("/chats/<string:chat_id>", methods=["GET"])
+@api.route("/chats/search", methods=["GET"])
+@jwt_required()
+def search_chats():
+    try:
+        text = request.args.get("q", "").strip()
+        if not text:
+            return jsonify({"error": "q is required"}), 400
+        if len(text) > search.SEARCH_MAX_QUERY_LENGTH:
+            return jsonify({"error": f"q is longer than {search.SEARCH_MAX_QUERY_LENGTH} characters"}), 400
+        limit = min(max(request.args.get("limit", search.SEARCH_PAGE_SIZE, type=int), 1), search.SEARCH_MAX_PAGE_SIZE)
+
+        results, next_cursor = search_chats_repo(get_jwt_identity(), text, limit=limit, cursor=request.args.get("cursor"))
+        return jsonify({"results": results, "next_cursor": next_cursor})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in search_chats route")
+        return jsonify({"error": "An error occurred while searching chats"}), 500
+
+@api.route("/chats/<string:chat_id>", methods=["GET"])
 @jwt_required()
 def get_chat(chat_id:str):
     try: 
         current_user_id = get_jwt_identity()
-        chat = get_chat_repo(chat_id, current_user_id)
-        if not chat:
+        version = get_chat_version_repo(chat_id, current_user_id)
+        if version is None:
             return jsonify({'error': 'Chat not found or not authorized'}), 404
-        
+
+        # The browser keeps the transcript and revalidates it on every visit (no-cache)
+        etag = f"v{version}"
+        headers = {"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"}
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers=headers)
+
         # Return the actual messages from the chat
-        return jsonify(chat['messages']), 200
+        return Response(
+            stream_with_context(read_chat_messages_repo(chat_id, current_user_id, version)),
+            mimetype="application/json",
+            headers=headers,
+        )
         
     except Exception as e:
-        print(f"Error in get_chats: {str(e)}")
+        logger.exception("Error in get_chats")
         return jsonify({
             "error": "An error occurred while fetching the chat"
         }), 500
 
-@app.route("/chats/<string:chat_id>", methods=["PATCH"])
+@api.route("/chats/<string:chat_id>", methods=["PATCH"])
 @jwt_required()
 def update_chat(chat_id:str):
     try:
         data = request.get_json()
         current_user = get_jwt_identity()
         
-        chat = get_chat_repo(chat_id=chat_id, user_id=current_user)
-        if not chat:
+        if not chat_owned_repo(chat_id, current_user):
             return jsonify({"error": "Chat not found"}), 404
         
         # Prepare the data for updaing - only update valid fields
@@ -299,52 +1234,344 @@ def update_chat(chat_id:str):
         else:
             return jsonify({"error": "Chat not found or update failed"}), 404
     except Exception as e:
-        print(f"Error in update_chat route: {str(e)}")
+        logger.exception("Error in update_chat route")
         return jsonify({"error": "An error occurred while updating the chat"}), 500
     
-@app.route("/chats", methods=["POST"])
+@api.route("/chats/<string:chat_id>/messages", methods=["POST"])
+@jwt_required()
+def append_chat_messages(chat_id:str):
+    try:
+        data = request.get_json()
+        current_user = get_jwt_identity()
+
+        messages = data.get("messages", [])
+        if not isinstance(messages, list):
+            messages = [messages]
+
+        message_count = append_chat_messages_repo(chat_id, current_user, messages)
+        if message_count is None:
+            return jsonify({"error": "Chat not found or append failed"}), 404
+
+        return jsonify({"chat_id": chat_id, "message_count": message_count}), 201
+    except Exception as e:
+        logger.exception("Error in append_chat_messages route")
+        return jsonify({"error": "An error occurred while appending to the chat"}), 500
+
+def run_generation(app: Flask, generation: Generation, prompt: list, messages: list, ticket):
+    """Generate the reply of `generation` on this thread, see app/replies.py."""
+    import ollama
+
+    run = chat_replies.run(app, generation, prompt, messages, ticket)
+    try:
+        with closing(ollama.chat(**run.request())) as response:
+            for part in response:
+                if run.add(part):
+                    break
+        run.finish()
+    except Exception as e:
+        run.fail()
+    finally:
+        run.close()
+
+def follow_generation(generation: Generation, after: int = 0) -> Response:
+    return Response(generation.follow(after), headers={**SSE_HEADERS, GENERATION_HEADER: generation.id})
+
+def stream_reply(messages: list, chat_id: Optional[str], current_user: str) -> Response:
+    """Start generating the reply to `messages` and stream it, see app/generations.py.
+
+    The new turns of `chat_id` are stored once the reply finishes, even if the client left.
+    """
+    # The generation outlives the request
+    app = current_app._get_current_object()
+    cached, prompt = chat_replies.prepare(app, messages, chat_id, current_user)
+    if cached is not None:
+        generation = chat_replies.start(current_user, chat_id)
+        threading.Thread(target=chat_replies.replay, args=(app, generation, cached, messages),
+                         name="generation", daemon=True).start()
+        return follow_generation(generation)
+
+    ticket = chat_replies.admit(current_user, prompt)
+    generation = chat_replies.start(current_user, chat_id)
+    threading.Thread(target=run_generation, args=(app, generation, prompt, messages, ticket),
+                     name="generation", daemon=True).start()
+    return follow_generation(generation)
+
+@api.route("/chats", methods=["POST"])
 @jwt_required()
 def chat():
     try:        
-        messages = request.get_json().get("messages", [])
+        data = request.get_json()
+        messages = data.get("messages", [])
         if not isinstance(messages, list):
             messages = [messages]
-        def generate():
-            with app.app_context():  # Add this line
-                response = ollama.chat(
-                    model="llama3.2",
-                    messages=messages,
-                    options={"temperature": 0.9, "max_token": 2000},
-                    stream=True,
-                )
-                
-                for part in response:
-                    content = part.get("message", {}).get("content", "")
-                    yield f"data: {json.dumps({'content': content})}\n\n"
-                    
-                    if part.get("done"):
-                        messages.append({"role": "assistant", "content": content})
-                        Chat.messages = messages
-                        db.session.commit()
-                        break
-                    
-                yield "data: [DONE]\n\n"
-            
-        return Response(
-            generate(),
-            headers={
-                "Content-Type": "text/event-stream",
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            },
-        )
+        chat_id = data.get("chat_id")
+        current_user = get_jwt_identity()
+        return stream_reply(messages, chat_id, current_user)
+    except SchedulerBusy as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+    except Exception as e:
+        logger.exception("Error processing request")
+        return jsonify({"error": "Error processing request"}), 500
+
+@api.route("/chats/<string:chat_id>/turns", methods=["POST"])
+@jwt_required()
+def add_chat_turn(chat_id: str):
+    """Send only the new user message; the history is read from storage."""
+    try:
+        data = request.get_json()
+        content = data.get("content", "")
+        if not isinstance(content, str) or not content.strip():
+            return jsonify({"error": "content is required"}), 400
+        current_user = get_jwt_identity()
+
+        history = load_chat_history_repo(chat_id, current_user)
+        if history is None:
+            return jsonify({"error": "Chat not found"}), 404
+        return stream_reply(history + [{"role": "user", "content": content}], chat_id, current_user)
+    except SchedulerBusy as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
     except Exception as e:
-        print(f"Error processing request: {e}")
+        logger.exception("Error in add_chat_turn route")
         return jsonify({"error": "Error processing request"}), 500
     
-@app.route("/", methods=["GET"])
+@api.route("/generations/<string:generation_id>", methods=["GET"])
+@jwt_required()
+def resume_generation(generation_id: str):
+    """Follow a generation again after a dropped connection, from the event after `Last-Event-ID`."""
+    generation = generations.get(generation_id, get_jwt_identity())
+    if generation is None:
+        return jsonify({"error": "Generation not found"}), 404
+    after = last_event_id(request.headers.get("Last-Event-ID") or request.args.get("last_event_id"))
+    return follow_generation(generation, after)
+
+@api.route("/chats/<string:chat_id>/generation", methods=["GET"])
+@jwt_required()
+def follow_chat_generation(chat_id: str):
+    """Follow the latest generation of a chat from its start, e.g. from another tab."""
+    generation = generations.for_chat(chat_id, get_jwt_identity())
+    if generation is None:
+        return jsonify({"error": "Generation not found"}), 404
+    return follow_generation(generation)
+
+@api.route("/export", methods=["GET"])
+@jwt_required()
+def export_chats():
+    """Download the signed-in user's chats as NDJSON, see app/transfer.py."""
+    try:
+        filename = f"chats-{datetime.now(timezone.utc):%Y%m%d}.ndjson"
+        return Response(
+            stream_with_context(export_chats_repo(get_jwt_identity())),
+            mimetype=transfer.EXPORT_MIMETYPE,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+    except Exception as e:
+        logger.exception("Error in export_chats route")
+        return jsonify({"error": "An error occurred while exporting chats"}), 500
+
+@api.route("/import", methods=["POST"])
+@jwt_required()
+def import_chats_route():
+    """Add the chats of an NDJSON export to the signed-in user's, see app/transfer.py."""
+    try:
+        counts = import_chats_repo(io.BufferedReader(request.stream), get_jwt_identity())
+        if counts is None:
+            return jsonify({"error": "An error occurred while importing chats"}), 500
+        return jsonify(counts), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in import_chats route")
+        return jsonify({"error": "An error occurred while importing chats"}), 500
+
+@api.route("/documents", methods=["POST"])
+@jwt_required()
+def upload_document():
+    try:
+        upload = request.files.get("file")
+        if upload is None or not upload.filename:
+            return jsonify({"error": "No file uploaded"}), 400
+
+        filename = secure_filename(upload.filename)
+        if not filename.lower().endswith(".pdf"):
+            return jsonify({"error": "Only PDF documents are supported"}), 400
+
+        os.makedirs(DATA_DIR, exist_ok=True)
+        file_path = os.path.join(DATA_DIR, filename)
+        if not claim_document_repo(file_path, get_jwt_identity()):
+            return jsonify({"error": "A document with this name already exists"}), 409
+        upload.save(file_path)
+
+        # Parsing and embedding run on a job worker; a job that is still queued for the
+        # same file picks up this upload as well
+        job_id = job_queue.enqueue("sync_document", {"path": file_path},
+                                   user_id=get_jwt_identity(), dedupe_key=f"sync_document:{filename}")
+        return jsonify({"job_id": job_id, "status": QUEUED, "status_url": f"/jobs/{job_id}"}), 202
+    except Exception as e:
+        logger.exception("Error in upload_document route")
+        return jsonify({"error": "An error occurred while ingesting the document"}), 500
+
+@api.route("/jobs/<string:job_id>", methods=["GET"])
+@jwt_required()
+def get_job(job_id: str):
+    job = db.session.get(Job, job_id)
+    if job is None or job.user_id != get_jwt_identity():
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+@api.route("/cache/stats", methods=["GET"])
+@jwt_required()
+def get_cache_stats():
+    stats = cache_stats()
+    stats["chat"] = chat_cache.stats()
+    if chat_version_cache is not None:
+        stats["chat_version"] = chat_version_cache.stats()
+    if response_cache is not None:
+        stats["response"] = response_cache.stats()
+    return jsonify(stats)
+
+@api.route("/scheduler", methods=["GET"])
+@jwt_required()
+def scheduler_stats():
+    return jsonify({**inference_scheduler.snapshot(), "generations": generations.snapshot()})
+
+@api.route("/models", methods=["GET"])
+@jwt_required()
+def model_stats():
+    return jsonify(model_router.snapshot())
+
+@api.route("/metrics/db", methods=["GET"])
+@jwt_required()
+def database_metrics():
+    return jsonify({"pool": pool_status(db.engine), **pool_metrics.snapshot()})
+
+@api.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return metrics.render_metrics()
+
+@api.route("/", methods=["GET"])
 def health():
     return jsonify({"message": "OK"})
 
+@api.cli.command("sync-documents")
+@click.argument("folder", default=DATA_DIR)
+def sync_documents_command(folder):
+    """Re-ingest the PDFs in FOLDER, embedding only new or changed pages."""
+    for summary in sync_directory_repo(folder):
+        print(f"{summary['source']}: {summary['status']}, {summary['pages_changed']} pages changed, "
+              f"{summary['pages_removed']} removed, {summary['chunks']} chunks embedded")
+
+@api.cli.command("run-jobs")
+@click.option("--processes", default=1, show_default=True, help="Worker processes")
+@click.option("--threads", default=1, show_default=True, help="Worker threads per process")
+def run_jobs_command(processes, threads):
+    """Run background job workers until interrupted."""
+    job_queue.run_workers(processes, threads, preload=import_job_modules)
+
+def find_user_id(email: str) -> str:
+    user_id = db.session.query(User.id).filter(User.email == email).scalar()
+    if user_id is None:
+        raise click.BadParameter(f"No user with email {email}", param_hint="--user")
+    return user_id
+
+@api.cli.command("export-chats")
+@click.argument("output", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--user", "email", help="Only export the chats of the user with this email")
+def export_chats_command(output, email):
+    """Write every chat, or one user's, to OUTPUT as NDJSON."""
+    for chunk in export_chats_repo(find_user_id(email) if email else None):
+        output.write(chunk)
+
+@api.cli.command("import-chats")
+@click.argument("input", type=click.File("rb"), default="-")
+@click.option("--user", "email", help="Give the chats fresh ids and to the user with this email")
+def import_chats_command(input, email):
+    """Import the chats of an NDJSON export from INPUT, skipping the ones already stored."""
+    try:
+        counts = import_chats_repo(input, find_user_id(email) if email else None)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if counts is None:
+        raise click.ClickException("Import failed, see the log")
+    print(f"{counts['users']} users, {counts['chats']} chats, {counts['messages']} messages imported")
+
+def preload_models():
+    """Load what a worker's first chat would otherwise wait for.
+
+    That's the Ollama client and, when retrieval is on and there is an index, the
+    embedding model and the index. Called as a server worker starts (PRELOAD_MODELS).
+    A model that fails to load is loaded again on first use.
+    """
+    started = time.perf_counter()
+    # Importing it creates the client behind `ollama.chat`
+    import ollama
+
+    if RETRIEVAL_ENABLED and os.path.isdir(INDEX_DIR):
+        try:
+            get_embedder()
+            get_index()
+        except Exception as e:
+            logger.exception("Error preloading the embedding model")
+    logger.info("models preloaded", extra={"duration_ms": round((time.perf_counter() - started) * 1000, 2)})
+
+def import_job_modules():
+    """Import the libraries job handlers use, before `flask run-jobs` forks its workers.
+
+    The forked workers then share them. The model handles themselves are still loaded in
+    each worker, on first use: ONNX Runtime's thread pools and Chroma's SQLite connections
+    don't survive a fork.
+    """
+    for name in JOB_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("Job module not installed", extra={"module": name})
+
+def create_app() -> Flask:
+    app = Flask(__name__)
+    # Clients read the generation id to resume a dropped stream
+    CORS(app, expose_headers=[GENERATION_HEADER])
+
+    configure_logging()
+
+    # Configuration
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JWT_SECRET_KEY'] = os.getenv("JWT_SECRET_KEY")
+    app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
+    # Access tokens only carry the user id and expire quickly; clients renew them at /auth/refresh
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(minutes=int(os.getenv("JWT_ACCESS_TOKEN_MINUTES", 15)))
+    app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=int(os.getenv("JWT_REFRESH_TOKEN_DAYS", 30)))
+
+    # Verify that the keys are set
+    if not app.config['JWT_SECRET_KEY']:
+        raise RuntimeError("JWT_SECRET_KEY is not set. Please set it as an environment variable.")
+    if not app.config['SECRET_KEY']:
+        logger.warning("SECRET_KEY is not set. It's recommended to set it for enhanced security.")
+
+    # check if database exist
+    if not app.config['SQLALCHEMY_DATABASE_URI']:
+        raise RuntimeError("DATABASE_URL is not set. Please set it as an environment variable.")
+
+    # Connection pool sizing per worker process, see app/database.py
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    # Extensions initialization
+    db.init_app(app)
+    jwt.init_app(app)
+    job_queue.init_app(app)
+    if click.get_current_context(silent=True) is not None:
+        # Only the flask command runs migrations, servers don't need to import Alembic
+        from flask_migrate import Migrate
+
+        # The Postgres-only search column isn't part of the models, see app/search.py
+        Migrate(app, db, include_object=search.include_object)
+
+    app.register_blueprint(api)
+
+    with app.app_context():
+        instrument_engine(db.engine)
+        metrics.init_app(app, db.engine)
+    return app
+
 if __name__ == "__main__":
-    app.run(port=8000)
\ No newline at end of file
+    create_app().run(port=8000)
\ No newline at end of file
@@ -0,0 +1,156 @@
+# Prometheus metrics
+# Request latency per route, database time per request and LLM generation timings,
+# served in the Prometheus text format on GET /metrics.
+#
+# Routes are labelled with their URL rule (`/chats/<chat_id>`), never the raw path,
+# so the number of series stays bounded. For streamed replies the request histogram
+# measures the time until the response starts; how long the stream itself takes is in
+# the generation histograms.
+#
+# hypercorn runs several worker processes. Point PROMETHEUS_MULTIPROC_DIR at an empty
+# directory shared by the workers so that /metrics aggregates all of them instead of
+# whichever worker answers the scrape.
+
+import logging
+import os
+import time
+
+from flask import Response, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+
+from app.streaming import StreamAccumulator
+
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+GENERATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TOKEN_RATE_BUCKETS = (1, 2.5, 5, 10, 20, 40, 60, 100, 200)
+
+logger = logging.getLogger(__name__)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to produce a response, by route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds",
+    "Time spent in database statements while serving a request",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database statements executed while serving a request",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from sending the prompt to the first streamed token",
+    ["model"],
+    buckets=LATENCY_BUCKETS,
+)
+GENERATION_TIME = Histogram(
+    "llm_generation_seconds",
+    "Time from sending the prompt to the end of the reply",
+    ["model"],
+    buckets=GENERATION_BUCKETS,
+)
+TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second",
+    "Completion tokens per second after the first token",
+    ["model"],
+    buckets=TOKEN_RATE_BUCKETS,
+)
+GENERATED_TOKENS = Counter("llm_completion_tokens", "Completion tokens generated", ["model"])
+GENERATIONS = Counter("llm_generations", "Generations by outcome", ["model", "outcome"])
+
+
+def observe_request(method: str, route: str, status: int, duration: float, db_time: float = 0.0, db_queries: int = 0):
+    REQUEST_LATENCY.labels(method, route, str(status)).observe(duration)
+    REQUEST_DB_TIME.labels(method, route).observe(db_time)
+    REQUEST_DB_QUERIES.labels(method, route).observe(db_queries)
+    logger.info(
+        "request",
+        extra={
+            "method": method,
+            "route": route,
+            "status": status,
+            "duration_ms": round(duration * 1000, 2),
+            "db_ms": round(db_time * 1000, 2),
+            "db_queries": db_queries,
+        },
+    )
+
+
+def observe_generation(model: str, reply: StreamAccumulator):
+    """Record the timings of a live generation, whether it finished or was cut short."""
+    if not reply.done:
+        GENERATIONS.labels(model, "aborted").inc()
+        return
+    GENERATIONS.labels(model, "completed").inc()
+    GENERATION_TIME.labels(model).observe(reply.finished_at - reply.started_at)
+    if reply.first_token_at is not None:
+        TIME_TO_FIRST_TOKEN.labels(model).observe(reply.first_token_at - reply.started_at)
+    if reply.completion_tokens:
+        GENERATED_TOKENS.labels(model).inc(reply.completion_tokens)
+        if reply.first_token_at is not None and reply.finished_at > reply.first_token_at:
+            TOKENS_PER_SECOND.labels(model).observe(
+                reply.completion_tokens / (reply.finished_at - reply.first_token_at)
+            )
+
+
+def render_metrics() -> Response:
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+
+def route_label() -> str:
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def init_app(app, engine):
+    @app.before_request
+    def start_timer():
+        g.request_started_at = time.perf_counter()
+        g.db_time = 0.0
+        g.db_queries = 0
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("request_started_at", None)
+        if started is not None:
+            observe_request(
+                request.method,
+                route_label(),
+                response.status_code,
+                time.perf_counter() - started,
+                g.get("db_time", 0.0),
+                g.get("db_queries", 0),
+            )
+        return response
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_statement(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.statement_started_at = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_statement(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and "statement_started_at" in g:
+            g.db_time = g.get("db_time", 0.0) + time.perf_counter() - g.pop("statement_started_at")
+            g.db_queries = g.get("db_queries", 0) + 1
@@ -0,0 +1,10 @@
+# Database models
+# Importing this package registers every table on `db.metadata`, which is what
+# `flask db migrate` compares the database against.
+
+from app.models.chat import Chat, ChatMessage
+from app.models.document import DocumentFile, DocumentPage
+from app.models.job import Job
+from app.models.user import User
+
+__all__ = ["Chat", "ChatMessage", "DocumentFile", "DocumentPage", "Job", "User"]
@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from sqlalchemy import JSON, DateTime
+from sqlalchemy.dialects import postgresql
+
+from app.extensions import db
+
+
+class Chat(db.Model):
+    __tablename__ = "chat_history"
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
+    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    title = db.Column(db.String, index=True, nullable=False)
+    # Legacy transcript column, superseded by the append-only `chat_messages` table and
+    # emptied by migration d81f4b6c2e05 when run with CLEAR_LEGACY_TRANSCRIPTS=true. Never
+    # loaded unless asked for.
+    messages = db.deferred(db.Column(JSON().with_variant(postgresql.JSONB(), "postgresql")))
+    created_at = db.Column(DateTime, index=True, default=lambda: datetime.now(timezone.utc))
+    # Rolling summary of the turns before `summary_upto`, see app/context.py
+    summary = db.Column(db.Text)
+    summary_upto = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Bumped by every write to the transcript, it is the ETag of GET /chats/<id>
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    turns = db.relationship(
+        "ChatMessage",
+        order_by="ChatMessage.seq",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    __table_args__ = (
+        # Serves the keyset-paginated sidebar listing
+        db.Index("ix_chat_history_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
+    def __repr__(self):
+        return f"Message(id={self.id}, id={self.id}, title={self.title} turns={len(self.turns)})"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "title": self.title,
+            "messages": [turn.to_dict() for turn in self.turns],
+        }
+
+class ChatMessage(db.Model):
+    """A single turn of a chat. Rows are appended, and an edit deletes the turns from the edited one on; they are never rewritten."""
+    __tablename__ = "chat_messages"
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True, autoincrement=True)
+    chat_id = db.Column(db.String(36), db.ForeignKey('chat_history.id', ondelete="CASCADE"), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    role = db.Column(db.String(16), nullable=False)
+    content = db.Column(db.Text, nullable=False, default="")
+    created_at = db.Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    # Generation stats, only set on assistant turns
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    latency_ms = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.UniqueConstraint("chat_id", "seq", name="uq_chat_messages_chat_id_seq"),
+    )
+
+    def __repr__(self):
+        return f"ChatMessage(chat_id={self.chat_id}, seq={self.seq}, role={self.role})"
+
+    def to_dict(self):
+        return {
+            "role": self.role,
+            "content": self.content,
+        }
@@ -0,0 +1,36 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from sqlalchemy import DateTime
+
+from app.extensions import db
+
+
+class DocumentFile(db.Model):
+    """Ingestion manifest: one row per indexed document, keyed by file name."""
+    __tablename__ = "document_files"
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
+    source = db.Column(db.String, unique=True, index=True, nullable=False)
+    # Absolute path the document was last synced from
+    path = db.Column(db.String, nullable=True)
+    # Only this user can replace the file; None for documents synced from the folder
+    uploaded_by = db.Column(db.String(36), db.ForeignKey('users.id', ondelete="SET NULL"), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    page_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    pages = db.relationship("DocumentPage", cascade="all, delete-orphan", passive_deletes=True)
+
+    def __repr__(self):
+        return f"DocumentFile(source={self.source}, pages={self.page_count})"
+
+class DocumentPage(db.Model):
+    __tablename__ = "document_pages"
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True, autoincrement=True)
+    file_id = db.Column(db.String(36), db.ForeignKey('document_files.id', ondelete="CASCADE"), nullable=False)
+    page = db.Column(db.Integer, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)
+    chunk_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint("file_id", "page", name="uq_document_pages_file_id_page"),
+    )
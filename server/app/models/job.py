@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from sqlalchemy import JSON, DateTime
+
+from app.extensions import db
+from app.jobs import QUEUED
+
+
+class Job(db.Model):
+    """A unit of background work, see app/jobs.py."""
+    __tablename__ = "jobs"
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
+    kind = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=QUEUED)
+    payload = db.Column(JSON)
+    result = db.Column(JSON)
+    error = db.Column(db.Text)
+    progress = db.Column(db.Float, nullable=False, default=0.0)
+    progress_message = db.Column(db.String)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id', ondelete="CASCADE"), index=True)
+    dedupe_key = db.Column(db.String)
+    run_at = db.Column(DateTime(timezone=True), nullable=False)
+    locked_by = db.Column(db.String)
+    locked_at = db.Column(DateTime(timezone=True))
+    created_at = db.Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    started_at = db.Column(DateTime(timezone=True))
+    finished_at = db.Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        # Serves the workers' polling query
+        db.Index("ix_jobs_status_run_at", "status", "run_at"),
+        # At most one queued job per key
+        db.Index(
+            "uq_jobs_queued_dedupe_key",
+            "dedupe_key",
+            unique=True,
+            postgresql_where=db.text("status = 'queued'"),
+            sqlite_where=db.text("status = 'queued'"),
+        ),
+    )
+
+    def __repr__(self):
+        return f"Job(id={self.id}, kind={self.kind}, status={self.status})"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "progress_message": self.progress_message,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
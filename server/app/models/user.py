@@ -0,0 +1,27 @@
+from uuid import uuid4
+
+from app.extensions import db
+
+
+class User(db.Model):
+    __tablename__ = "users"
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
+    display_name = db.Column(db.String, index=True)
+    user_google_id = db.Column(db.String)
+    email = db.Column(db.String, unique=True, index=True)
+    photo_url = db.Column(db.String)
+
+    def __init__(self, user_google_id=None, display_name=None, email=None, photo_url=None):
+        self.user_google_id = user_google_id
+        self.display_name = display_name
+        self.email = email
+        self.photo_url = photo_url
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "email": self.email,
+            "photo_url": self.photo_url,
+            "display_name": self.display_name,
+            "user_google_id": self.user_google_id,
+        }
@@ -0,0 +1,174 @@
+# Chat replies
+# What every chat reply goes through, whichever entry point streams it. The Flask routes
+# in app/main.py run generations on threads with the sync Ollama client, app/asgi.py runs
+# them as tasks on the event loop with the async one. Only that transport differs:
+#
+# - The prompt is built. A reply to it in the response cache is replayed instead of
+#   generated, otherwise the request is admitted by the inference scheduler.
+# - The generation is registered, so clients can follow and resume it (app/generations.py).
+# - However it ends, its scheduler ticket is released and the model router and the
+#   metrics are told how it went.
+# - A finished reply is stored before [DONE] is sent, and added to the response cache.
+#
+# A transport calls `prepare`, `admit` or `admit_async`, `start`, then either `replay` or
+# `run`, and moves the chunks of the Ollama stream into `ReplyRun.add`.
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Optional
+
+from app.generations import Generation, GenerationRegistry
+from app.metrics import observe_generation
+from app.routing import ModelRouter
+from app.scheduler import InferenceScheduler, Ticket, prompt_size
+from app.streaming import StreamAccumulator, replay_chunks
+
+logger = logging.getLogger(__name__)
+
+
+class PreparedReply(NamedTuple):
+    # A cached reply to replay, or else the prompt to generate one from
+    cached: Optional[str]
+    prompt: Optional[list]
+
+
+class ReplyRun:
+    """The bookkeeping of one generation, from its first chunk to the release of its ticket.
+
+    The transport streams `request()` from Ollama into `add` until it returns True, then
+    calls `finish`. It calls `fail` when the stream raised, and always `close` last.
+    """
+
+    def __init__(self, replies: "ChatReplies", app, generation: Generation, prompt: list, messages: list,
+                 ticket: Ticket):
+        self.replies = replies
+        self.app = app
+        self.generation = generation
+        self.prompt = prompt
+        self.messages = messages
+        self.ticket = ticket
+        self.choice = replies.router.route("chat", prompt)
+        self.failed = False
+
+    def request(self) -> dict:
+        """Keyword arguments of the streaming Ollama chat call."""
+        return {
+            "model": self.choice.model,
+            "messages": self.prompt,
+            "options": self.choice.options,
+            "keep_alive": self.choice.keep_alive,
+            "stream": True,
+        }
+
+    def add(self, part) -> bool:
+        """Publish a chunk of the Ollama stream. Returns True once the stream should stop."""
+        self.generation.add(part)
+        return bool(part.get("done")) or self.generation.cancelled
+
+    def finish(self):
+        """Store the reply and end the stream. Blocks on the database."""
+        self.replies.finish(self.app, self.generation, self.messages)
+
+    def fail(self):
+        self.failed = True
+        logger.exception("Error streaming chat")
+        self.generation.fail("Error processing request")
+
+    def close(self):
+        reply = self.generation.reply
+        self.replies.scheduler.release(self.ticket)
+        self.replies.remember(self.prompt, self.generation.user_id, reply)
+        self.replies.router.observe(self.choice, reply, self.failed)
+        observe_generation(self.choice.model, reply)
+
+
+class ChatReplies:
+    def __init__(
+        self,
+        generations: GenerationRegistry,
+        scheduler: InferenceScheduler,
+        router: ModelRouter,
+        options: dict,
+        build_prompt: Callable,
+        save_turn: Callable,
+        response_cache=None,
+        index_version: Optional[Callable[[], str]] = None,
+    ):
+        """`build_prompt(app, messages, chat_id, user_id)` returns the prompt for a turn and
+        `save_turn(app, chat_id, user_id, messages, reply)` stores a finished one.
+        """
+        self.generations = generations
+        self.scheduler = scheduler
+        self.router = router
+        self.options = options
+        self.build_prompt = build_prompt
+        self.save_turn = save_turn
+        self.response_cache = response_cache
+        self.index_version = index_version
+        # Finished replies are added to the response cache here rather than on the streaming path
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-persist")
+
+    def lookup(self, prompt: list, user_id: str) -> Optional[str]:
+        if self.response_cache is None:
+            return None
+        try:
+            return self.response_cache.lookup(
+                self.router.signature("chat"), self.options, self.index_version(), user_id, prompt
+            )
+        except Exception as e:
+            logger.exception("Error reading response cache")
+            return None
+
+    def store(self, prompt: list, user_id: str, content: str):
+        try:
+            self.response_cache.store(
+                self.router.signature("chat"), self.options, self.index_version(), user_id, prompt, content
+            )
+        except Exception as e:
+            logger.exception("Error writing response cache")
+
+    def remember(self, prompt: list, user_id: str, reply: StreamAccumulator):
+        """Add a finished generation to the response cache, on the background executor."""
+        if self.response_cache is not None and reply.done:
+            self.executor.submit(self.store, list(prompt), user_id, reply.content)
+
+    def prepare(self, app, messages: list, chat_id: Optional[str], user_id: str) -> PreparedReply:
+        """Build the prompt and look its reply up in the response cache. Blocks on the
+        database, the embedder and the index."""
+        prompt = self.build_prompt(app, messages, chat_id, user_id)
+        cached = self.lookup(prompt, user_id)
+        if cached is not None:
+            return PreparedReply(cached, None)
+        return PreparedReply(None, prompt)
+
+    def admit(self, user_id: str, prompt: list) -> Ticket:
+        return self.scheduler.acquire(user_id, prompt_size(prompt))
+
+    async def admit_async(self, user_id: str, prompt: list) -> Ticket:
+        return await self.scheduler.acquire_async(user_id, prompt_size(prompt))
+
+    def start(self, user_id: str, chat_id: Optional[str]) -> Generation:
+        return self.generations.start(user_id, chat_id)
+
+    def run(self, app, generation: Generation, prompt: list, messages: list, ticket: Ticket) -> ReplyRun:
+        return ReplyRun(self, app, generation, prompt, messages, ticket)
+
+    def finish(self, app, generation: Generation, messages: list):
+        """Store a finished reply and end its stream with [DONE]. A cancelled one just ends."""
+        if generation.reply.done:
+            # Stored before [DONE], so a follow-up turn sent right after it reads the reply back
+            if generation.chat_id:
+                self.save_turn(app, generation.chat_id, generation.user_id, list(messages), generation.reply)
+            generation.complete()
+        else:
+            generation.close()
+
+    def replay(self, app, generation: Generation, content: str, messages: list):
+        """Publish a reply from the response cache as `generation`, and store it. Blocks on the database."""
+        try:
+            for part in replay_chunks(content):
+                generation.add(part)
+            self.finish(app, generation, messages)
+        except Exception as e:
+            logger.exception("Error replaying chat")
+            generation.fail("Error processing request")
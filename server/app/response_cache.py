@@ -0,0 +1,188 @@
+# Semantic response cache
+# Opt-in cache of finished replies, so a prompt that was already answered can be
+# replayed instead of paying for another generation on Ollama.
+#
+# Entries are keyed on the prompt the model was actually given, after the context window,
+# the chat summary and the document excerpts were added, and partitioned by model,
+# generation options and document index version. A cached reply is only reused under the
+# exact settings it was generated with and never outlives the documents it may have quoted.
+#
+# - A request whose whole prompt is identical to an earlier one gets its reply, whoever
+#   asked: the reply only depends on what the requester sent and may already read.
+# - Otherwise a reply is reused when the conversation tail's embedding has a cosine
+#   similarity of at least RESPONSE_CACHE_THRESHOLD with an earlier one. Only replies to the
+#   same user, with the same prompt before the tail (system prompt, summary, excerpts),
+#   are considered, so a reply never carries another user's private context.
+#
+# Enable with RESPONSE_CACHE_ENABLED=true. Entries are per process. numpy is only imported
+# by an enabled cache.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 3600))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 512))
+# How many trailing messages of the conversation make up the cache key
+RESPONSE_CACHE_TAIL = int(os.getenv("RESPONSE_CACHE_TAIL", 3))
+
+
+class CachedResponse:
+    def __init__(self, partition: str, digest: str, exact_key: str, vector: "np.ndarray", content: str,
+                 expires_at: float):
+        self.partition = partition
+        self.digest = digest
+        self.exact_key = exact_key
+        self.vector = vector
+        self.content = content
+        self.expires_at = expires_at
+
+
+def conversation_text(messages: list) -> str:
+    return "\n".join(
+        f"{message.get('role', '')}: {message.get('content', '')}"
+        for message in messages
+        if isinstance(message, dict)
+    )
+
+
+def conversation_tail(messages: list, size: int = RESPONSE_CACHE_TAIL) -> str:
+    return conversation_text(messages[-size:])
+
+
+def digest_of(messages: list) -> str:
+    turns = [[message.get("role", ""), message.get("content", "")] for message in messages if isinstance(message, dict)]
+    return hashlib.sha256(json.dumps(turns).encode()).hexdigest()
+
+
+def partition_key(model: str, options: dict, index_version: str) -> str:
+    return f"{model}|{json.dumps(options, sort_keys=True)}|{index_version}"
+
+
+def keys(model: str, options: dict, index_version: str, user_id: str, prompt: list, size: int = RESPONSE_CACHE_TAIL):
+    """The exact key of `prompt`, the partition its tail is compared in, and the tail."""
+    base = partition_key(model, options, index_version)
+    exact_key = f"{base}|{digest_of(prompt)}"
+    partition = f"{base}|{user_id}|{digest_of(prompt[:-size] if size else prompt)}"
+    return exact_key, partition, conversation_tail(prompt, size)
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        embed: Callable[[str], list],
+        threshold: float = RESPONSE_CACHE_THRESHOLD,
+        ttl: int = RESPONSE_CACHE_TTL_SECONDS,
+        max_entries: int = RESPONSE_CACHE_SIZE,
+    ):
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # partition -> tail digest -> entry, with the least recently used entries first
+        self._partitions: "OrderedDict[str, OrderedDict]" = OrderedDict()
+        # exact key -> the latest entry stored for that whole prompt, by any user
+        self._exact: Dict[str, CachedResponse] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _vector(self, text: str) -> "np.ndarray":
+        import numpy as np
+
+        vector = np.asarray(self.embed(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, entries: "OrderedDict", now: float):
+        for digest in [digest for digest, entry in entries.items() if entry.expires_at <= now]:
+            self._drop(entries.pop(digest))
+
+    def _drop(self, entry: CachedResponse):
+        self._size -= 1
+        if self._exact.get(entry.exact_key) is entry:
+            del self._exact[entry.exact_key]
+
+    def _touch(self, entry: CachedResponse):
+        entries = self._partitions.get(entry.partition)
+        if entries is not None and entries.get(entry.digest) is entry:
+            entries.move_to_end(entry.digest)
+            self._partitions.move_to_end(entry.partition)
+
+    def lookup(self, model: str, options: dict, index_version: str, user_id: str, prompt: list) -> Optional[str]:
+        """The cached reply to `prompt`, built for `user_id`, or None."""
+        exact_key, partition, tail = keys(model, options, index_version, user_id, prompt)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._exact.get(exact_key)
+            if entry is not None and entry.expires_at > now:
+                self._touch(entry)
+                self.exact_hits += 1
+                return entry.content
+            entries = self._partitions.get(partition)
+            if entries:
+                self._expire(entries, now)
+            candidates: List[CachedResponse] = list(entries.values()) if entries else []
+
+        if candidates:
+            import numpy as np
+
+            query = self._vector(tail)
+            similarities = np.stack([candidate.vector for candidate in candidates]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                with self._lock:
+                    self.semantic_hits += 1
+                return candidates[best].content
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, model: str, options: dict, index_version: str, user_id: str, prompt: list, content: str):
+        if not content:
+            return
+        exact_key, partition, tail = keys(model, options, index_version, user_id, prompt)
+        digest = hashlib.sha256(tail.encode()).hexdigest()
+        entry = CachedResponse(partition, digest, exact_key, self._vector(tail), content, time.monotonic() + self.ttl)
+
+        with self._lock:
+            entries = self._partitions.setdefault(partition, OrderedDict())
+            previous = entries.pop(digest, None)
+            if previous is not None:
+                self._drop(previous)
+            entries[digest] = entry
+            self._exact[exact_key] = entry
+            self._size += 1
+            self._partitions.move_to_end(partition)
+            while self._size > self.max_entries:
+                oldest_key, oldest = next(iter(self._partitions.items()))
+                if oldest:
+                    self._drop(oldest.popitem(last=False)[1])
+                if not oldest:
+                    del self._partitions[oldest_key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": self._size,
+                "max_entries": self.max_entries,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+            }
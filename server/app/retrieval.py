@@ -0,0 +1,247 @@
+# Retrieval module
+# Embeds document chunks on the CPU and keeps them in an on-disk Chroma index, then
+# looks up the chunks closest to a user's question so they can be put in the prompt.
+#
+# Chunks are embedded in batches straight off the ingestion stream, so building the
+# index never holds more than one batch of chunks and vectors in memory. The embedding
+# model and the index client are loaded on first use, once per process.
+#
+# Query embeddings and retrieval results are cached (see app/cache.py). Result keys
+# include the index version, a counter stored next to the index that every write bumps,
+# so any process that updates the index invalidates every worker's cached results.
+
+import logging
+import os
+import re
+import threading
+import uuid
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+from app.cache import TieredCache, backend_from_env
+from app.document_ingestion import DATA_DIR, Chunk
+
+
+INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(DATA_DIR, "index"))
+COLLECTION_NAME = "documents"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 4))
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "true").lower() == "true"
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", 1024))
+
+logger = logging.getLogger(__name__)
+
+_cache_backend = backend_from_env()
+embedding_cache = TieredCache("query-embedding", max_entries=RETRIEVAL_CACHE_SIZE, backend=_cache_backend)
+retrieval_cache = TieredCache("retrieval", max_entries=RETRIEVAL_CACHE_SIZE, backend=_cache_backend)
+
+
+def normalize_query(text: str) -> str:
+    """Fold the trivial differences between near-identical questions."""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip("?!. ")
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def chunk_id(chunk: Chunk) -> str:
+    return f"{chunk.source}:{chunk.page}:{chunk.index}"
+
+
+class Embedder:
+    def __init__(self, model_name: str = EMBEDDING_MODEL, batch_size: int = EMBED_BATCH_SIZE):
+        from fastembed import TextEmbedding
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = TextEmbedding(model_name=model_name)
+
+    def embed_documents(self, texts: List[str]) -> List[list]:
+        return [vector.tolist() for vector in self.model.embed(texts, batch_size=self.batch_size)]
+
+    def embed_query(self, text: str) -> list:
+        return next(iter(self.model.query_embed(text))).tolist()
+
+
+_embedder: Optional[Embedder] = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> Embedder:
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = Embedder()
+        return _embedder
+
+
+def embed_query(text: str, embedder: Optional[Embedder] = None) -> list:
+    """Embed a query, reusing the vector of any earlier query that normalizes the same."""
+    # Keyed without loading the model, so a cache hit never pays for it
+    model_name = embedder.model_name if embedder is not None else EMBEDDING_MODEL
+    key = f"{model_name}:{normalize_query(text)}"
+    vector = embedding_cache.get(key)
+    if vector is None:
+        vector = (embedder or get_embedder()).embed_query(text)
+        embedding_cache.set(key, vector)
+    return vector
+
+
+class VectorIndex:
+    def __init__(self, path: str = INDEX_DIR, embedder: Optional[Embedder] = None):
+        import chromadb
+
+        self.path = path
+        self._embedder = embedder
+        self._version_file = os.path.join(path, "VERSION")
+        self._version = (None, None)
+        self.client = chromadb.PersistentClient(path=path)
+        self.collection = self.client.get_or_create_collection(
+            COLLECTION_NAME,
+            embedding_function=None,
+            metadata={"hnsw:space": "cosine"},
+        )
+
+    @property
+    def embedder(self) -> Embedder:
+        return self._embedder or get_embedder()
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def version(self) -> str:
+        """The current index version; re-read only when the version file changes."""
+        try:
+            mtime = os.stat(self._version_file).st_mtime_ns
+        except FileNotFoundError:
+            return "0"
+        if self._version[0] != mtime:
+            with open(self._version_file) as f:
+                self._version = (mtime, f.read().strip())
+            retrieval_cache.clear_local()
+        return self._version[1]
+
+    def bump_version(self):
+        temporary = f"{self._version_file}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(temporary, self._version_file)
+
+    def add_chunks(self, chunks: Iterable[Chunk], batch_size: int = EMBED_BATCH_SIZE) -> int:
+        added = 0
+        for batch in batched(chunks, batch_size):
+            self.collection.upsert(
+                ids=[chunk_id(chunk) for chunk in batch],
+                embeddings=self.embedder.embed_documents([chunk.text for chunk in batch]),
+                documents=[chunk.text for chunk in batch],
+                metadatas=[{"source": chunk.source, "page": chunk.page, "index": chunk.index} for chunk in batch],
+            )
+            added += len(batch)
+        if added:
+            self.bump_version()
+        return added
+
+    def delete_pages(self, source: str, pages: Iterable[int]):
+        pages = list(pages)
+        if pages:
+            self.collection.delete(where={"$and": [{"source": source}, {"page": {"$in": pages}}]})
+            self.bump_version()
+
+    def delete_source(self, source: str):
+        self.collection.delete(where={"source": source})
+        self.bump_version()
+
+    def embed_query(self, text: str) -> list:
+        return embed_query(text, self._embedder)
+
+    def query(self, text: str, k: int = RETRIEVAL_TOP_K) -> List[dict]:
+        key = f"{self.version()}:{k}:{normalize_query(text)}"
+        results = retrieval_cache.get(key)
+        if results is None:
+            results = self.search(text, k)
+            retrieval_cache.set(key, results)
+        return results
+
+    def search(self, text: str, k: int = RETRIEVAL_TOP_K) -> List[dict]:
+        count = self.count()
+        if count == 0:
+            return []
+        result = self.collection.query(
+            query_embeddings=[self.embed_query(text)],
+            n_results=min(k, count),
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            {
+                "text": document,
+                "source": metadata["source"],
+                "page": metadata["page"],
+                "score": 1 - distance,
+            }
+            for document, metadata, distance in zip(
+                result["documents"][0], result["metadatas"][0], result["distances"][0]
+            )
+        ]
+
+
+_index: Optional[VectorIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> VectorIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VectorIndex()
+        return _index
+
+
+def current_index_version() -> str:
+    if not os.path.isdir(INDEX_DIR):
+        return "0"
+    return get_index().version()
+
+
+def build_context_message(results: List[dict]) -> dict:
+    sources = "\n\n".join(
+        f"[{result['source']}, page {result['page'] + 1}]\n{result['text']}" for result in results
+    )
+    return {
+        "role": "system",
+        "content": (
+            "Answer using the following excerpts from the organization's documents when they are "
+            "relevant, and say which document you used.\n\n" + sources
+        ),
+    }
+
+
+def augment_messages(messages: list, k: int = RETRIEVAL_TOP_K) -> list:
+    """Return the prompt for `messages` with the top-k document chunks injected before the last turn."""
+    if not RETRIEVAL_ENABLED or not messages or not os.path.isdir(INDEX_DIR):
+        return messages
+
+    question = messages[-1].get("content", "") if isinstance(messages[-1], dict) else ""
+    if not question:
+        return messages
+
+    try:
+        results = get_index().query(question, k=k)
+    except Exception as e:
+        logger.exception("Error retrieving context")
+        return messages
+
+    if not results:
+        return messages
+    return messages[:-1] + [build_context_message(results), messages[-1]]
+
+
+def cache_stats() -> dict:
+    return {
+        "query_embedding": embedding_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+    }
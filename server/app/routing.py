@@ -0,0 +1,306 @@
+# Model routing
+# Picks the Ollama model for every generation, caps how many tokens it may produce and
+# keeps the routed models loaded.
+#
+# Routes are read from MODEL_ROUTES, a JSON list, cheapest model first:
+#
+#     [{"model": "llama3.2:1b", "tasks": ["title", "summary", "chat"], "max_prompt_chars": 4000},
+#      {"model": "llama3.1:8b", "tasks": ["chat"], "num_predict": 1500}]
+#
+# A generation for a task (chat, summary or title) can go to any route that serves the
+# task and whose `max_prompt_chars` fits its prompt. Among those, the router picks the one
+# expected to finish first. The estimate uses per-model moving averages of Ollama's own
+# timings (prompt tokens/s, generated tokens/s, reply length, load time) and of the
+# failure rate. A route whose model has not served, failed or started a generation yet
+# is tried before the others, in listed order. When no route fits a prompt, the one
+# taking the longest prompts gets it. Without MODEL_ROUTES, every task goes to its own
+# model (CHAT_MODEL, SUMMARY_MODEL, TITLE_MODEL).
+#
+# `num_predict` caps the generated tokens: the task's cap, or the route's own if lower.
+#
+# Ollama unloads a model once it has been idle for its keep-alive, and the next request
+# waits for it to load again. Every request asks for MODEL_KEEP_ALIVE seconds. A thread
+# in each process pings the routed models that have been idle for MODEL_KEEPALIVE_INTERVAL
+# seconds with an empty generation, which loads a model without generating anything.
+# Routes with `"warm": false` are left to load on demand. Stats are per process.
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.scheduler import prompt_size
+from app.streaming import StreamAccumulator
+
+
+TASKS = ("chat", "summary", "title")
+MODEL_KEEP_ALIVE = int(os.getenv("MODEL_KEEP_ALIVE", 1800))
+MODEL_KEEPALIVE_INTERVAL = float(os.getenv("MODEL_KEEPALIVE_INTERVAL", 300))
+# Rough size of a token, to turn a prompt's length into an evaluation time
+CHARS_PER_TOKEN = 4
+# Weight of the latest sample in the moving averages
+STATS_WEIGHT = 0.2
+# Prompts shorter than this evaluate too fast to time, they don't count toward the prompt rate
+MIN_TIMED_PROMPT_TOKENS = 64
+# A load slower than this means the model wasn't loaded
+COLD_LOAD_SECONDS = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    model: str
+    tasks: Tuple[str, ...] = TASKS
+    max_prompt_chars: Optional[int] = None
+    num_predict: Optional[int] = None
+    warm: bool = True
+
+
+class ModelChoice(NamedTuple):
+    task: str
+    model: str
+    options: dict
+    keep_alive: int
+
+
+class MovingAverage:
+    def __init__(self, weight: float = STATS_WEIGHT):
+        self.weight = weight
+        self.value: Optional[float] = None
+
+    def add(self, sample: float):
+        self.value = sample if self.value is None else self.value + self.weight * (sample - self.value)
+
+
+class ModelStats:
+    def __init__(self):
+        self.prompt_rate = MovingAverage()
+        self.eval_rate = MovingAverage()
+        self.reply_tokens = MovingAverage()
+        self.load_seconds = MovingAverage()
+        self.failure_rate = MovingAverage()
+        self.generations = 0
+        self.failures = 0
+        self.cold_loads = 0
+        self.pings = 0
+        self.in_flight = 0
+        # Last time this process sent the model a request or a ping (monotonic)
+        self.last_warmed = 0.0
+
+    def snapshot(self) -> dict:
+        def rounded(average: MovingAverage, digits: int = 2):
+            return round(average.value, digits) if average.value is not None else None
+
+        return {
+            "generations": self.generations,
+            "failures": self.failures,
+            "cold_loads": self.cold_loads,
+            "pings": self.pings,
+            "in_flight": self.in_flight,
+            "prompt_tokens_per_second": rounded(self.prompt_rate, 1),
+            "tokens_per_second": rounded(self.eval_rate, 1),
+            "reply_tokens": rounded(self.reply_tokens, 1),
+            "load_seconds": rounded(self.load_seconds),
+            "failure_rate": rounded(self.failure_rate, 3),
+            "idle_seconds": round(time.monotonic() - self.last_warmed, 1) if self.last_warmed else None,
+        }
+
+
+def default_routes(models: Dict[str, str]) -> List[ModelRoute]:
+    """One route per model, serving the tasks mapped to it in `models` (task -> model)."""
+    tasks: Dict[str, List[str]] = {}
+    for task, model in models.items():
+        tasks.setdefault(model, []).append(task)
+    return [ModelRoute(model=model, tasks=tuple(model_tasks)) for model, model_tasks in tasks.items()]
+
+
+def routes_from_env(default: List[ModelRoute], raw: Optional[str] = None) -> List[ModelRoute]:
+    raw = raw if raw is not None else os.getenv("MODEL_ROUTES")
+    if not raw:
+        return default
+    try:
+        return [
+            ModelRoute(
+                model=entry["model"],
+                tasks=tuple(entry.get("tasks", TASKS)),
+                max_prompt_chars=entry.get("max_prompt_chars"),
+                num_predict=entry.get("num_predict"),
+                warm=entry.get("warm", True),
+            )
+            for entry in json.loads(raw)
+        ]
+    except (ValueError, TypeError, KeyError) as e:
+        raise RuntimeError(f"Invalid MODEL_ROUTES: {e}") from e
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        routes: List[ModelRoute],
+        task_options: Dict[str, dict],
+        keep_alive: int = MODEL_KEEP_ALIVE,
+        keepalive_interval: float = MODEL_KEEPALIVE_INTERVAL,
+    ):
+        for task in task_options:
+            if not any(task in route.tasks for route in routes):
+                raise RuntimeError(f"No model route serves {task} generations")
+        self.routes = routes
+        self.task_options = task_options
+        self.keep_alive = keep_alive
+        self.keepalive_interval = keepalive_interval
+        self.stats: Dict[str, ModelStats] = {route.model: ModelStats() for route in routes}
+        self._lock = threading.Lock()
+        self._keepalive_pid: Optional[int] = None
+
+    def signature(self, task: str) -> str:
+        """The models that may serve `task`, for keying what their replies are cached under."""
+        return "|".join(route.model for route in self.routes if task in route.tasks)
+
+    def options(self, route: ModelRoute, task: str) -> dict:
+        options = dict(self.task_options[task])
+        if route.num_predict is not None:
+            options["num_predict"] = min(route.num_predict, options.get("num_predict", route.num_predict))
+        return options
+
+    def estimate(self, route: ModelRoute, task: str, prompt_chars: int) -> Optional[float]:
+        """Seconds a generation on `route` is expected to take, or None before it has any stats."""
+        stats = self.stats[route.model]
+        if stats.eval_rate.value is None:
+            return None
+        num_predict = self.options(route, task).get("num_predict")
+        reply_tokens = stats.reply_tokens.value or 0.0
+        if num_predict is not None:
+            reply_tokens = min(reply_tokens, num_predict)
+        seconds = reply_tokens / stats.eval_rate.value
+        if stats.prompt_rate.value:
+            seconds += prompt_chars / CHARS_PER_TOKEN / stats.prompt_rate.value
+        if stats.load_seconds.value and time.monotonic() - stats.last_warmed > self.keep_alive:
+            seconds += stats.load_seconds.value
+        # Failed generations are paid for and then retried
+        return seconds / max(1.0 - (stats.failure_rate.value or 0.0), 0.1)
+
+    def route(self, task: str, prompt: list) -> ModelChoice:
+        """Choose the model for a generation of `task` from `prompt`."""
+        self.start_keepalive()
+        size = prompt_size(prompt)
+        serving = [route for route in self.routes if task in route.tasks]
+        if not serving:
+            raise ValueError(f"No model route serves {task} generations")
+        candidates = [route for route in serving if route.max_prompt_chars is None or size <= route.max_prompt_chars]
+        if not candidates:
+            candidates = [max(serving, key=lambda route: route.max_prompt_chars)]
+
+        with self._lock:
+            estimates = [(self.estimate(route, task, size), route) for route in candidates]
+            untried = [
+                route for estimate, route in estimates
+                if estimate is None and not self.stats[route.model].in_flight and not self.stats[route.model].failures
+            ]
+            known = [(estimate, route) for estimate, route in estimates if estimate is not None]
+            if untried:
+                chosen = untried[0]
+            elif known:
+                chosen = min(known, key=lambda pair: pair[0])[1]
+            else:
+                # No candidate has finished a generation yet
+                chosen = candidates[0]
+            stats = self.stats[chosen.model]
+            stats.in_flight += 1
+            stats.last_warmed = time.monotonic()
+        return ModelChoice(task, chosen.model, self.options(chosen, task), self.keep_alive)
+
+    def observe(self, choice: ModelChoice, reply: StreamAccumulator, failed: bool = False):
+        """Feed a finished, failed or abandoned generation back into the stats of its model.
+
+        Every routed generation has to be observed, it counts as under way until then.
+        """
+        stats = self.stats.get(choice.model)
+        if stats is None:
+            return
+        with self._lock:
+            stats.in_flight -= 1
+            if failed:
+                stats.failures += 1
+                stats.failure_rate.add(1.0)
+                return
+            if not reply.done:
+                # The client left, which says nothing about the model
+                return
+            stats.generations += 1
+            stats.failure_rate.add(0.0)
+            if (reply.prompt_tokens or 0) >= MIN_TIMED_PROMPT_TOKENS and reply.prompt_eval_seconds:
+                stats.prompt_rate.add(reply.prompt_tokens / reply.prompt_eval_seconds)
+            if reply.completion_tokens:
+                stats.reply_tokens.add(reply.completion_tokens)
+                seconds = reply.eval_seconds
+                if not seconds and reply.first_token_at is not None:
+                    seconds = reply.finished_at - reply.first_token_at
+                if seconds:
+                    stats.eval_rate.add(reply.completion_tokens / seconds)
+            self._observe_load(stats, reply.load_seconds)
+
+    def _observe_load(self, stats: ModelStats, load_seconds: Optional[float]):
+        if load_seconds is not None and load_seconds >= COLD_LOAD_SECONDS:
+            stats.cold_loads += 1
+            stats.load_seconds.add(load_seconds)
+
+    def ping(self, model: str):
+        """Load `model` on Ollama, or keep it loaded, without generating anything."""
+        import ollama
+
+        response = ollama.generate(model=model, prompt="", keep_alive=self.keep_alive)
+        load_duration = response.get("load_duration")
+        with self._lock:
+            stats = self.stats[model]
+            stats.pings += 1
+            stats.last_warmed = time.monotonic()
+            self._observe_load(stats, load_duration / 1e9 if load_duration else None)
+
+    def keep_warm(self):
+        """Ping every warm route's model that has been idle for the keep-alive interval."""
+        models = list(dict.fromkeys(route.model for route in self.routes if route.warm))
+        for model in models:
+            if time.monotonic() - self.stats[model].last_warmed < self.keepalive_interval:
+                continue
+            try:
+                self.ping(model)
+            except Exception:
+                logger.warning("Model keep-alive ping failed", exc_info=True, extra={"model": model})
+
+    def start_keepalive(self):
+        """Start this process' keep-alive thread, once per process. It warms the models right away."""
+        if self.keepalive_interval <= 0 or self._keepalive_pid == os.getpid():
+            return
+        with self._lock:
+            if self._keepalive_pid == os.getpid():
+                return
+            self._keepalive_pid = os.getpid()
+
+        def run():
+            while True:
+                self.keep_warm()
+                time.sleep(self.keepalive_interval)
+
+        threading.Thread(target=run, name="model-keepalive", daemon=True).start()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "keep_alive": self.keep_alive,
+                "keepalive_interval": self.keepalive_interval,
+                "routes": [
+                    {
+                        "model": route.model,
+                        "tasks": list(route.tasks),
+                        "max_prompt_chars": route.max_prompt_chars,
+                        "num_predict": route.num_predict,
+                        "warm": route.warm,
+                    }
+                    for route in self.routes
+                ],
+                "models": {model: stats.snapshot() for model, stats in self.stats.items()},
+            }
@@ -0,0 +1,217 @@
+# Inference scheduler
+# Admission control between the chat routes and the local Ollama server.
+#
+# - A bounded pool of generation slots. Ollama batches up to OLLAMA_NUM_PARALLEL
+#   concurrent requests per loaded model, so sizing the pool to match keeps the
+#   model server saturated without queueing work inside it where nobody can see it.
+# - Per-user fair queuing: waiting requests sit in one FIFO per user and freed slots
+#   are handed out round-robin across users, so one user's burst can't starve others.
+# - Short prompts go first, unless a longer one has already waited `max_short_bypass`.
+# - Bounded queue depth (globally and per user) and a wait-time limit. Rejections raise
+#   `SchedulerBusy` with a Retry-After estimate that the routes turn into a 429.
+#
+# The scheduler knows nothing about Ollama itself, so it can be driven against a fake
+# model server by pointing OLLAMA_HOST at it. It is safe to use from both WSGI threads
+# and the asyncio streaming path. Limits apply per process (i.e. per hypercorn worker).
+
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+
+
+class SchedulerBusy(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    def __init__(self, user_id: str, prompt_size: int):
+        self.user_id = user_id
+        self.prompt_size = prompt_size
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.granted = False
+        self.released = False
+        self.wake: Callable[[], None] = lambda: None
+
+
+def prompt_size(messages: list) -> int:
+    """Size of a chat request in characters, the cheapest proxy for prompt eval cost."""
+    return sum(len(str(message.get("content", ""))) for message in messages if isinstance(message, dict))
+
+
+class InferenceScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = 2,
+        max_queue_depth: int = 64,
+        max_queue_per_user: int = 4,
+        max_wait: float = 30.0,
+        short_prompt_chars: int = 2000,
+        max_short_bypass: float = 5.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_per_user = max_queue_per_user
+        self.max_wait = max_wait
+        self.short_prompt_chars = short_prompt_chars
+        self.max_short_bypass = max_short_bypass
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._depth = 0
+        # user_id -> waiting tickets; dict order is the round-robin order
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        # Moving average of how long a generation holds a slot, for Retry-After estimates
+        self._service_time = 5.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def retry_after(self) -> int:
+        rounds = self._depth / self.max_concurrency + 1
+        return max(1, math.ceil(rounds * self._service_time))
+
+    def _enqueue(self, user_id: str, size: int) -> Ticket:
+        ticket = Ticket(user_id, size)
+        with self._lock:
+            if self._active < self.max_concurrency and self._depth == 0:
+                self._grant(ticket)
+                return ticket
+
+            queue = self._queues.get(user_id)
+            if self._depth >= self.max_queue_depth:
+                self.rejected += 1
+                raise SchedulerBusy("Inference queue is full", self.retry_after())
+            if queue is not None and len(queue) >= self.max_queue_per_user:
+                self.rejected += 1
+                raise SchedulerBusy("Too many requests queued for this user", self.retry_after())
+
+            self._queues.setdefault(user_id, deque()).append(ticket)
+            self._depth += 1
+            return ticket
+
+    def _grant(self, ticket: Ticket):
+        # Caller holds the lock
+        ticket.granted = True
+        ticket.started_at = time.monotonic()
+        self._active += 1
+        self.admitted += 1
+
+    def _next_ticket(self) -> Optional[Ticket]:
+        # Caller holds the lock
+        if not self._queues:
+            return None
+
+        heads = [(user_id, queue[0]) for user_id, queue in self._queues.items()]
+        oldest = min(heads, key=lambda head: head[1].enqueued_at)
+        chosen = heads[0]
+        if time.monotonic() - oldest[1].enqueued_at >= self.max_short_bypass:
+            chosen = oldest
+        else:
+            for head in heads:
+                if head[1].prompt_size <= self.short_prompt_chars:
+                    chosen = head
+                    break
+
+        user_id, _ = chosen
+        queue = self._queues[user_id]
+        ticket = queue.popleft()
+        self._depth -= 1
+        if queue:
+            self._queues.move_to_end(user_id)
+        else:
+            del self._queues[user_id]
+        return ticket
+
+    def _remove(self, ticket: Ticket):
+        # Caller holds the lock
+        queue = self._queues.get(ticket.user_id)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            self._depth -= 1
+            if not queue:
+                del self._queues[ticket.user_id]
+
+    def release(self, ticket: Ticket):
+        """Give a slot back and hand it to the next waiting request. Safe to call twice."""
+        with self._lock:
+            if not ticket.granted or ticket.released:
+                return
+            ticket.released = True
+            self._active -= 1
+            held = time.monotonic() - ticket.started_at
+            self._service_time = 0.8 * self._service_time + 0.2 * held
+
+            woken = []
+            while self._active < self.max_concurrency:
+                waiting = self._next_ticket()
+                if waiting is None:
+                    break
+                self._grant(waiting)
+                woken.append(waiting)
+        for waiting in woken:
+            waiting.wake()
+
+    def _abandon(self, ticket: Ticket, reason: str) -> bool:
+        """Drop a ticket that stopped waiting. Returns True if it was granted in the meantime."""
+        with self._lock:
+            if ticket.granted:
+                return True
+            self._remove(ticket)
+            if reason == "timeout":
+                self.timed_out += 1
+            return False
+
+    def acquire(self, user_id: str, size: int) -> Ticket:
+        """Block the calling thread until a slot is free."""
+        ticket = self._enqueue(user_id, size)
+        if ticket.granted:
+            return ticket
+
+        granted = threading.Event()
+        ticket.wake = granted.set
+        if ticket.granted:
+            return ticket
+        if not granted.wait(self.max_wait) and not self._abandon(ticket, "timeout"):
+            raise SchedulerBusy("Timed out waiting for an inference slot", self.retry_after())
+        return ticket
+
+    async def acquire_async(self, user_id: str, size: int) -> Ticket:
+        """Wait on the event loop until a slot is free."""
+        ticket = self._enqueue(user_id, size)
+        if ticket.granted:
+            return ticket
+
+        loop = asyncio.get_running_loop()
+        granted = asyncio.Event()
+        ticket.wake = lambda: loop.call_soon_threadsafe(granted.set)
+        if ticket.granted:
+            return ticket
+        try:
+            await asyncio.wait_for(granted.wait(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if not self._abandon(ticket, "timeout"):
+                raise SchedulerBusy("Timed out waiting for an inference slot", self.retry_after())
+        except asyncio.CancelledError:
+            if self._abandon(ticket, "cancelled"):
+                self.release(ticket)
+            raise
+        return ticket
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "active": self._active,
+                "queued": self._depth,
+                "queued_users": len(self._queues),
+                "max_concurrency": self.max_concurrency,
+                "service_time_seconds": round(self._service_time, 3),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
@@ -0,0 +1,100 @@
+# Chat search
+# Full-text search over the messages of a user's chats, for GET /chats/search.
+#
+# On Postgres every message has a `search_vector` column, generated from its content with
+# the `english` text search configuration and indexed with GIN. Queries use web search
+# syntax ("quoted phrases", -excluded words, or). Matches are ranked with ts_rank_cd,
+# which ranks terms that appear close together higher, and ts_headline marks them in a
+# snippet. Snippets are only built for the page that is returned, because ts_headline
+# has to parse the message again.
+#
+# The column and its index only exist on Postgres: they are created by a migration and
+# are not part of the models, so `include_object` keeps autogenerate from dropping them.
+# Other databases fall back to a LIKE scan, which is fine for development.
+
+import re
+from typing import List
+
+from sqlalchemy import Float, cast, func, literal_column
+
+
+SEARCH_CONFIG = "english"
+SEARCH_VECTOR_COLUMN = "search_vector"
+SEARCH_VECTOR_INDEX = "ix_chat_messages_search_vector"
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+SEARCH_MAX_QUERY_LENGTH = 200
+SNIPPET_MAX_WORDS = 30
+
+# Control characters can't clash with message text, and the snippet is sent to clients
+# as fragments rather than markup, so nothing in a message is ever rendered as HTML
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+HEADLINE_OPTIONS = (
+    f'StartSel="{HIGHLIGHT_START}", StopSel="{HIGHLIGHT_STOP}", MaxWords={SNIPPET_MAX_WORDS}, '
+    'MinWords=12, MaxFragments=2, FragmentDelimiter=" … "'
+)
+
+
+def search_config():
+    return literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+
+
+def search_vector():
+    return literal_column(f"chat_messages.{SEARCH_VECTOR_COLUMN}")
+
+
+def ts_query(text: str):
+    return func.websearch_to_tsquery(search_config(), text)
+
+
+def ts_rank(query):
+    # ts_rank_cd returns a float4. Pages are keyed on the rank, and a cursor's rank comes
+    # back as a float8, which a float4 rank equal to it may not compare equal to, so the
+    # rank is a float8 from the start
+    return cast(func.ts_rank_cd(search_vector(), query), Float(53))
+
+
+def ts_headline(content, query):
+    return func.ts_headline(search_config(), content, query, HEADLINE_OPTIONS)
+
+
+def fragments(snippet: str) -> List[dict]:
+    """Split a snippet with highlight markers into `{"text", "highlight"}` fragments."""
+    parts = []
+    for number, text in enumerate(re.split(f"[{HIGHLIGHT_START}{HIGHLIGHT_STOP}]", snippet or "")):
+        if text:
+            parts.append({"text": text, "highlight": number % 2 == 1})
+    return parts
+
+
+def query_terms(text: str) -> List[str]:
+    """The words a LIKE search has to find, from a query in web search syntax."""
+    terms = []
+    for phrase, word in re.findall(r'"([^"]+)"|(\S+)', text):
+        term = (phrase or word).strip().lower()
+        if not term or term == "or" or term.startswith("-"):
+            continue
+        terms.append(term)
+    return terms
+
+
+def like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def like_snippet(content: str, terms: List[str]) -> List[dict]:
+    """A window of the message around the first match, as fragments with the terms highlighted."""
+    lowered = content.lower()
+    first = min((lowered.find(term) for term in terms if term in lowered), default=0)
+    words = content[:first].split()[-SNIPPET_MAX_WORDS // 3:] + content[first:].split()
+    window = " ".join(words[:SNIPPET_MAX_WORDS])
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    marked = pattern.sub(lambda match: f"{HIGHLIGHT_START}{match.group(0)}{HIGHLIGHT_STOP}", window)
+    return fragments(marked)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Alembic hook: leave the Postgres-only search column and index out of autogenerate."""
+    return not (reflected and compare_to is None and name in (SEARCH_VECTOR_COLUMN, SEARCH_VECTOR_INDEX))
@@ -0,0 +1,97 @@
+# Server-sent events helpers
+# Shared by the Flask streaming route and the native ASGI streaming path so that
+# both emit exactly the same wire format to the webapp. Events of a generation carry
+# its event number as their `id:`, see app/generations.py.
+
+import json
+import re
+import time
+from typing import Iterator, Optional
+
+
+SSE_HEADERS = {
+    "Content-Type": "text/event-stream",
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+}
+
+# A comment line, sent to idle streams so that proxies don't close them
+SSE_HEARTBEAT = ": keep-alive\n\n"
+
+
+def sse_frame(data: str, event_id: Optional[int] = None) -> str:
+    if event_id is None:
+        return f"data: {data}\n\n"
+    return f"id: {event_id}\ndata: {data}\n\n"
+
+
+def sse_event(payload: dict, event_id: Optional[int] = None) -> str:
+    return sse_frame(json.dumps(payload), event_id)
+
+
+def chunk_content(part) -> str:
+    """Pull the token text out of one streamed Ollama chat chunk."""
+    return part.get("message", {}).get("content", "") or ""
+
+
+def seconds(nanoseconds: Optional[int]) -> Optional[float]:
+    return nanoseconds / 1e9 if nanoseconds else None
+
+
+class StreamAccumulator:
+    """Collects a streamed reply and its generation stats.
+
+    Token chunks are appended to a list and joined once at the end, so building the
+    reply stays linear in its length however many chunks it arrives in.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        # Ollama's own timings of the generation, in seconds
+        self.load_seconds: Optional[float] = None
+        self.prompt_eval_seconds: Optional[float] = None
+        self.eval_seconds: Optional[float] = None
+
+    def add(self, part) -> str:
+        content = chunk_content(part)
+        if content:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.parts.append(content)
+        if part.get("done"):
+            self.finished_at = time.perf_counter()
+            self.prompt_tokens = part.get("prompt_eval_count")
+            self.completion_tokens = part.get("eval_count")
+            self.load_seconds = seconds(part.get("load_duration"))
+            self.prompt_eval_seconds = seconds(part.get("prompt_eval_duration"))
+            self.eval_seconds = seconds(part.get("eval_duration"))
+        return content
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def content(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def latency_ms(self) -> Optional[int]:
+        if self.finished_at is None:
+            return None
+        return int((self.finished_at - self.started_at) * 1000)
+
+
+def replay_chunks(content: str) -> Iterator[dict]:
+    """Split an already finished reply into chunks shaped like those of a live Ollama stream.
+
+    Replayed word by word, it reaches the client in the same event format as a live generation.
+    """
+    for piece in re.findall(r"\S+\s*|\s+", content):
+        yield {"message": {"content": piece}}
+    yield {"done": True}
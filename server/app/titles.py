@@ -0,0 +1,65 @@
+# Chat titles
+# A chat is created with a placeholder title. Once it has its first reply, a background
+# job asks TITLE_MODEL for a title based on the opening turns. That is a short,
+# low-temperature call capped at TITLE_MAX_TOKENS, so a small model is plenty.
+#
+# Titles are generated in batches: while a title job is queued, chats that get their first
+# reply join it instead of queueing their own, so a busy queue titles them all in one go.
+# When the model's answer is unusable, the start of the first user message is used.
+
+import os
+import re
+from typing import List, Optional
+
+
+NEW_CHAT_TITLE = "New chat"
+TITLE_MAX_TOKENS = int(os.getenv("TITLE_MAX_TOKENS", 16))
+TITLE_BATCH_SIZE = int(os.getenv("TITLE_BATCH_SIZE", 16))
+TITLE_MAX_LENGTH = 60
+# Opening turns shown to the model, each cut to this many characters
+TITLE_CONTEXT_TURNS = 2
+TITLE_CONTEXT_CHARS = 1000
+
+TITLE_INSTRUCTIONS = (
+    "Write a title of at most six words for the conversation below. "
+    "Reply with the title only, without quotes and without a full stop."
+)
+
+
+def title_prompt(turns: List[dict]) -> List[dict]:
+    transcript = "\n\n".join(
+        f"{turn.get('role', 'user')}: {str(turn.get('content', ''))[:TITLE_CONTEXT_CHARS]}"
+        for turn in turns[:TITLE_CONTEXT_TURNS]
+    )
+    return [
+        {"role": "system", "content": TITLE_INSTRUCTIONS},
+        {"role": "user", "content": transcript},
+    ]
+
+
+def shorten(text: str) -> str:
+    if len(text) <= TITLE_MAX_LENGTH:
+        return text
+    return text[:TITLE_MAX_LENGTH].rsplit(" ", 1)[0].rstrip(",;:-") + "…"
+
+
+def clean_title(text: str) -> Optional[str]:
+    """The model's answer as a title, or None when there's nothing usable in it."""
+    lines = [line for line in (text or "").strip().splitlines() if line.strip()]
+    if not lines:
+        return None
+    title = re.sub(r"^(title\s*:\s*)", "", lines[0].strip(), flags=re.IGNORECASE)
+    title = title.strip(" \"'*#`").rstrip(".")
+    if not title or title == NEW_CHAT_TITLE:
+        return None
+    return shorten(title)
+
+
+def fallback_title(turns: List[dict]) -> str:
+    for turn in turns:
+        if turn.get("role") == "user":
+            words = " ".join(str(turn.get("content", "")).split())
+            if words:
+                return shorten(words)
+    # Anything but the placeholder, or the chat would be picked up again
+    return "Untitled chat"
@@ -0,0 +1,126 @@
+# Chat export and import
+# Chats move between databases (backups, moving users to another deployment) as NDJSON,
+# one JSON object per line:
+#
+#     {"type": "export", "version": 1, "exported_at": "...", "scope": "user"}
+#     {"type": "user", "id": "...", "email": "...", "display_name": "...", ...}
+#     {"type": "chat", "id": "...", "user_id": "...", "title": "...", "created_at": "...", ...}
+#     {"type": "message", "chat_id": "...", "seq": 0, "role": "user", "content": "...", ...}
+#
+# Users come first, then every chat followed by its messages in order. An export reads
+# chats and their messages in one query from a server-side cursor (`yield_per`) and writes
+# each batch of rows as it arrives, so it runs in constant memory however many chats there
+# are. An import reads one line at a time and inserts IMPORT_BATCH_SIZE rows per statement
+# with executemany, in a single transaction: an import that fails stores nothing.
+#
+# GET /export and POST /import move the chats of the signed-in user, and an import gives
+# them fresh ids and the importing user as their owner. `flask export-chats` and
+# `flask import-chats` move the whole org and keep the ids. Users are matched by email,
+# and chats and messages that are already stored are skipped, so the same file can be
+# imported again.
+#
+# Only the current chat's id is kept while importing, which is why a chat's messages have
+# to follow it.
+
+import json
+import os
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional, Tuple
+
+
+EXPORT_VERSION = 1
+EXPORT_MIMETYPE = "application/x-ndjson"
+# Rows per INSERT when importing
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000))
+
+USER_FIELDS = ("id", "email", "display_name", "photo_url", "user_google_id")
+CHAT_FIELDS = ("id", "user_id", "title", "created_at", "summary", "summary_upto")
+MESSAGE_FIELDS = ("chat_id", "seq", "role", "content", "created_at", "prompt_tokens", "completion_tokens", "latency_ms")
+
+
+def timestamp(value: datetime) -> str:
+    if not isinstance(value, datetime):
+        raise TypeError(f"{type(value).__name__} is not JSON serializable")
+    return value.isoformat()
+
+
+# One encoder for every line, json.dumps would build a new one per call with these options
+ENCODER = json.JSONEncoder(separators=(",", ":"), default=timestamp)
+
+
+def ndjson(record: dict) -> str:
+    return ENCODER.encode(record) + "\n"
+
+
+def parse_timestamp(value) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid timestamp {value!r}") from e
+
+
+def export_header(scope: str) -> str:
+    return ndjson({
+        "type": "export",
+        "version": EXPORT_VERSION,
+        "exported_at": datetime.now(timezone.utc),
+        "scope": scope,
+    })
+
+
+def record(kind: str, fields: Tuple[str, ...], row) -> str:
+    """The line of a `kind` record, from a row holding `fields` in order."""
+    return ndjson({"type": kind, **dict(zip(fields, row))})
+
+
+def read_records(lines: Iterable) -> Iterator[Tuple[int, dict]]:
+    """Parse NDJSON `lines` (str or bytes) into (line number, record), skipping blank lines."""
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"line {number}: invalid JSON") from e
+        if not isinstance(item, dict) or not isinstance(item.get("type"), str):
+            raise ValueError(f"line {number}: expected an object with a type")
+        if item["type"] == "export" and item.get("version", EXPORT_VERSION) != EXPORT_VERSION:
+            raise ValueError(f"line {number}: export version {item['version']!r} is not supported")
+        yield number, item
+
+
+def chat_row(item: dict, chat_id: str, user_id: str, default_title: str) -> dict:
+    summary_upto = item.get("summary_upto") or 0
+    if not isinstance(summary_upto, int) or summary_upto < 0:
+        raise ValueError("summary_upto must be a non-negative integer")
+    return {
+        "id": chat_id,
+        "user_id": user_id,
+        "title": item.get("title") or default_title,
+        "created_at": parse_timestamp(item.get("created_at")) or datetime.now(timezone.utc),
+        "summary": item.get("summary"),
+        "summary_upto": summary_upto,
+    }
+
+
+def message_row(item: dict, chat_id: str) -> dict:
+    seq, role, content = item.get("seq"), item.get("role"), item.get("content", "")
+    if not isinstance(seq, int) or seq < 0:
+        raise ValueError("seq must be a non-negative integer")
+    if not isinstance(role, str) or not isinstance(content, str):
+        raise ValueError("role and content must be strings")
+    row = {
+        "chat_id": chat_id,
+        "seq": seq,
+        "role": role,
+        "content": content,
+        "created_at": parse_timestamp(item.get("created_at")) or datetime.now(timezone.utc),
+    }
+    for field in ("prompt_tokens", "completion_tokens", "latency_ms"):
+        value = item.get(field)
+        if value is not None and not isinstance(value, int):
+            raise ValueError(f"{field} must be an integer")
+        row[field] = value
+    return row
@@ -0,0 +1,56 @@
+# Retrieval benchmark
+# Builds a throwaway vector index from a set of PDFs and reports index build time
+# and top-k query latency.
+#
+# Usage (from server/): python -m benchmarks.bench_retrieval ./app/data/*.pdf --queries 200
+
+import argparse
+import statistics
+import tempfile
+import time
+
+from app.document_ingestion import load_pdf
+from app.retrieval import EMBED_BATCH_SIZE, RETRIEVAL_TOP_K, VectorIndex
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark index build time and query latency.")
+    parser.add_argument("paths", nargs="+", help="PDF files to index")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--top-k", type=int, default=RETRIEVAL_TOP_K)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as path:
+        index = VectorIndex(path=path)
+        index.embedder  # load the model outside the timed section
+
+        started = time.perf_counter()
+        chunks = 0
+        for file_path in args.paths:
+            chunks += index.add_chunks(load_pdf(file_path), batch_size=args.batch_size)
+        build_seconds = time.perf_counter() - started
+        print(f"index build: {chunks} chunks in {build_seconds:.2f}s ({chunks / build_seconds:.1f} chunks/s)")
+
+        sample = index.collection.get(limit=args.queries, include=["documents"])["documents"]
+        questions = [document[:200] for document in sample] or ["What does this document say?"]
+        latencies = []
+        for number in range(args.queries):
+            started = time.perf_counter()
+            index.query(questions[number % len(questions)], k=args.top_k)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        print(
+            f"query latency over {len(latencies)} queries: "
+            f"p50={percentile(latencies, 50):.1f}ms p95={percentile(latencies, 95):.1f}ms "
+            f"p99={percentile(latencies, 99):.1f}ms mean={statistics.mean(latencies):.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Model routing benchmark
+# Sends a mix of short and long chat prompts through the model router to the stub Ollama
+# server, which plays a fast small model and a slow large one that take --load-time to
+# load. Every mode starts a fresh stub, so the models start out unloaded:
+#
+#     large   every prompt on the large model, loaded by the first request
+#     warm    the same, with the keep-alive pinger loading it before traffic starts
+#     routed  both models warmed, short prompts may go to the small one
+#
+# and reports p50/p95 latency per prompt length, the model loads the requests waited
+# for, and where the router sent the prompts.
+#
+# Usage (from server/): python -m benchmarks.bench_routing --requests 60 --concurrency 4
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+
+SMALL_MODEL = "llama3.2:1b"
+LARGE_MODEL = "llama3.1:8b"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def wait_for(url: str, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def prompts(count: int, long_share: float, long_chars: int, seed: int = 7):
+    generator = random.Random(seed)
+    for number in range(count):
+        long = generator.random() < long_share
+        text = ("Summarize the attached policy. " * (long_chars // 31)) if long else f"What is the leave policy for case {number}?"
+        yield ("long" if long else "short"), [{"role": "user", "content": text}]
+
+
+def run_mode(mode: str, args) -> dict:
+    from app.routing import ModelRoute, ModelRouter
+    from app.streaming import StreamAccumulator
+    import ollama
+
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(args.ollama_port),
+         "--tokens", str(args.tokens), "--first-token-delay", "0.05", "--load-time", str(args.load_time),
+         "--model-rate", f"{SMALL_MODEL}={args.small_rate}", "--model-rate", f"{LARGE_MODEL}={args.large_rate}"],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for(f"http://127.0.0.1:{args.ollama_port}/stats")
+        routes = [ModelRoute(LARGE_MODEL, ("chat",))]
+        if mode == "routed":
+            routes.insert(0, ModelRoute(SMALL_MODEL, ("chat",), max_prompt_chars=args.small_max_chars))
+        router = ModelRouter(routes, {"chat": {"temperature": 0.9, "num_predict": args.num_predict}},
+                             keepalive_interval=0)
+        if mode != "large":
+            # What the keep-alive thread does as a server worker starts
+            router.keep_warm()
+
+        client = ollama.Client(host=f"http://127.0.0.1:{args.ollama_port}")
+
+        def generate(item):
+            kind, prompt = item
+            started = time.perf_counter()
+            choice = router.route("chat", prompt)
+            reply = StreamAccumulator()
+            for part in client.chat(model=choice.model, messages=prompt, options=choice.options,
+                                    keep_alive=choice.keep_alive, stream=True):
+                reply.add(part)
+            router.observe(choice, reply)
+            return kind, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            results = list(pool.map(generate, prompts(args.requests, args.long_share, args.long_chars)))
+        elapsed = time.perf_counter() - started
+        stats = httpx.get(f"http://127.0.0.1:{args.ollama_port}/stats").json()
+        return {
+            "results": results,
+            "elapsed": elapsed,
+            "loads": stats["loads"],
+            "models": {model: data["generations"] for model, data in router.snapshot()["models"].items()},
+        }
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark model routing against the stub Ollama server.")
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--long-share", type=float, default=0.3, help="Share of long prompts")
+    parser.add_argument("--long-chars", type=int, default=12000, help="Length of a long prompt")
+    parser.add_argument("--small-max-chars", type=int, default=4000, help="Longest prompt the small model takes")
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per reply")
+    parser.add_argument("--num-predict", type=int, default=2000, help="Token cap of a chat reply")
+    parser.add_argument("--small-rate", type=float, default=150, help="Tokens per second of the small model")
+    parser.add_argument("--large-rate", type=float, default=40, help="Tokens per second of the large model")
+    parser.add_argument("--load-time", type=float, default=1.5, help="Seconds to load a model")
+    parser.add_argument("--ollama-port", type=int, default=11436)
+    parser.add_argument("--modes", default="large,warm,routed")
+    args = parser.parse_args(argv)
+
+    # Keeps the module-level client ollama creates on import off the real server
+    os.environ.setdefault("OLLAMA_HOST", f"http://127.0.0.1:{args.ollama_port}")
+    print(f"{args.requests} prompts ({args.long_share:.0%} long), {args.concurrency} at a time, "
+          f"{args.tokens} tokens per reply, models load in {args.load_time}s")
+    print(f"{'mode':<8}{'short p50':>11}{'short p95':>11}{'long p50':>10}{'long p95':>10}{'total':>8}{'loads':>7}  models")
+    for mode in args.modes.split(","):
+        report = run_mode(mode, args)
+        columns = []
+        for kind in ("short", "long"):
+            samples = [seconds for sample_kind, seconds in report["results"] if sample_kind == kind]
+            columns += [percentile(samples, 50), percentile(samples, 95)] if samples else [0.0, 0.0]
+        models = ", ".join(f"{model}: {count}" for model, count in report["models"].items())
+        print(f"{mode:<8}{columns[0]:>10.2f}s{columns[1]:>10.2f}s{columns[2]:>9.2f}s{columns[3]:>9.2f}s"
+              f"{report['elapsed']:>7.1f}s{report['loads']:>7}  {models}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Worker startup benchmark
+# Starts fresh interpreters the way hypercorn starts its workers (spawned, not forked),
+# all at once, and has each import the server entry point. Reports per worker the time
+# until the app can serve, its resident memory, and which heavy dependencies got imported
+# along the way. With --preload, also the time and memory it takes to load the models.
+#
+# Needs the same environment as the server (DATABASE_URL, JWT_SECRET_KEY); nothing is
+# written to the database. RSS is read from /proc, so Linux only.
+#
+# Usage (from server/): python -m benchmarks.bench_startup --workers 4 [--preload]
+
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+HEAVY_MODULES = ("ollama", "httpx", "numpy", "pypdf", "alembic", "langchain_text_splitters", "fastembed", "chromadb")
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def worker(target: str, preload: bool):
+    started = time.perf_counter()
+    importlib.import_module(target)
+    report = {
+        "import_s": time.perf_counter() - started,
+        "rss_mb": rss_mb(),
+        "modules": len(sys.modules),
+        "heavy": [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+    if preload:
+        from app.main import preload_models
+
+        started = time.perf_counter()
+        preload_models()
+        report["preload_s"] = time.perf_counter() - started
+        report["preloaded_rss_mb"] = rss_mb()
+    print(json.dumps(report))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark worker startup time and memory.")
+    parser.add_argument("--workers", type=int, default=4, help="Workers started at the same time")
+    parser.add_argument("--target", default="app.asgi", help="Module a worker imports to serve")
+    parser.add_argument("--preload", action="store_true", help="Also load the models, as PRELOAD_MODELS does")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        worker(args.target, args.preload)
+        return
+
+    command = [sys.executable, "-m", "benchmarks.bench_startup", "--worker", "--target", args.target]
+    if args.preload:
+        command.append("--preload")
+    started = time.perf_counter()
+    processes = [subprocess.Popen(command, stdout=subprocess.PIPE, text=True) for _ in range(args.workers)]
+    reports = []
+    for number, process in enumerate(processes):
+        output, _ = process.communicate()
+        if process.returncode != 0:
+            raise SystemExit(f"worker {number} exited with {process.returncode}")
+        reports.append(json.loads(output.strip().splitlines()[-1]))
+    elapsed = time.perf_counter() - started
+
+    for number, report in enumerate(reports):
+        line = (f"worker {number}: import {report['import_s'] * 1000:.0f}ms, rss {report['rss_mb']:.1f}MB, "
+                f"{report['modules']} modules")
+        if "preload_s" in report:
+            line += f", preload {report['preload_s'] * 1000:.0f}ms -> rss {report['preloaded_rss_mb']:.1f}MB"
+        print(line)
+    print(f"heavy modules imported: {', '.join(reports[0]['heavy']) or 'none'}")
+    print(f"{args.target}: import mean={statistics.mean(r['import_s'] for r in reports) * 1000:.0f}ms "
+          f"max={max(r['import_s'] for r in reports) * 1000:.0f}ms, "
+          f"rss mean={statistics.mean(r['rss_mb'] for r in reports):.1f}MB, "
+          f"all {args.workers} workers ready in {elapsed * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
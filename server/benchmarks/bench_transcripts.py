@@ -0,0 +1,113 @@
+# Transcript read benchmark
+# Stores one long chat and compares ways of serving GET /chats/<id>: loading the chat and
+# its turns as ORM objects and serializing them with jsonify (how the route used to work),
+# streaming the rows from a server-side cursor, serving the transcript from the chat cache
+# after checking the chat's version, and answering a revalidation with 304 after the same
+# check. Reports time and peak Python memory per read, and on Postgres the on-disk size of
+# the table. Transcripts longer than CHAT_CACHE_MAX_CHARS are never cached.
+#
+# Run it against a migrated database that holds nothing you want to keep.
+#
+# Usage (from server/): python -m benchmarks.bench_transcripts --messages 2000 --size 2000
+
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+import uuid
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.main import (
+    create_app, get_chat_repo, get_chat_version_repo, insert_chat_messages, read_chat_messages_repo,
+    stream_chat_messages_repo,
+)
+from app.models import Chat, User
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def measure(read, runs: int):
+    latencies, peaks = [], []
+    for _ in range(runs):
+        tracemalloc.start()
+        started = time.perf_counter()
+        size = read()
+        latencies.append((time.perf_counter() - started) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024 / 1024)
+        tracemalloc.stop()
+        db.session.rollback()
+    return latencies, peaks, size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark reading a long chat transcript.")
+    parser.add_argument("--messages", type=int, default=1000, help="Messages in the chat")
+    parser.add_argument("--size", type=int, default=1500, help="Characters per message")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(7)
+    words = "the leave policy says that annual days carry over into the next year unless".split()
+    app = create_app()
+    with app.app_context():
+        user = User(user_google_id=uuid.uuid4().hex, display_name="Bench", email=f"{uuid.uuid4().hex}@example.com")
+        db.session.add(user)
+        db.session.flush()
+        chat = Chat(user_id=user.id, title="Transcript benchmark")
+        db.session.add(chat)
+        db.session.flush()
+        for start in range(0, args.messages, 500):
+            insert_chat_messages([
+                {"chat_id": chat.id, "seq": seq, "role": "user" if seq % 2 == 0 else "assistant",
+                 "content": " ".join(rng.choice(words) for _ in range(args.size // 5))[:args.size]}
+                for seq in range(start, min(start + 500, args.messages))
+            ])
+        db.session.commit()
+        chat_id, user_id = chat.id, user.id
+        print(f"database: {db.engine.dialect.name}, {args.messages} messages of {args.size} characters")
+
+        def orm_read():
+            with app.test_request_context():
+                return len(app.json.response(get_chat_repo(chat_id, user_id)["messages"]).get_data())
+
+        def streamed_read():
+            return sum(len(part) for part in stream_chat_messages_repo(chat_id))
+
+        def cached_read():
+            version = get_chat_version_repo(chat_id, user_id)
+            return sum(len(part) for part in read_chat_messages_repo(chat_id, user_id, version))
+
+        def revalidated_read():
+            # If-None-Match matched, nothing but the version is read
+            get_chat_version_repo(chat_id, user_id)
+            return 0
+
+        reads = (("ORM + jsonify", orm_read), ("streamed", streamed_read), ("cached", cached_read),
+                 ("304", revalidated_read))
+        for name, read in reads:
+            read()  # warm up
+            latencies, peaks, size = measure(read, args.runs)
+            print(
+                f"{name:<14} p50={percentile(latencies, 50):.1f}ms p95={percentile(latencies, 95):.1f}ms "
+                f"mean={statistics.mean(latencies):.1f}ms peak memory={max(peaks):.1f}MB body={size / 1024:.0f}KB"
+            )
+
+        if db.engine.dialect.name == "postgresql":
+            row = db.session.execute(text(
+                "SELECT pg_size_pretty(pg_total_relation_size('chat_messages')), "
+                "pg_size_pretty(sum(pg_column_size(content))), sum(octet_length(content)), "
+                "string_agg(DISTINCT coalesce(pg_column_compression(content), 'none'), ',') "
+                "FROM chat_messages WHERE chat_id = :chat_id"
+            ), {"chat_id": chat_id}).one()
+            print(f"chat_messages: {row[0]} in total; this chat's content {row[1]} stored for "
+                  f"{row[2] / 1024 / 1024:.1f}MB of text (compression: {row[3]})")
+
+
+if __name__ == "__main__":
+    main()
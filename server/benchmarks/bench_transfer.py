@@ -0,0 +1,107 @@
+# Chat export and import benchmark
+# Stores one user with many chats, then compares building an export from ORM objects
+# (every chat and its turns loaded, then serialized) with the streamed NDJSON export, and
+# importing the export back row by row through the ORM with the batched import. Reports
+# time, rows per second and peak Python memory of each.
+#
+# Run it against a migrated database that holds nothing you want to keep.
+#
+# Usage (from server/): python -m benchmarks.bench_transfer --chats 200 --messages 500
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from app.extensions import db
+from app.main import create_app, export_chats_repo, import_chats_repo, insert_chat_messages
+from app.models import Chat, ChatMessage, User
+
+
+def measure(run):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark exporting and importing chats.")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=500, help="Messages per chat")
+    parser.add_argument("--size", type=int, default=400, help="Characters per message")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(7)
+    words = "the leave policy says that annual days carry over into the next year unless".split()
+    app = create_app()
+    with app.app_context():
+        user = User(user_google_id=uuid.uuid4().hex, display_name="Bench", email=f"{uuid.uuid4().hex}@example.com")
+        db.session.add(user)
+        db.session.flush()
+        for number in range(args.chats):
+            chat = Chat(user_id=user.id, title=f"Transfer benchmark {number}")
+            db.session.add(chat)
+            db.session.flush()
+            insert_chat_messages([
+                {"chat_id": chat.id, "seq": seq, "role": "user" if seq % 2 == 0 else "assistant",
+                 "content": " ".join(rng.choice(words) for _ in range(args.size // 5))[:args.size]}
+                for seq in range(args.messages)
+            ])
+        db.session.commit()
+        user_id = user.id
+        rows = args.chats * (args.messages + 1)
+        print(f"database: {db.engine.dialect.name}, {args.chats} chats of {args.messages} messages "
+              f"of {args.size} characters")
+
+        path = os.path.join(tempfile.mkdtemp(prefix="org-pedia-transfer-"), "export.ndjson")
+
+        def orm_export():
+            chats = db.session.query(Chat).filter(Chat.user_id == user_id).all()
+            with open(path + ".json", "w") as f:
+                json.dump([chat.to_dict() for chat in chats], f)
+            return os.path.getsize(path + ".json")
+
+        def streamed_export():
+            with open(path, "w", encoding="utf-8") as f:
+                for chunk in export_chats_repo(user_id):
+                    f.write(chunk)
+            return os.path.getsize(path)
+
+        def orm_import():
+            with open(path, encoding="utf-8") as f:
+                chat_id = None
+                for line in f:
+                    item = json.loads(line)
+                    if item["type"] == "chat":
+                        chat = Chat(user_id=user_id, title=item["title"])
+                        db.session.add(chat)
+                        db.session.flush()
+                        chat_id = chat.id
+                    elif item["type"] == "message":
+                        db.session.add(ChatMessage(chat_id=chat_id, seq=item["seq"], role=item["role"],
+                                                   content=item["content"]))
+            db.session.commit()
+
+        def batched_import():
+            with open(path, "rb") as f:
+                return import_chats_repo(f, user_id)
+
+        for name, run in (("export ORM", orm_export), ("export streamed", streamed_export),
+                          ("import ORM", orm_import), ("import batched", batched_import)):
+            elapsed, peak, _ = measure(run)
+            db.session.rollback()
+            db.session.expunge_all()
+            print(f"{name:<16} {elapsed:>7.2f}s {rows / elapsed:>9.0f} rows/s peak memory={peak:.1f}MB")
+        print(f"export: {os.path.getsize(path) / 1024 / 1024:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# Stub Ollama server
+# Answers POST /api/chat with a stream of fake tokens at a fixed rate, so the server
+# can be load-tested without a GPU or a model. Point the app at it with OLLAMA_HOST.
+#
+# Models can be given their own speed with --model-rate. A model evaluates the prompt at
+# --prompt-rate tokens/s, scaled like its generation rate, before its first token, and
+# replies are cut at the request's `num_predict`. With --load-time a model that is not
+# loaded (first use, or idle past the request's keep_alive) takes that long to load.
+# POST /api/generate with an empty prompt loads a model, like Ollama.
+#
+# Usage (from server/): python -m benchmarks.fake_ollama --port 11435 --tokens 64 --rate 50
+#     [--model-rate llama3.2:1b=150 --model-rate llama3.1:8b=40 --load-time 2]
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+
+
+def chunk(payload: dict) -> bytes:
+    line = json.dumps(payload).encode() + b"\n"
+    return f"{len(line):x}\r\n".encode() + line + b"\r\n"
+
+
+# Ollama's default keep-alive, in seconds
+DEFAULT_KEEP_ALIVE = 300
+CHARS_PER_TOKEN = 4
+
+
+class FakeOllama:
+    def __init__(self, tokens: int, rate: float, first_token_delay: float, model: str,
+                 model_rates: dict = None, prompt_rate: float = 2000, load_time: float = 0):
+        self.tokens = tokens
+        self.rate = rate
+        self.first_token_delay = first_token_delay
+        self.model = model
+        self.model_rates = model_rates or {}
+        self.prompt_rate = prompt_rate
+        self.load_time = load_time
+        # When each model is unloaded (monotonic), absent while it isn't loaded
+        self.loaded_until = {}
+        self.loading = {}
+        self.active = 0
+        self.completed = 0
+        self.aborted = 0
+        self.loads = 0
+        self.by_model = {}
+
+    async def load(self, request: dict) -> float:
+        """Load the requested model if it isn't loaded and return how long that took."""
+        model = request.get("model") or self.model
+        keep_alive = request.get("keep_alive")
+        keep_alive = DEFAULT_KEEP_ALIVE if keep_alive is None else float(keep_alive)
+        started = time.perf_counter()
+        # Requests that arrive while a model loads wait for that load
+        async with self.loading.setdefault(model, asyncio.Lock()):
+            if self.loaded_until.get(model, 0) < time.monotonic():
+                self.loads += 1
+                await asyncio.sleep(self.load_time)
+        waited = time.perf_counter() - started
+        self.loaded_until[model] = float("inf") if keep_alive < 0 else time.monotonic() + keep_alive
+        return waited
+
+    def plan(self, request: dict):
+        """Model, rate, prompt tokens, prompt evaluation time and reply length of a request."""
+        model = request.get("model") or self.model
+        rate = self.model_rates.get(model, self.rate)
+        prompt_tokens = sum(len(message.get("content") or "") for message in request.get("messages", [])) // CHARS_PER_TOKEN
+        prompt_seconds = prompt_tokens / (self.prompt_rate * rate / self.rate) if self.prompt_rate else 0.0
+        tokens = self.tokens
+        num_predict = (request.get("options") or {}).get("num_predict")
+        if num_predict is not None and num_predict >= 0:
+            tokens = min(tokens, num_predict)
+        self.by_model[model] = self.by_model.get(model, 0) + 1
+        return model, rate, max(prompt_tokens, 1), prompt_seconds, tokens
+
+    async def read_request(self, reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        request_line, *header_lines = head.decode().split("\r\n")
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        method, path, _ = request_line.split(" ", 2)
+        return method, path, body
+
+    async def send_json(self, writer, status: str, payload: dict):
+        body = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\ncontent-type: application/json\r\ncontent-length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def stream_chat(self, writer, request: dict):
+        writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: application/x-ndjson\r\ntransfer-encoding: chunked\r\n\r\n")
+        self.active += 1
+        started = time.perf_counter()
+        try:
+            load_seconds = await self.load(request)
+            model, rate, prompt_tokens, prompt_seconds, tokens = self.plan(request)
+            await asyncio.sleep(self.first_token_delay + prompt_seconds)
+            evaluated = time.perf_counter()
+            for number in range(tokens):
+                writer.write(chunk({
+                    "model": model,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "message": {"role": "assistant", "content": f"token{number} "},
+                    "done": False,
+                }))
+                await writer.drain()
+                await asyncio.sleep(1 / rate)
+            writer.write(chunk({
+                "model": model,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "done_reason": "length" if tokens < self.tokens else "stop",
+                **self.durations(started, evaluated, load_seconds, prompt_tokens, prompt_seconds, tokens),
+            }) + b"0\r\n\r\n")
+            await writer.drain()
+            self.completed += 1
+        except ConnectionError:
+            self.aborted += 1
+            raise
+        finally:
+            self.active -= 1
+
+    def durations(self, started, evaluated, load_seconds, prompt_tokens, prompt_seconds, tokens) -> dict:
+        finished = time.perf_counter()
+        return {
+            "total_duration": int((finished - started) * 1e9),
+            "load_duration": int(load_seconds * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(max(prompt_seconds, 1e-6) * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int((finished - evaluated) * 1e9),
+        }
+
+    async def chat(self, writer, request: dict):
+        started = time.perf_counter()
+        load_seconds = await self.load(request)
+        model, rate, prompt_tokens, prompt_seconds, tokens = self.plan(request)
+        await asyncio.sleep(self.first_token_delay + prompt_seconds)
+        evaluated = time.perf_counter()
+        await asyncio.sleep(tokens / rate)
+        self.completed += 1
+        await self.send_json(writer, "200 OK", {
+            "model": model,
+            "message": {"role": "assistant", "content": " ".join(f"token{number}" for number in range(tokens))},
+            "done": True,
+            **self.durations(started, evaluated, load_seconds, prompt_tokens, prompt_seconds, tokens),
+        })
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    method, path, body = await self.read_request(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                request = json.loads(body or b"{}") if method == "POST" else {}
+                if method == "POST" and path == "/api/chat" and request.get("stream", True):
+                    await self.stream_chat(writer, request)
+                elif method == "POST" and path == "/api/chat":
+                    await self.chat(writer, request)
+                elif method == "POST" and path == "/api/generate" and not request.get("prompt"):
+                    load_seconds = await self.load(request)
+                    await self.send_json(writer, "200 OK", {
+                        "model": request.get("model") or self.model,
+                        "response": "",
+                        "done": True,
+                        "done_reason": "load",
+                        "load_duration": int(load_seconds * 1e9),
+                    })
+                elif method == "GET" and path == "/stats":
+                    await self.send_json(writer, "200 OK", {
+                        "active": self.active,
+                        "completed": self.completed,
+                        "aborted": self.aborted,
+                        "loads": self.loads,
+                        "by_model": self.by_model,
+                    })
+                else:
+                    await self.send_json(writer, "404 Not Found", {"error": "not found"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host: str, port: int, server: FakeOllama):
+    listener = await asyncio.start_server(server.handle, host, port)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve fake Ollama chat streams.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per reply")
+    parser.add_argument("--rate", type=float, default=50, help="Tokens per second, per stream")
+    parser.add_argument("--first-token-delay", type=float, default=0.1, help="Seconds before the first token")
+    parser.add_argument("--model", default="llama3.2")
+    parser.add_argument("--model-rate", action="append", default=[], metavar="MODEL=RATE",
+                        help="Tokens per second of one model, repeatable")
+    parser.add_argument("--prompt-rate", type=float, default=2000,
+                        help="Prompt tokens evaluated per second at --rate, 0 to skip")
+    parser.add_argument("--load-time", type=float, default=0, help="Seconds to load a model that isn't loaded")
+    args = parser.parse_args(argv)
+
+    model_rates = {}
+    for entry in args.model_rate:
+        model, _, rate = entry.rpartition("=")
+        model_rates[model] = float(rate)
+    server = FakeOllama(args.tokens, args.rate, args.first_token_delay, args.model,
+                        model_rates, args.prompt_rate, args.load_time)
+    print(f"fake ollama on http://{args.host}:{args.port} ({args.tokens} tokens at {args.rate}/s)", flush=True)
+    try:
+        asyncio.run(serve(args.host, args.port, server))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""Add document file path
+
+Revision ID: 4f8c2d7a9b16
+Revises: 6e2b9d4f7a31
+Create Date: 2026-10-19 10:02:37.418520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f8c2d7a9b16'
+down_revision = '6e2b9d4f7a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled in the next time each document is synced
+    with op.batch_alter_table('document_files', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('path', sa.String(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('document_files', schema=None) as batch_op:
+        batch_op.drop_column('path')
@@ -0,0 +1,27 @@
+"""Add chat version
+
+Revision ID: 6e2b9d4f7a31
+Revises: d81f4b6c2e05
+Create Date: 2026-10-18 22:15:41.207664
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e2b9d4f7a31'
+down_revision = 'd81f4b6c2e05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A constant default, so Postgres adds the column without rewriting the table
+    with op.batch_alter_table('chat_history', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('chat_history', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,29 @@
+"""Add document file uploader
+
+Revision ID: 8b3e5f1c6d29
+Revises: 4f8c2d7a9b16
+Create Date: 2026-10-19 10:41:12.905318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b3e5f1c6d29'
+down_revision = '4f8c2d7a9b16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Documents indexed before this have no uploader, so no user can replace them
+    with op.batch_alter_table('document_files', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('uploaded_by', sa.String(length=36), nullable=True))
+        batch_op.create_foreign_key('fk_document_files_uploaded_by_users', 'users', ['uploaded_by'], ['id'], ondelete='SET NULL')
+
+
+def downgrade():
+    with op.batch_alter_table('document_files', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_document_files_uploaded_by_users', type_='foreignkey')
+        batch_op.drop_column('uploaded_by')
@@ -0,0 +1,39 @@
+"""Add chat message search vector
+
+Revision ID: b5e0d3a8c961
+Revises: 7a4c2e9b5d13
+Create Date: 2026-10-18 19:31:54.106273
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e0d3a8c961'
+down_revision = '7a4c2e9b5d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Postgres only, other databases search with LIKE (see app/search.py).
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    # Adding a stored generated column rewrites the table once
+    op.execute(
+        "ALTER TABLE chat_messages ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english'::regconfig, coalesce(content, ''))) STORED"
+    )
+    # Built without blocking writes to the table
+    with op.get_context().autocommit_block():
+        op.create_index('ix_chat_messages_search_vector', 'chat_messages', ['search_vector'], unique=False,
+                        postgresql_using='gin', postgresql_concurrently=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_chat_messages_search_vector', table_name='chat_messages', postgresql_concurrently=True)
+    op.drop_column('chat_messages', 'search_vector')
@@ -0,0 +1,113 @@
+"""Compact chat transcript storage
+
+Revision ID: d81f4b6c2e05
+Revises: b5e0d3a8c961
+Create Date: 2026-10-18 20:47:09.518302
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81f4b6c2e05'
+down_revision = 'b5e0d3a8c961'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+# Set to true to empty the legacy chat_history.messages column. The downgrade rebuilds it
+# from chat_messages, not from the original values, so this is opt-in.
+CLEAR_LEGACY_TRANSCRIPTS = os.getenv('CLEAR_LEGACY_TRANSCRIPTS', 'false').lower() == 'true'
+
+chat_history = sa.table(
+    'chat_history',
+    sa.column('id', sa.String),
+    sa.column('messages', sa.JSON),
+)
+
+chat_messages = sa.table(
+    'chat_messages',
+    sa.column('chat_id', sa.String),
+    sa.column('seq', sa.Integer),
+    sa.column('role', sa.String),
+    sa.column('content', sa.Text),
+)
+
+# Columns holding long text, stored out of line (TOAST) and compressed by Postgres
+COMPRESSED_COLUMNS = (('chat_messages', 'content'), ('chat_history', 'summary'))
+
+
+def upgrade():
+    bind = op.get_bind()
+    # The legacy transcripts were copied to chat_messages by 5b1d0c7e9a42 and haven't been
+    # written since, so they are dead weight in every chat_history row. Destructive.
+    if CLEAR_LEGACY_TRANSCRIPTS:
+        bind.execute(chat_history.update().where(chat_history.c.messages.isnot(None)).values(messages=sa.null()))
+
+    if bind.dialect.name != 'postgresql':
+        return
+    with op.batch_alter_table('chat_history', schema=None) as batch_op:
+        batch_op.alter_column('messages',
+               existing_type=sa.JSON(),
+               type_=postgresql.JSONB(astext_type=sa.Text()),
+               existing_nullable=True,
+               postgresql_using='messages::jsonb')
+
+    # lz4 compresses and, above all, decompresses much faster than the default pglz. It
+    # needs Postgres 14 built with lz4, otherwise the columns keep pglz. Applies to values
+    # written from now on.
+    if bind.dialect.server_version_info < (14,):
+        return
+    for table, column in COMPRESSED_COLUMNS:
+        try:
+            with bind.begin_nested():
+                op.execute(f'ALTER TABLE {table} ALTER COLUMN {column} SET COMPRESSION lz4')
+        except sa.exc.DBAPIError:
+            break
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        if bind.dialect.server_version_info >= (14,):
+            for table, column in COMPRESSED_COLUMNS:
+                op.execute(f'ALTER TABLE {table} ALTER COLUMN {column} SET COMPRESSION default')
+        with op.batch_alter_table('chat_history', schema=None) as batch_op:
+            batch_op.alter_column('messages',
+                   existing_type=postgresql.JSONB(astext_type=sa.Text()),
+                   type_=sa.JSON(),
+                   existing_nullable=True,
+                   postgresql_using='messages::json')
+
+    # Fold the rows back into the legacy column, one chat at a time
+    rows = bind.execution_options(stream_results=True).execute(
+        sa.select(chat_messages.c.chat_id, chat_messages.c.role, chat_messages.c.content)
+        .order_by(chat_messages.c.chat_id, chat_messages.c.seq)
+    )
+    updates, chat_id, messages = [], None, []
+    for row_chat_id, role, content in rows:
+        if row_chat_id != chat_id and messages:
+            updates.append({'chat': chat_id, 'transcript': messages})
+            messages = []
+        chat_id = row_chat_id
+        messages.append({'role': role, 'content': content})
+        if len(updates) >= BATCH_SIZE:
+            restore(bind, updates)
+            updates = []
+    if messages:
+        updates.append({'chat': chat_id, 'transcript': messages})
+    if updates:
+        restore(bind, updates)
+
+
+def restore(bind, updates):
+    bind.execute(
+        chat_history.update()
+        .where(chat_history.c.id == sa.bindparam('chat'))
+        .values(messages=sa.bindparam('transcript')),
+        updates,
+    )
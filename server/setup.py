@@ -189,7 +189,7 @@ def setup_database():
 # Step 7: Start the server
 def start_server():
     print("Starting the server...")
-    run_command(["hypercorn", "app.main:app", "--reload"])
+    run_command(["hypercorn", "app.asgi:app", "--reload"])
 
 if __name__ == "__main__":
     print(f"Detected OS: {OS_TYPE}")
@@ -0,0 +1,174 @@
+# Test fixtures
+# Every test that needs the app gets a fresh one on its own SQLite database, with the
+# tables created from the models. Chat replies come from benchmarks/fake_ollama.py, run
+# once per session on a free port that OLLAMA_HOST points at.
+#
+# The environment is set here, before anything imports the app: most settings are read
+# once, at import time.
+#
+# Run from server/: python -m pytest -q
+
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import pytest
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+OLLAMA_PORT = free_port()
+FAKE_TOKENS = 8
+
+os.environ.update({
+    "JWT_SECRET_KEY": "test-secret-key-that-is-long-enough-for-hs256",
+    "SECRET_KEY": "test-secret-key",
+    # Replaced per test by the app fixture
+    "DATABASE_URL": "sqlite://",
+    "OLLAMA_HOST": f"http://127.0.0.1:{OLLAMA_PORT}",
+    "LOG_LEVEL": "ERROR",
+    "PRELOAD_MODELS": "false",
+    "MODEL_KEEPALIVE_INTERVAL": "0",
+    # Jobs are run by the tests themselves
+    "JOB_INLINE_WORKERS": "0",
+    "RETRIEVAL_ENABLED": "false",
+    "CACHE_URL": "",
+})
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def fake_ollama():
+    """The fake Ollama server, replying FAKE_TOKENS tokens as fast as it can."""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(OLLAMA_PORT), "--tokens", str(FAKE_TOKENS),
+         "--rate", "1000", "--first-token-delay", "0"],
+        cwd=SERVER_DIR,
+    )
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", OLLAMA_PORT), timeout=0.2).close()
+            break
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("fake Ollama didn't start")
+            time.sleep(0.05)
+    yield f"http://127.0.0.1:{OLLAMA_PORT}"
+    process.terminate()
+    process.wait(timeout=5)
+
+
+def reset_state():
+    """Forget what earlier tests left in the module-level caches."""
+    from app import main
+
+    main.profile_cache.clear_local()
+    main.chat_cache.clear_local()
+    main.chat_history_cache.clear()
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    from app.extensions import db
+    from app.main import create_app
+
+    reset_state()
+    app = create_app()
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def shared_cache(monkeypatch):
+    """Chat versions in a shared cache backend, as with CACHE_URL set."""
+    from app import main
+    from app.cache import LocalBackend, TieredCache
+
+    monkeypatch.setattr(main, "chat_version_cache", TieredCache("chat_version", backend=LocalBackend(), keep_local=False))
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_user(app, email: str = None) -> str:
+    from app.extensions import db
+    from app.models import User
+
+    with app.app_context():
+        user = User(user_google_id=uuid.uuid4().hex, display_name="Test", email=email or f"{uuid.uuid4().hex}@example.com")
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def auth_headers(app, user_id: str) -> dict:
+    from flask_jwt_extended import create_access_token
+
+    with app.app_context():
+        return {"Authorization": f"Bearer {create_access_token(identity=user_id)}"}
+
+
+@pytest.fixture
+def user(app) -> str:
+    return add_user(app)
+
+
+@pytest.fixture
+def auth(app, user) -> dict:
+    return auth_headers(app, user)
+
+
+def add_chat(app, user_id: str, messages: list, title: str = "Chat") -> str:
+    from app.extensions import db
+    from app.main import add_chat_messages
+    from app.models import Chat
+
+    with app.app_context():
+        chat = Chat(user_id=user_id, title=title)
+        db.session.add(chat)
+        db.session.flush()
+        add_chat_messages(chat.id, messages, 0)
+        db.session.commit()
+        return chat.id
+
+
+def stored_messages(app, chat_id: str) -> list:
+    from app.extensions import db
+    from app.models import ChatMessage
+
+    with app.app_context():
+        rows = db.session.query(ChatMessage.role, ChatMessage.content).filter(
+            ChatMessage.chat_id == chat_id
+        ).order_by(ChatMessage.seq).all()
+        return [{"role": role, "content": content} for role, content in rows]
+
+
+def turns(count: int, start: int = 0) -> list:
+    return [{"role": "user" if n % 2 == 0 else "assistant", "content": f"message {n}"} for n in range(start, start + count)]
+
+
+def sse_events(body: str) -> list:
+    """The (id, data) of every event in an SSE body, heartbeats left out."""
+    events = []
+    for frame in body.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in frame.splitlines() if line and not line.startswith(":"))
+        if "data" in fields:
+            events.append((int(fields["id"]) if "id" in fields else None, fields["data"]))
+    return events
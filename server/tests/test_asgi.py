@@ -0,0 +1,136 @@
+import asyncio
+import json
+
+import pytest
+
+from conftest import FAKE_TOKENS, add_chat, sse_events, stored_messages, turns
+
+
+@pytest.fixture
+def asgi(app, monkeypatch):
+    """app/asgi.py's ASGI app, serving the test app."""
+    from hypercorn.middleware import AsyncioWSGIMiddleware
+
+    from app import asgi
+
+    monkeypatch.setattr(asgi, "flask_app", app)
+    monkeypatch.setattr(asgi, "wsgi_app", AsyncioWSGIMiddleware(asgi.with_empty_chunk(app), max_body_size=asgi.MAX_BODY_SIZE))
+    # Every test runs its own event loop, the async client binds to the first one it sees
+    monkeypatch.setattr(asgi, "_ollama_client", None)
+    return asgi.app
+
+
+def request(asgi_app, method: str, path: str, headers: dict = None, body: bytes = b"", chunks: list = None):
+    """Run one request through `asgi_app` and return (status, headers, body)."""
+    async def run():
+        pending = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks or []]
+        pending.append({"type": "http.request", "body": body, "more_body": False})
+        finished = asyncio.Event()
+        sent = []
+
+        async def receive():
+            if pending:
+                return pending.pop(0)
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        path_only, _, query = path.partition("?")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+            "path": path_only, "raw_path": path_only.encode(), "query_string": query.encode(), "root_path": "",
+            "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+            "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+        }
+        await asgi_app(scope, receive, send)
+        finished.set()
+        start = next(message for message in sent if message["type"] == "http.response.start")
+        response_headers = {name.decode(): value.decode() for name, value in start["headers"]}
+        return start["status"], response_headers, b"".join(message.get("body", b"") for message in sent[1:])
+
+    return asyncio.run(run())
+
+
+def test_chat_stream_is_served_on_the_event_loop(asgi, auth, app, user, fake_ollama):
+    chat_id = add_chat(app, user, [])
+
+    status, headers, body = request(asgi, "POST", "/chats", auth, json.dumps({"messages": turns(1), "chat_id": chat_id}).encode())
+
+    assert status == 200
+    assert headers["content-type"] == "text/event-stream"
+    events = sse_events(body.decode())
+    assert events[-1][1] == "[DONE]"
+    assert len(events) == FAKE_TOKENS + 2
+    # Stored before [DONE]
+    assert len(stored_messages(app, chat_id)) == 2
+
+
+def test_turn_stream_and_resume(asgi, auth, app, user, fake_ollama):
+    chat_id = add_chat(app, user, turns(2))
+
+    status, headers, body = request(asgi, "POST", f"/chats/{chat_id}/turns", auth, b'{"content": "more"}')
+    resumed = request(asgi, "GET", f"/generations/{headers['x-generation-id']}", {**auth, "Last-Event-ID": "2"})
+
+    assert status == 200
+    assert stored_messages(app, chat_id)[2] == {"role": "user", "content": "more"}
+    assert sse_events(resumed[2].decode()) == sse_events(body.decode())[2:]
+
+
+def test_stream_needs_a_token(asgi):
+    assert request(asgi, "POST", "/chats", {}, b"{}")[0] == 401
+
+
+def test_malformed_chat_request_is_a_bad_request(asgi, auth):
+    assert request(asgi, "POST", "/chats", auth, b"not json")[0] == 400
+    # Valid JSON, but not an object
+    assert request(asgi, "POST", "/chats", auth, b"[1, 2]")[0] == 400
+
+
+def test_failing_prompt_is_a_json_error(asgi, auth, monkeypatch):
+    from app import main
+
+    def build_prompt(app, messages, chat_id, user_id):
+        raise RuntimeError("index unavailable")
+
+    monkeypatch.setattr(main.chat_replies, "build_prompt", build_prompt)
+
+    status, headers, body = request(asgi, "POST", "/chats", auth, json.dumps({"messages": turns(1)}).encode())
+
+    assert status == 500
+    assert headers["content-type"] == "application/json"
+    assert json.loads(body) == {"error": "Error processing request"}
+
+
+def test_other_routes_go_to_flask(asgi, auth, app, user):
+    chat_id = add_chat(app, user, turns(2))
+
+    status, headers, body = request(asgi, "GET", f"/chats/{chat_id}", auth)
+    not_modified = request(asgi, "GET", f"/chats/{chat_id}", {**auth, "If-None-Match": headers["etag"]})
+
+    assert status == 200
+    assert json.loads(body) == turns(2)
+    # Answered without a body, which hypercorn's WSGI adapter can't send on its own
+    assert not_modified[0] == 304
+    assert not_modified[2] == b""
+
+
+def test_import_reads_the_body_as_it_arrives(asgi, auth, app, user):
+    from app.main import export_chats_repo
+
+    chat_id = add_chat(app, user, turns(3))
+    with app.app_context():
+        export = "".join(export_chats_repo(user)).encode()
+    half = len(export) // 2
+
+    status, _, body = request(asgi, "POST", "/import", auth, export[half:], chunks=[export[:half]])
+
+    assert status == 201
+    assert json.loads(body) == {"users": 0, "chats": 1, "messages": 3}
+    with app.app_context():
+        from app.extensions import db
+        from app.models import Chat
+
+        imported = db.session.query(Chat.id).filter(Chat.user_id == user, Chat.id != chat_id).scalar()
+    assert stored_messages(app, imported) == turns(3)
@@ -0,0 +1,57 @@
+from conftest import auth_headers
+
+GOOGLE_USER = {
+    "user_google_id": "google-1",
+    "display_name": "Ada",
+    "email": "ada@example.com",
+    "photo_url": "https://example.com/ada.png",
+    "access_token": "not-stored",
+}
+
+
+def test_sign_in_creates_the_user_once(client):
+    first = client.post("/auth", json=GOOGLE_USER)
+    again = client.post("/auth", json={**GOOGLE_USER, "display_name": "Ada L."})
+
+    assert first.status_code == 200
+    assert again.json["user"]["id"] == first.json["user"]["id"]
+    assert again.json["user"]["display_name"] == "Ada L."
+    assert "access_token" not in again.json["user"]
+
+
+def test_profile_needs_a_token(client):
+    assert client.get("/me").status_code == 401
+
+
+def test_profile_reflects_the_latest_sign_in(client):
+    signed_in = client.post("/auth", json=GOOGLE_USER).json
+    user_id, headers = signed_in["user"]["id"], {"Authorization": f"Bearer {signed_in['access_token']}"}
+    client.get("/me", headers=headers)
+    client.post("/auth", json={**GOOGLE_USER, "photo_url": "https://example.com/new.png"})
+
+    profile = client.get("/me", headers=headers).json
+    assert (profile["id"], profile["photo_url"]) == (user_id, "https://example.com/new.png")
+
+
+def test_refresh_token_gets_a_new_access_token(client):
+    tokens = client.post("/auth", json=GOOGLE_USER).json
+
+    refreshed = client.post("/auth/refresh", headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+
+    assert refreshed.status_code == 200
+    assert client.get("/me", headers={"Authorization": f"Bearer {refreshed.json['access_token']}"}).status_code == 200
+    # An access token can't be used to refresh
+    assert client.post("/auth/refresh", headers={"Authorization": f"Bearer {tokens['access_token']}"}).status_code == 422
+
+
+def test_unknown_user_is_not_found(client, app):
+    assert client.get("/me", headers=auth_headers(app, "missing")).status_code == 404
+
+
+def test_prometheus_metrics_count_requests(client, auth):
+    client.get("/chats", headers=auth)
+
+    body = client.get("/metrics").get_data(as_text=True)
+
+    assert 'route="/chats"' in body
+    assert "http_request_duration_seconds" in body
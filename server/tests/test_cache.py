@@ -0,0 +1,225 @@
+import pytest
+
+from app.cache import LocalBackend, LRUCache, TieredCache
+from app.response_cache import ResponseCache
+
+from conftest import add_chat, turns
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_entries_expire():
+    cache = LRUCache(ttl=-1)
+    cache.set("a", 1)
+
+    assert cache.get("a") is None
+
+
+def test_tiered_cache_falls_back_to_the_shared_backend():
+    backend = LocalBackend()
+    writer = TieredCache("test", backend=backend)
+    reader = TieredCache("test", backend=backend)
+
+    writer.set("key", {"value": 1})
+    assert reader.get("key") == {"value": 1}
+    assert reader.stats()["shared_hits"] == 1
+    writer.delete("key")
+    reader.clear_local()
+    assert reader.get("key") is None
+
+
+class Embedder:
+    """Counts the questions it is asked to embed."""
+    model_name = "test-model"
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [float(len(text)), 1.0]
+
+
+@pytest.fixture
+def vector_index(tmp_path):
+    pytest.importorskip("chromadb")
+    from app import retrieval
+
+    retrieval.embedding_cache.clear_local()
+    retrieval.retrieval_cache.clear_local()
+    return retrieval.VectorIndex(path=str(tmp_path / "index"), embedder=Embedder())
+
+
+def test_query_embeddings_are_cached_by_normalized_text(vector_index):
+    vector_index.embed_query("How many leave days?")
+    vector_index.embed_query("  how many LEAVE days ")
+
+    assert vector_index.embedder.calls == 1
+
+
+def test_retrieval_results_are_cached_until_the_index_changes(vector_index, monkeypatch):
+    from app.document_ingestion import Chunk
+
+    searches = []
+    search = vector_index.search
+    monkeypatch.setattr(vector_index, "search", lambda text, k: searches.append(text) or search(text, k))
+    vector_index.add_chunks([Chunk("doc.pdf", 0, 0, "leave policy")])
+
+    first = vector_index.query("leave?")
+    assert vector_index.query("Leave") == first
+    assert len(searches) == 1
+    vector_index.add_chunks([Chunk("doc.pdf", 1, 0, "expenses")])
+    vector_index.query("leave")
+    assert len(searches) == 2
+
+
+def embed(text: str) -> list:
+    """A bag-of-letters embedding, close for texts that differ by a few characters."""
+    vector = [0.0] * 26
+    for character in text.lower():
+        if "a" <= character <= "z":
+            vector[ord(character) - ord("a")] += 1
+    return vector
+
+
+@pytest.fixture
+def response_cache():
+    pytest.importorskip("numpy")
+    return ResponseCache(embed=embed, threshold=0.99)
+
+
+def test_add_keeps_a_newer_value():
+    backend = LocalBackend()
+    writer = TieredCache("test", backend=backend, keep_local=False)
+    reader = TieredCache("test", backend=backend, keep_local=False)
+
+    assert reader.add("version", 1)
+    writer.set("version", 2)
+    # A reader that read 1 before the write can't bring it back
+    assert not reader.add("version", 1)
+    assert reader.get("version") == 2
+    assert reader.stats()["entries"] == 0
+
+
+def test_response_cache_replays_identical_and_similar_prompts(response_cache):
+    messages = [{"role": "user", "content": "How many days of annual leave do I get?"}]
+    response_cache.store("llama3.2", {}, "1", "ada", messages, "Twenty.")
+
+    assert response_cache.lookup("llama3.2", {}, "1", "ada", messages) == "Twenty."
+    assert response_cache.lookup("llama3.2", {}, "1", "ada", [{"role": "user", "content": "How many days of annual leave do I get"}]) == "Twenty."
+    assert response_cache.lookup("llama3.2", {}, "1", "ada", [{"role": "user", "content": "Who approves expenses?"}]) is None
+    assert response_cache.stats()["exact_hits"] == 1 and response_cache.stats()["semantic_hits"] == 1
+
+
+def test_response_cache_is_partitioned_by_model_options_and_index(response_cache):
+    messages = [{"role": "user", "content": "hello"}]
+    response_cache.store("llama3.2", {"temperature": 0.9}, "1", "ada", messages, "Hi!")
+
+    assert response_cache.lookup("llama3.1", {"temperature": 0.9}, "1", "ada", messages) is None
+    assert response_cache.lookup("llama3.2", {"temperature": 0.2}, "1", "ada", messages) is None
+    assert response_cache.lookup("llama3.2", {"temperature": 0.9}, "2", "ada", messages) is None
+
+
+def test_identical_prompts_share_replies_across_users(response_cache):
+    prompt = [{"role": "system", "content": "Excerpt: leave policy"}, {"role": "user", "content": "How much leave?"}]
+    response_cache.store("llama3.2", {}, "1", "ada", prompt, "Twenty days.")
+
+    assert response_cache.lookup("llama3.2", {}, "1", "grace", prompt) == "Twenty days."
+
+
+def test_similar_prompts_dont_leak_another_users_context(response_cache):
+    private = [
+        {"role": "system", "content": "Summary of the earlier conversation: Ada is on medical leave."},
+        {"role": "user", "content": "How much leave do I have left?"},
+    ]
+    response_cache.store("llama3.2", {}, "1", "ada", private, "Ada, after your medical leave, five days.")
+    other_summary = [{"role": "system", "content": "Summary of the earlier conversation: nothing yet."}, private[1]]
+    similar = [private[0], {"role": "user", "content": "How much leave do I have left"}]
+
+    # Another user asking the same thing, in a chat of their own
+    assert response_cache.lookup("llama3.2", {}, "1", "grace", [private[1]]) is None
+    assert response_cache.lookup("llama3.2", {}, "1", "grace", similar) is None
+    # The same user, with another context before the same question
+    assert response_cache.lookup("llama3.2", {}, "1", "ada", other_summary) is None
+    assert response_cache.lookup("llama3.2", {}, "1", "ada", similar) == "Ada, after your medical leave, five days."
+
+
+def test_response_cache_evicts_the_least_recently_used(response_cache):
+    response_cache.max_entries = 2
+    for user in ("ada", "grace", "alan"):
+        response_cache.store("llama3.2", {}, "1", user, [{"role": "user", "content": f"question of {user}"}], user)
+
+    assert response_cache.lookup("llama3.2", {}, "1", "ada", [{"role": "user", "content": "question of ada"}]) is None
+    assert response_cache.lookup("llama3.2", {}, "1", "alan", [{"role": "user", "content": "question of alan"}]) == "alan"
+    assert response_cache.stats()["entries"] == 2
+
+
+def test_transcript_etag_revalidates_until_the_chat_changes(client, auth, app, user):
+    chat_id = add_chat(app, user, turns(2))
+
+    first = client.get(f"/chats/{chat_id}", headers=auth)
+    etag = first.headers["ETag"]
+    unchanged = client.get(f"/chats/{chat_id}", headers={**auth, "If-None-Match": etag})
+    client.post(f"/chats/{chat_id}/messages", json={"messages": turns(1, start=2)}, headers=auth)
+    changed = client.get(f"/chats/{chat_id}", headers={**auth, "If-None-Match": etag})
+
+    assert first.headers["Cache-Control"] == "private, no-cache"
+    assert unchanged.status_code == 304
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json == turns(3)
+
+
+def test_title_change_keeps_the_etag(client, auth, app, user):
+    chat_id = add_chat(app, user, turns(2))
+    etag = client.get(f"/chats/{chat_id}", headers=auth).headers["ETag"]
+
+    client.patch(f"/chats/{chat_id}", json={"title": "Renamed"}, headers=auth)
+
+    assert client.get(f"/chats/{chat_id}", headers={**auth, "If-None-Match": etag}).status_code == 304
+
+
+def test_cached_transcript_is_served_again(client, auth, app, user):
+    from app.main import chat_cache
+
+    chat_id = add_chat(app, user, turns(2))
+    # Cached once it has been streamed in full
+    client.get(f"/chats/{chat_id}", headers=auth).get_data()
+    hits = chat_cache.stats()["hits"]
+
+    assert client.get(f"/chats/{chat_id}", headers=auth).json == turns(2)
+    assert chat_cache.stats()["hits"] == hits + 1
+
+
+def test_unchanged_chat_is_revalidated_without_a_query(client, auth, app, user, shared_cache):
+    from sqlalchemy import event
+
+    from app.extensions import db
+
+    chat_id = add_chat(app, user, turns(2))
+    etag = client.get(f"/chats/{chat_id}", headers=auth).headers["ETag"]
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        response = client.get(f"/chats/{chat_id}", headers={**auth, "If-None-Match": etag})
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert response.status_code == 304
+    assert statements == []
@@ -0,0 +1,130 @@
+import json
+
+from conftest import add_chat, add_user, auth_headers, stored_messages, turns
+
+
+def test_start_chat_stores_messages_in_order(client, auth, app):
+    response = client.post("/start-chat", json={"messages": turns(3)}, headers=auth)
+
+    assert response.status_code == 201
+    assert stored_messages(app, response.json["chat_id"]) == turns(3)
+
+
+def test_append_adds_rows_after_the_stored_ones(client, auth, app, user):
+    chat_id = add_chat(app, user, turns(2))
+
+    response = client.post(f"/chats/{chat_id}/messages", json={"messages": turns(2, start=2)}, headers=auth)
+
+    assert response.status_code == 201
+    assert response.json["message_count"] == 4
+    assert stored_messages(app, chat_id) == turns(4)
+
+
+def test_patch_only_writes_new_turns(client, auth, app, user):
+    chat_id = add_chat(app, user, turns(2))
+
+    response = client.patch(f"/chats/{chat_id}", json={"messages": turns(3)}, headers=auth)
+
+    assert response.status_code == 200
+    assert stored_messages(app, chat_id) == turns(3)
+
+
+def message_ids(app, chat_id: str) -> list:
+    from app.models import ChatMessage
+
+    with app.app_context():
+        return [row.id for row in ChatMessage.query.filter_by(chat_id=chat_id).order_by(ChatMessage.seq)]
+
+
+def test_patch_replaces_turns_from_the_first_edit_on(client, auth, app, user):
+    chat_id = add_chat(app, user, turns(4))
+    kept = message_ids(app, chat_id)[:2]
+    edited = turns(2) + [{"role": "user", "content": "edited"}] + turns(2, start=3)
+
+    response = client.patch(f"/chats/{chat_id}", json={"messages": edited}, headers=auth)
+
+    assert response.status_code == 200
+    assert stored_messages(app, chat_id) == edited
+    # The turns before the edit are left as they were
+    assert message_ids(app, chat_id)[:2] == kept
+
+
+def test_patch_with_a_shorter_transcript_truncates_the_chat(client, auth, app, user):
+    chat_id = add_chat(app, user, turns(4))
+    kept = message_ids(app, chat_id)[:2]
+
+    client.patch(f"/chats/{chat_id}", json={"messages": turns(2)}, headers=auth)
+
+    assert stored_messages(app, chat_id) == turns(2)
+    assert message_ids(app, chat_id) == kept
+    assert client.get(f"/chats/{chat_id}", headers=auth).json == turns(2)
+
+
+def test_patch_with_the_stored_transcript_keeps_the_version(client, auth, app, user):
+    chat_id = add_chat(app, user, turns(2))
+    etag = client.get(f"/chats/{chat_id}", headers=auth).headers["ETag"]
+
+    client.patch(f"/chats/{chat_id}", json={"messages": turns(2)}, headers=auth)
+
+    assert client.get(f"/chats/{chat_id}", headers={**auth, "If-None-Match": etag}).status_code == 304
+
+
+def test_update_is_scoped_to_the_owner(app, user):
+    from app.main import update_chat_repo
+
+    chat_id = add_chat(app, user, turns(2))
+    with app.app_context():
+        assert update_chat_repo(chat_id, add_user(app), {"messages": []}) is None
+    assert stored_messages(app, chat_id) == turns(2)
+
+
+def test_chats_of_other_users_are_not_found(client, app, user):
+    chat_id = add_chat(app, user, turns(2))
+    other = auth_headers(app, add_user(app))
+
+    assert client.get(f"/chats/{chat_id}", headers=other).status_code == 404
+    assert client.patch(f"/chats/{chat_id}", json={"title": "Mine"}, headers=other).status_code == 404
+    assert client.post(f"/chats/{chat_id}/messages", json={"messages": turns(1)}, headers=other).status_code == 404
+
+
+def test_listing_pages_through_every_chat_once(client, auth, app, user):
+    chat_ids = [add_chat(app, user, turns(1), title=f"Chat {number}") for number in range(5)]
+
+    seen, cursor = [], None
+    while True:
+        response = client.get("/chats", query_string={"limit": 2, **({"cursor": cursor} if cursor else {})}, headers=auth)
+        assert response.status_code == 200
+        assert len(response.json["chats"]) <= 2
+        seen.extend(chat["id"] for chat in response.json["chats"])
+        cursor = response.json["next_cursor"]
+        if cursor is None:
+            break
+
+    # Newest first
+    assert seen == list(reversed(chat_ids))
+
+
+def test_listing_only_reads_the_sidebar_projection(client, auth, app, user):
+    add_chat(app, user, [{"role": "user", "content": "x" * 500}])
+
+    chat = client.get("/chats", headers=auth).json["chats"][0]
+
+    assert set(chat) == {"id", "title", "created_at", "preview"}
+    assert len(chat["preview"]) == 120
+
+
+def test_invalid_cursor_is_a_bad_request(client, auth):
+    assert client.get("/chats", query_string={"cursor": "not-a-cursor"}, headers=auth).status_code == 400
+
+
+def test_transcript_is_streamed_as_a_json_array(client, auth, app, user, monkeypatch):
+    from app import main
+
+    # Several batches, so the separators between them are exercised
+    monkeypatch.setattr(main, "TRANSCRIPT_BATCH_SIZE", 2)
+    chat_id = add_chat(app, user, turns(5))
+
+    response = client.get(f"/chats/{chat_id}", headers=auth)
+
+    assert response.status_code == 200
+    assert json.loads(response.data) == turns(5)
@@ -0,0 +1,57 @@
+from app.context import CONTEXT_MIN_TURNS, build_context, estimate_tokens, summary_prompt
+
+
+def conversation(count: int, size: int = 400) -> list:
+    return [{"role": "user" if n % 2 == 0 else "assistant", "content": f"{n} " + "x" * size} for n in range(count)]
+
+
+def test_short_conversation_is_sent_whole():
+    messages = [{"role": "system", "content": "Be brief."}] + conversation(4)
+
+    window = build_context(messages)
+
+    assert window.messages == messages
+    assert not window.needs_summary
+
+
+def test_long_conversation_keeps_the_system_prompt_and_the_newest_turns():
+    messages = [{"role": "system", "content": "Be brief."}] + conversation(40)
+
+    window = build_context(messages, budget=1000)
+
+    assert window.tokens <= 1000
+    assert window.messages[0] == messages[0]
+    assert window.messages[-1] == messages[-1]
+    assert window.needs_summary
+    # The turns that fell out are summarized, down to the low watermark
+    assert window.unsummarized == messages[1:window.summarize_upto]
+    assert window.summarize_upto > window.first_kept - 1
+
+
+def test_summary_replaces_the_turns_it_covers():
+    messages = conversation(40)
+
+    window = build_context(messages, summary="Earlier: leave policy.", summary_upto=30, budget=1000)
+
+    assert window.messages[0]["content"].endswith("Earlier: leave policy.")
+    assert window.first_kept >= 30
+    assert messages[29] not in window.messages
+
+
+def test_summary_past_the_transcript_is_ignored():
+    window = build_context(conversation(4), summary="Stale", summary_upto=10)
+
+    assert all("Stale" not in message["content"] for message in window.messages)
+
+
+def test_newest_turns_are_kept_even_over_budget():
+    window = build_context(conversation(4, size=10_000), budget=100)
+
+    assert len(window.messages) == CONTEXT_MIN_TURNS
+
+
+def test_summary_prompt_carries_the_previous_summary():
+    prompt = summary_prompt("Before.", [{"role": "user", "content": "Hi"}])
+
+    assert "Before." in prompt[1]["content"] and "user: Hi" in prompt[1]["content"]
+    assert estimate_tokens("abcd" * 10) == 10
@@ -0,0 +1,53 @@
+from sqlalchemy.pool import NullPool
+
+from app import database
+from app.database import PoolMetrics, engine_options, percentile
+
+
+def test_percentile_of_recent_samples():
+    assert percentile([], 0.95) == 0.0
+    assert percentile(list(range(100)), 0.95) == 95
+
+
+def test_snapshot_reports_checkout_waits_and_slow_queries():
+    metrics = PoolMetrics(slow_query_ms=100)
+    metrics.record_wait(2.0, overflowed=False)
+    metrics.record_wait(6.0, overflowed=True)
+    metrics.record_query("SELECT   1", 5.0)
+    metrics.record_query("SELECT\n  pg_sleep(1)", 1000.0)
+
+    snapshot = metrics.snapshot()
+
+    assert snapshot["checkout_wait_ms"] == {"avg": 4.0, "p95": 6.0, "max": 6.0}
+    assert snapshot["overflow_events"] == 1
+    assert snapshot["queries"] == 2
+    assert [query["statement"] for query in snapshot["slow_queries"]] == ["SELECT pg_sleep(1)"]
+
+
+def test_average_wait_covers_every_checkout():
+    metrics = PoolMetrics()
+    for _ in range(database.METRICS_WINDOW):
+        metrics.record_wait(1.0, overflowed=False)
+    # Past the window, the oldest samples are dropped from the percentiles only
+    for _ in range(database.METRICS_WINDOW):
+        metrics.record_wait(3.0, overflowed=False)
+
+    wait = metrics.snapshot()["checkout_wait_ms"]
+
+    assert wait["avg"] == 2.0
+    assert wait["p95"] == 3.0
+
+
+def test_engine_options_pool_only_real_databases(monkeypatch):
+    assert "poolclass" not in engine_options("sqlite:///chat.db")
+    assert engine_options("postgresql://db/chat")["poolclass"] is database.InstrumentedQueuePool
+
+    monkeypatch.setattr(database, "DB_PGBOUNCER", True)
+    assert engine_options("postgresql://db/chat")["poolclass"] is NullPool
+
+
+def test_db_metrics_count_the_requests_queries(client, auth):
+    before = client.get("/metrics/db", headers=auth).json["queries"]
+    client.get("/chats", headers=auth)
+
+    assert client.get("/metrics/db", headers=auth).json["queries"] > before
@@ -0,0 +1,230 @@
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip("pypdf")
+pytest.importorskip("langchain_text_splitters")
+
+from app.document_ingestion import file_hash, ingest_pdf, iter_chunks, page_hashes
+
+from conftest import add_user, auth_headers
+
+
+def write_pdf(path, pages: list, font: str = "Helvetica"):
+    """A PDF with one line of text per page, in one of the standard fonts."""
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject(f"/{font}"),
+    }))
+    for text in pages:
+        page = writer.add_blank_page(612, 792)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+        })
+        contents = DecodedStreamObject()
+        contents.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode())
+        page[NameObject("/Contents")] = writer._add_object(contents)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return str(path)
+
+
+def test_pages_are_chunked_in_page_order(tmp_path):
+    path = write_pdf(tmp_path / "handbook.pdf", [f"Page {number} text" for number in range(20)])
+
+    chunks = list(iter_chunks(path, workers=2))
+
+    assert [chunk.page for chunk in chunks] == list(range(20))
+    assert chunks[3].text == "Page 3 text"
+    assert chunks[3].source == "handbook.pdf"
+    assert ingest_pdf(path)["chunks"] == 20
+
+
+def test_only_the_requested_pages_are_parsed(tmp_path):
+    path = write_pdf(tmp_path / "handbook.pdf", ["one", "two", "three"])
+
+    assert [(chunk.page, chunk.text) for chunk in iter_chunks(path, pages=[2, 0])] == [(0, "one"), (2, "three")]
+
+
+def test_page_hashes_change_with_the_page(tmp_path):
+    before = page_hashes(write_pdf(tmp_path / "a.pdf", ["one", "two"]))
+    after = page_hashes(write_pdf(tmp_path / "b.pdf", ["one", "changed"]))
+
+    assert before[0] == after[0]
+    assert before[1] != after[1]
+
+
+def test_page_hashes_change_with_the_fonts(tmp_path):
+    before = page_hashes(write_pdf(tmp_path / "a.pdf", ["one", "two"]))
+    after = page_hashes(write_pdf(tmp_path / "b.pdf", ["one", "two"], font="Courier"))
+
+    # Same content streams, drawn with another font
+    assert before[0] != after[0] and before[1] != after[1]
+
+
+class FakeIndex:
+    """Records what a sync asks the vector index to do."""
+
+    def __init__(self):
+        self.deleted, self.added = [], []
+
+    def delete_pages(self, source, pages):
+        self.deleted.append((source, sorted(pages)))
+
+    def delete_source(self, source):
+        self.deleted.append((source, None))
+
+    def add_chunks(self, chunks):
+        chunks = list(chunks)
+        self.added.append(sorted({chunk.page for chunk in chunks}))
+        return len(chunks)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    from app import main
+
+    index = FakeIndex()
+    monkeypatch.setattr(main, "get_index", lambda: index)
+    return index
+
+
+def test_sync_only_embeds_new_or_changed_pages(app, tmp_path, index):
+    from app.main import sync_document_repo
+
+    path = write_pdf(tmp_path / "handbook.pdf", ["one", "two", "three"])
+    with app.app_context():
+        added = sync_document_repo(path)
+        unchanged = sync_document_repo(path)
+        write_pdf(tmp_path / "handbook.pdf", ["one", "changed"])
+        updated = sync_document_repo(path)
+
+    assert added["status"] == "added" and added["chunks"] == 3
+    assert unchanged["status"] == "unchanged"
+    assert updated == {"source": "handbook.pdf", "status": "updated", "pages_changed": 1, "pages_removed": 1, "chunks": 1}
+    assert index.added == [[0, 1, 2], [1]]
+    assert index.deleted[-1] == ("handbook.pdf", [1, 2])
+
+
+def test_sync_directory_drops_documents_that_are_gone(app, tmp_path, index):
+    from app.main import sync_directory_repo
+
+    write_pdf(tmp_path / "a.pdf", ["a"])
+    write_pdf(tmp_path / "b.pdf", ["b"])
+    with app.app_context():
+        sync_directory_repo(str(tmp_path))
+        (tmp_path / "b.pdf").unlink()
+        summaries = sync_directory_repo(str(tmp_path))
+
+    assert [(summary["source"], summary["status"]) for summary in summaries] == [("a.pdf", "unchanged"), ("b.pdf", "removed")]
+    assert index.deleted[-1] == ("b.pdf", None)
+
+
+def test_sync_directory_keeps_documents_of_other_folders(app, tmp_path, index):
+    from app.main import sync_directory_repo
+
+    (tmp_path / "handbooks").mkdir()
+    (tmp_path / "policies").mkdir()
+    write_pdf(tmp_path / "handbooks" / "a.pdf", ["a"])
+    write_pdf(tmp_path / "policies" / "b.pdf", ["b"])
+    with app.app_context():
+        sync_directory_repo(str(tmp_path / "handbooks"))
+        summaries = sync_directory_repo(str(tmp_path / "policies"))
+
+    assert [(summary["source"], summary["status"]) for summary in summaries] == [("b.pdf", "added")]
+    assert ("a.pdf", None) not in index.deleted
+
+
+def test_upload_must_be_a_pdf(client, auth):
+    response = client.post("/documents", data={"file": (BytesIO(b"text"), "notes.txt")}, headers=auth)
+
+    assert response.status_code == 400
+
+
+def test_upload_cant_replace_another_users_document(client, auth, app, tmp_path, monkeypatch):
+    from app import main
+
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+    pdf = open(write_pdf(tmp_path / "source.pdf", ["one"]), "rb").read()
+    write_pdf(tmp_path / "synced.pdf", ["two"])
+    other = auth_headers(app, add_user(app))
+
+    def upload(name, headers):
+        return client.post("/documents", data={"file": (BytesIO(pdf), name)}, headers=headers).status_code
+
+    assert upload("handbook.pdf", auth) == 202
+    assert upload("handbook.pdf", other) == 409
+    assert upload("handbook.pdf", auth) == 202
+    # Nor a document that was synced from the folder rather than uploaded
+    assert upload("synced.pdf", auth) == 409
+
+
+def test_command_line_index_goes_through_the_manifest(app, tmp_path, index, monkeypatch, capsys):
+    from app import document_ingestion, main
+
+    monkeypatch.setattr(main, "create_app", lambda: app)
+    path = write_pdf(tmp_path / "handbook.pdf", ["one", "two"])
+    document_ingestion.main([path, "--index"])
+    document_ingestion.main([path, "--index"])
+
+    assert index.added == [[0, 1]]
+    assert capsys.readouterr().out.splitlines()[-1].startswith("handbook.pdf: unchanged")
+    with pytest.raises(SystemExit):
+        document_ingestion.main([path, "--index", "--chunk-size", "500"])
+
+
+def test_vector_index_returns_the_closest_chunks(tmp_path):
+    pytest.importorskip("chromadb")
+    from app.document_ingestion import Chunk
+    from app.retrieval import VectorIndex
+
+    class Embedder:
+        model_name = "letters"
+
+        def embed_documents(self, texts):
+            return [self.embed_query(text) for text in texts]
+
+        def embed_query(self, text):
+            return [float(text.count(letter)) + 0.01 for letter in "aeiou"]
+
+    index = VectorIndex(path=str(tmp_path / "index"), embedder=Embedder())
+    version = index.version()
+    index.add_chunks([Chunk("doc.pdf", 0, 0, "aaaa"), Chunk("doc.pdf", 1, 0, "oooo")])
+
+    assert index.version() != version
+    assert [result["page"] for result in index.search("ooo", k=1)] == [1]
+    index.delete_pages("doc.pdf", [1])
+    assert index.count() == 1
+
+
+def test_file_hash_is_of_the_whole_file(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"abc")
+
+    assert file_hash(str(path)) == "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
+
+
+def test_excerpts_go_right_before_the_question(tmp_path, monkeypatch):
+    from app import retrieval
+
+    class Index:
+        def count(self):
+            return 1
+
+        def query(self, text, k):
+            return [{"text": "Twenty days a year.", "source": "leave.pdf", "page": 2, "score": 0.9}]
+
+    monkeypatch.setattr(retrieval, "RETRIEVAL_ENABLED", True)
+    monkeypatch.setattr(retrieval, "INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(retrieval, "get_index", lambda: Index())
+    messages = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "How much leave?"}]
+
+    prompt = retrieval.augment_messages(messages)
+
+    assert [message["role"] for message in prompt] == ["system", "system", "user"]
+    assert "[leave.pdf, page 3]\nTwenty days a year." in prompt[1]["content"]
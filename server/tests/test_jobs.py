@@ -0,0 +1,202 @@
+import threading
+from datetime import timedelta
+
+import pytest
+
+from app.jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, SUPERSEDED, JobQueue, PermanentJobError, utcnow
+
+from conftest import add_chat, turns
+
+
+@pytest.fixture
+def queue(app):
+    from app.extensions import db
+    from app.models import Job
+
+    queue = JobQueue(db, Job, inline_workers=0)
+    queue.init_app(app)
+    calls = []
+
+    @queue.handler("echo", max_attempts=2)
+    def echo(payload, progress):
+        calls.append(payload)
+        if payload.get("error") == "permanent":
+            raise PermanentJobError("can't be done")
+        if payload.get("error"):
+            raise RuntimeError("try again")
+        progress(0.5, "halfway")
+        return {"echo": payload}
+
+    queue.calls = calls
+    return queue
+
+
+def run_next(queue, worker_id: str = "worker"):
+    job = queue.claim(worker_id)
+    assert job is not None
+    queue.run(job, worker_id)
+    return queue.get(job["id"])
+
+
+def test_job_runs_and_stores_its_result(queue):
+    job_id = queue.enqueue("echo", {"value": 1})
+
+    job = run_next(queue)
+
+    assert job["id"] == job_id
+    assert job["status"] == SUCCEEDED
+    assert job["result"] == {"echo": {"value": 1}}
+    assert job["progress"] == 1.0 and job["locked_by"] is None
+    assert queue.claim("worker") is None
+
+
+def test_queued_duplicate_is_returned_instead_of_added(queue):
+    first = queue.enqueue("echo", {"value": 1}, dedupe_key="same")
+    second = queue.enqueue("echo", {"value": 2}, dedupe_key="same")
+    run_next(queue)
+    third = queue.enqueue("echo", {"value": 3}, dedupe_key="same")
+
+    assert first == second
+    assert third != first
+    assert queue.calls == [{"value": 1}]
+
+
+def test_failed_job_is_retried_later_then_marked_failed(queue):
+    job_id = queue.enqueue("echo", {"error": "transient"})
+
+    job = run_next(queue)
+    assert job["status"] == QUEUED
+    assert job["attempts"] == 1 and job["error"] == "try again"
+    # Backed off, so not due yet
+    assert queue.claim("worker") is None
+
+    with queue.engine.begin() as connection:
+        connection.execute(queue.table.update().where(queue.table.c.id == job_id).values(run_at=utcnow()))
+    job = run_next(queue)
+    assert job["status"] == FAILED
+    assert job["attempts"] == 2
+
+
+def test_permanent_error_is_not_retried(queue):
+    queue.enqueue("echo", {"error": "permanent"})
+
+    job = run_next(queue)
+
+    assert job["status"] == FAILED
+    assert job["attempts"] == 1
+
+
+def test_failing_job_is_superseded_by_a_queued_duplicate(queue):
+    failing = queue.enqueue("echo", {"error": "transient"}, dedupe_key="same")
+    job = queue.claim("worker")
+    # Enqueued while the first one runs, so it is queued next to it
+    queued = queue.enqueue("echo", {"value": 2}, dedupe_key="same")
+    queue.run(job, "worker")
+
+    assert queued != failing
+    assert queue.get(failing)["status"] == SUPERSEDED
+    assert queue.get(failing)["result"] == {"superseded_by": queued}
+    assert run_next(queue)["id"] == queued
+    assert queue.claim("worker") is None
+
+
+def test_duplicate_queued_during_the_retry_supersedes_the_job(queue, monkeypatch):
+    failing = queue.enqueue("echo", {"error": "transient"}, dedupe_key="same")
+    job = queue.claim("worker")
+    queued = queue.enqueue("echo", {"value": 2}, dedupe_key="same")
+    lookups = iter([None])
+    original = queue.queued_duplicate
+    # The duplicate isn't there yet when the failed job looks for it
+    monkeypatch.setattr(queue, "queued_duplicate", lambda job: next(lookups, None) or original(job))
+
+    queue.run(job, "worker")
+
+    assert queue.get(failing)["status"] == SUPERSEDED
+    assert queue.get(queued)["status"] == QUEUED
+
+
+def test_worker_keeps_polling_after_an_error(queue, monkeypatch):
+    queue.enqueue("echo", {"value": 1})
+    queue.enqueue("echo", {"value": 2})
+    stop, runs = threading.Event(), []
+
+    def run(job, worker_id):
+        runs.append(job["payload"])
+        if len(runs) == 1:
+            raise RuntimeError("database went away")
+        stop.set()
+
+    monkeypatch.setattr(queue, "run", run)
+    queue.work("worker", stop)
+
+    assert runs == [{"value": 1}, {"value": 2}]
+
+
+def test_expired_lease_is_taken_over(queue):
+    job_id = queue.enqueue("echo", {"value": 1})
+    job = queue.claim("dead-worker")
+    assert job["status"] == RUNNING
+    assert queue.claim("worker") is None
+
+    with queue.engine.begin() as connection:
+        connection.execute(
+            queue.table.update().where(queue.table.c.id == job_id).values(locked_at=utcnow() - timedelta(hours=1))
+        )
+    job = run_next(queue)
+
+    assert job["status"] == SUCCEEDED
+    assert job["attempts"] == 2
+    # The old worker lost its lease and can't write to the job any more
+    assert not queue.update(job_id, "dead-worker", progress=0.0)
+
+
+def test_job_status_route(client, auth, app, user):
+    from app.main import job_queue
+
+    with app.app_context():
+        job_id = job_queue.enqueue("generate_titles", {}, user_id=user)
+
+    response = client.get(f"/jobs/{job_id}", headers=auth)
+
+    assert response.status_code == 200
+    assert response.json["status"] == QUEUED
+
+
+def test_titles_are_generated_for_chats_with_a_reply(app, user, fake_ollama):
+    from app.extensions import db
+    from app.main import generate_titles, update_chat_titles_repo
+    from app.models import Chat
+    from app.titles import NEW_CHAT_TITLE
+
+    answered = add_chat(app, user, turns(2), title=NEW_CHAT_TITLE)
+    unanswered = add_chat(app, user, turns(1), title=NEW_CHAT_TITLE)
+
+    with app.app_context():
+        result = generate_titles({}, lambda fraction, message=None: None)
+        titles = dict(db.session.query(Chat.id, Chat.title).all())
+        # A chat the user renamed meanwhile keeps its name
+        renamed = update_chat_titles_repo({answered: "Overwritten"})
+
+    assert result == {"titled": 1}
+    assert titles[answered] not in (NEW_CHAT_TITLE, "")
+    assert titles[unanswered] == NEW_CHAT_TITLE
+    assert renamed == 0
+
+
+def test_summary_job_folds_old_turns_into_the_summary(app, user, fake_ollama):
+    from app.context import CONTEXT_TOKEN_BUDGET, build_context
+    from app.main import get_chat_summary_repo, summarize_chat
+
+    long_turns = [{**turn, "content": turn["content"] + " " + "x" * 2000} for turn in turns(12)]
+    chat_id = add_chat(app, user, long_turns)
+    assert build_context(long_turns).needs_summary
+
+    with app.app_context():
+        result = summarize_chat({"chat_id": chat_id, "user_id": user}, lambda fraction, message=None: None)
+        summary, summary_upto = get_chat_summary_repo(chat_id, user)
+
+    assert summary.startswith("token0")
+    assert summary_upto == result["summary_upto"] > 0
+    window = build_context(long_turns, summary, summary_upto)
+    assert not window.needs_summary
+    assert window.tokens <= CONTEXT_TOKEN_BUDGET
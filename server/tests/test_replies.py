@@ -0,0 +1,96 @@
+import pytest
+
+from app.generations import GenerationRegistry
+from app.replies import ChatReplies
+from app.routing import ModelRoute, ModelRouter
+from app.scheduler import InferenceScheduler
+
+from conftest import sse_events
+
+PROMPT = [{"role": "user", "content": "hi"}]
+
+
+class Cache:
+    def __init__(self, reply=None):
+        self.reply, self.stored = reply, []
+
+    def lookup(self, model, options, index_version, user_id, prompt):
+        self.prompt = prompt
+        return self.reply
+
+    def store(self, model, options, index_version, user_id, prompt, content):
+        self.stored.append(content)
+
+
+@pytest.fixture
+def replies():
+    saved = []
+    replies = ChatReplies(
+        GenerationRegistry(),
+        InferenceScheduler(max_concurrency=1),
+        ModelRouter([ModelRoute("llama3.2", ("chat",))], task_options={"chat": {}}, keepalive_interval=0),
+        {},
+        build_prompt=lambda app, messages, chat_id, user_id: [{"role": "system", "content": "prompt"}] + messages,
+        save_turn=lambda app, chat_id, user_id, messages, reply: saved.append((chat_id, reply.content)),
+        response_cache=Cache(),
+        index_version=lambda: "1",
+    )
+    replies.saved = saved
+    return replies
+
+
+def follow(generation) -> list:
+    return [data for _, data in sse_events("".join(generation.follow()))]
+
+
+def test_finished_run_is_stored_then_released(replies):
+    cached, prompt = replies.prepare(None, PROMPT, "chat", "user")
+    ticket = replies.admit("user", prompt)
+    generation = replies.start("user", "chat")
+    run = replies.run(None, generation, prompt, PROMPT, ticket)
+
+    assert run.request()["messages"][0]["content"] == "prompt"
+    assert not run.add({"message": {"content": "Hello"}})
+    assert run.add({"done": True, "eval_count": 1})
+    run.finish()
+    run.close()
+    replies.executor.shutdown(wait=True)
+
+    assert cached is None
+    assert follow(generation)[-1] == "[DONE]"
+    assert replies.saved == [("chat", "Hello")]
+    assert replies.response_cache.stored == ["Hello"]
+    assert replies.scheduler.snapshot()["active"] == 0
+    assert replies.router.snapshot()["models"]["llama3.2"]["generations"] == 1
+
+
+def test_failed_run_is_released_and_counted(replies):
+    generation = replies.start("user", "chat")
+    run = replies.run(None, generation, PROMPT, PROMPT, replies.admit("user", PROMPT))
+    run.add({"message": {"content": "Hel"}})
+    try:
+        raise ConnectionError("Ollama went away")
+    except ConnectionError:
+        run.fail()
+    finally:
+        run.close()
+
+    assert '"error"' in follow(generation)[-1]
+    assert replies.saved == [] and replies.response_cache.stored == []
+    assert replies.scheduler.snapshot()["active"] == 0
+    assert replies.router.snapshot()["models"]["llama3.2"]["failures"] == 1
+
+
+def test_cached_reply_is_replayed_and_stored(replies):
+    replies.response_cache.reply = "Twenty days."
+
+    cached, prompt = replies.prepare(None, PROMPT, "chat", "user")
+    generation = replies.start("user", "chat")
+    replies.replay(None, generation, cached, PROMPT)
+
+    assert prompt is None
+    # Looked up by the prompt the model would have been given
+    assert replies.response_cache.prompt[0] == {"role": "system", "content": "prompt"}
+    assert follow(generation)[-1] == "[DONE]"
+    assert replies.saved == [("chat", "Twenty days.")]
+    assert replies.scheduler.snapshot()["admitted"] == 0
@@ -0,0 +1,80 @@
+import pytest
+
+from app.routing import ModelRoute, ModelRouter, default_routes, routes_from_env
+from app.streaming import StreamAccumulator
+
+
+def finished_reply(tokens: int, eval_seconds: float) -> StreamAccumulator:
+    reply = StreamAccumulator()
+    reply.add({"message": {"content": "x"}})
+    reply.add({"done": True, "eval_count": tokens, "eval_duration": int(eval_seconds * 1e9), "prompt_eval_count": 10})
+    return reply
+
+
+def router(routes, **options) -> ModelRouter:
+    return ModelRouter(routes, task_options={"chat": {"num_predict": 2000}}, keepalive_interval=0, **options)
+
+
+def test_default_routes_give_every_task_its_model():
+    routes = default_routes({"chat": "big", "summary": "small", "title": "small"})
+
+    assert routes == [ModelRoute("big", ("chat",)), ModelRoute("small", ("summary", "title"))]
+
+
+def test_routes_from_env_are_parsed_and_checked():
+    routes = routes_from_env([], '[{"model": "small", "tasks": ["chat"], "max_prompt_chars": 100, "num_predict": 50}]')
+
+    assert routes == [ModelRoute("small", ("chat",), max_prompt_chars=100, num_predict=50)]
+    with pytest.raises(RuntimeError):
+        routes_from_env([], "[{}]")
+    with pytest.raises(RuntimeError):
+        router([ModelRoute("small", ("title",))])
+
+
+def test_long_prompts_skip_routes_that_cant_take_them():
+    chat = router([ModelRoute("small", ("chat",), max_prompt_chars=10), ModelRoute("big", ("chat",))])
+
+    assert chat.route("chat", [{"content": "short"}]).model == "small"
+    assert chat.route("chat", [{"content": "a much longer prompt"}]).model == "big"
+
+
+def test_route_caps_the_reply_length():
+    chat = router([ModelRoute("small", ("chat",), num_predict=100)])
+
+    assert chat.route("chat", []).options == {"num_predict": 100}
+
+
+def test_fastest_model_wins_once_both_have_stats():
+    chat = router([ModelRoute("slow", ("chat",)), ModelRoute("fast", ("chat",))])
+    for model, seconds in (("slow", 10.0), ("fast", 1.0)):
+        choice = chat.route("chat", [])
+        assert choice.model == model
+        chat.observe(choice, finished_reply(100, seconds))
+
+    assert chat.route("chat", []).model == "fast"
+    assert chat.snapshot()["models"]["fast"]["tokens_per_second"] == 100.0
+
+
+def test_failures_count_against_a_model():
+    chat = router([ModelRoute("flaky", ("chat",)), ModelRoute("steady", ("chat",))])
+    flaky = chat.route("chat", [])
+    chat.observe(flaky, StreamAccumulator(), failed=True)
+
+    assert chat.route("chat", []).model == "steady"
+    assert chat.snapshot()["models"]["flaky"]["failures"] == 1
+
+
+def test_generation_is_capped_by_num_predict(app, fake_ollama, monkeypatch):
+    from app import main
+
+    chat = ModelRouter([ModelRoute("llama3.2", num_predict=3)], task_options={"summary": {}}, keepalive_interval=0)
+    monkeypatch.setattr(main, "model_router", chat)
+
+    assert main.generate_text("summary", [{"role": "user", "content": "hi"}], "user") == "token0 token1 token2"
+
+
+def test_ping_loads_a_model(fake_ollama):
+    chat = router([ModelRoute("llama3.2", ("chat",))])
+    chat.keep_warm()
+
+    assert chat.snapshot()["models"]["llama3.2"]["pings"] == 1
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.scheduler import InferenceScheduler, SchedulerBusy, prompt_size
+
+
+def queue_in_background(scheduler, user_id: str, size: int, granted: list):
+    ready = threading.Event()
+
+    def run():
+        ready.set()
+        ticket = scheduler.acquire(user_id, size)
+        granted.append((user_id, size, ticket))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait()
+    return thread
+
+
+def wait_until_queued(scheduler, depth: int):
+    for _ in range(1000):
+        if scheduler.snapshot()["queued"] == depth:
+            return
+        threading.Event().wait(0.001)
+    raise AssertionError(f"expected {depth} queued requests")
+
+
+def test_grants_up_to_max_concurrency_then_queues():
+    scheduler = InferenceScheduler(max_concurrency=2)
+    first, second = scheduler.acquire("a", 10), scheduler.acquire("b", 10)
+    granted = []
+
+    waiting = queue_in_background(scheduler, "c", 10, granted)
+    wait_until_queued(scheduler, 1)
+    assert not granted
+
+    scheduler.release(first)
+    waiting.join(1)
+    assert [user_id for user_id, _, _ in granted] == ["c"]
+    assert scheduler.snapshot()["active"] == 2
+    scheduler.release(second)
+    scheduler.release(granted[0][2])
+    assert scheduler.snapshot()["active"] == 0
+
+
+def test_freed_slots_go_round_robin_across_users():
+    scheduler = InferenceScheduler(max_concurrency=1, max_queue_per_user=4)
+    held = scheduler.acquire("busy", 10)
+    granted, threads = [], []
+    for user_id in ("a", "a", "a", "b"):
+        threads.append(queue_in_background(scheduler, user_id, 10, granted))
+        wait_until_queued(scheduler, len(threads))
+
+    scheduler.release(held)
+    order = []
+    for _ in threads:
+        for _ in range(1000):
+            if len(granted) > len(order):
+                break
+            threading.Event().wait(0.001)
+        user_id, _, ticket = granted[len(order)]
+        order.append(user_id)
+        scheduler.release(ticket)
+
+    # "b" doesn't wait behind all of "a"'s requests
+    assert order[:2] == ["a", "b"]
+
+
+def test_short_prompts_go_first():
+    scheduler = InferenceScheduler(max_concurrency=1, short_prompt_chars=100)
+    held = scheduler.acquire("busy", 10)
+    granted = []
+    long_wait = queue_in_background(scheduler, "a", 5000, granted)
+    wait_until_queued(scheduler, 1)
+    short_wait = queue_in_background(scheduler, "b", 50, granted)
+    wait_until_queued(scheduler, 2)
+
+    scheduler.release(held)
+    short_wait.join(1)
+    assert granted[0][:2] == ("b", 50)
+    scheduler.release(granted[0][2])
+    long_wait.join(1)
+
+
+def test_rejects_beyond_the_per_user_and_global_limits():
+    scheduler = InferenceScheduler(max_concurrency=1, max_queue_depth=2, max_queue_per_user=1)
+    held = scheduler.acquire("busy", 10)
+    granted = []
+    queue_in_background(scheduler, "a", 10, granted)
+    wait_until_queued(scheduler, 1)
+
+    with pytest.raises(SchedulerBusy) as per_user:
+        scheduler.acquire("a", 10)
+    queue_in_background(scheduler, "b", 10, granted)
+    wait_until_queued(scheduler, 2)
+    with pytest.raises(SchedulerBusy) as full:
+        scheduler.acquire("c", 10)
+
+    assert per_user.value.retry_after >= 1 and full.value.retry_after >= 1
+    assert scheduler.snapshot()["rejected"] == 2
+    scheduler.release(held)
+
+
+def test_times_out_waiting_for_a_slot():
+    scheduler = InferenceScheduler(max_concurrency=1, max_wait=0.05)
+    scheduler.acquire("busy", 10)
+
+    with pytest.raises(SchedulerBusy):
+        scheduler.acquire("a", 10)
+    assert scheduler.snapshot()["queued"] == 0
+    assert scheduler.snapshot()["timed_out"] == 1
+
+
+def test_cancelled_async_waiter_gives_up_its_place():
+    scheduler = InferenceScheduler(max_concurrency=1)
+
+    async def run():
+        held = scheduler.acquire("busy", 10)
+        waiter = asyncio.create_task(scheduler.acquire_async("a", 10))
+        await asyncio.sleep(0.01)
+        assert scheduler.snapshot()["queued"] == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        scheduler.release(held)
+
+    asyncio.run(run())
+    assert scheduler.snapshot() | {"service_time_seconds": 0} == {
+        "active": 0, "queued": 0, "queued_users": 0, "max_concurrency": 1, "service_time_seconds": 0,
+        "admitted": 1, "rejected": 0, "timed_out": 0,
+    }
+
+
+def test_prompt_size_counts_message_content():
+    assert prompt_size([{"role": "user", "content": "abc"}, {"role": "assistant", "content": "de"}, "junk"]) == 5
+
+
+def test_busy_scheduler_is_a_429_with_retry_after(client, auth, monkeypatch):
+    from app import main
+
+    monkeypatch.setattr(main.chat_replies, "scheduler", InferenceScheduler(max_concurrency=1, max_queue_depth=0))
+    main.chat_replies.scheduler.acquire("someone", 10)
+
+    response = client.post("/chats", json={"messages": [{"role": "user", "content": "hi"}]}, headers=auth)
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
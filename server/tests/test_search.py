@@ -0,0 +1,65 @@
+from sqlalchemy.dialects import postgresql
+
+from app.search import like_snippet, query_terms, ts_query, ts_rank
+
+from conftest import add_chat, add_user
+
+
+def test_query_terms_follow_web_search_syntax():
+    assert query_terms('leave "carry over" or -sick') == ["leave", "carry over"]
+
+
+def test_snippet_highlights_the_terms():
+    fragments = like_snippet("Annual leave carries over into next year", ["leave"])
+
+    assert {"text": "leave", "highlight": True} in fragments
+
+
+def test_search_finds_only_the_users_messages(client, auth, app, user):
+    chat_id = add_chat(app, user, [{"role": "user", "content": "How much annual leave do I get?"},
+                                   {"role": "assistant", "content": "Twenty days."}], title="Leave")
+    add_chat(app, add_user(app), [{"role": "user", "content": "annual leave for someone else"}])
+
+    response = client.get("/chats/search", query_string={"q": "annual leave"}, headers=auth)
+
+    assert response.status_code == 200
+    assert [(result["chat_id"], result["seq"], result["title"]) for result in response.json["results"]] == [(chat_id, 0, "Leave")]
+
+
+def test_search_pages_through_every_match_once(client, auth, app, user):
+    add_chat(app, user, [{"role": "user", "content": f"policy question {number}"} for number in range(7)])
+
+    seen, cursor = [], None
+    while True:
+        response = client.get("/chats/search", query_string={"q": "policy", "limit": 3, **({"cursor": cursor} if cursor else {})},
+                              headers=auth)
+        seen.extend(result["seq"] for result in response.json["results"])
+        cursor = response.json["next_cursor"]
+        if cursor is None:
+            break
+
+    assert sorted(seen) == list(range(7))
+    assert len(seen) == 7
+
+
+def test_rank_is_compared_as_a_double():
+    rank = str(ts_rank(ts_query("leave")).compile(dialect=postgresql.dialect()))
+
+    assert rank.startswith("CAST(ts_rank_cd(") and rank.endswith("AS FLOAT(53))")
+
+
+def test_matches_of_equal_rank_straddle_a_page_boundary(client, auth, app, user):
+    # Identical messages rank the same, so only the message id orders them
+    add_chat(app, user, [{"role": "user", "content": "expense policy"} for _ in range(5)])
+
+    first = client.get("/chats/search", query_string={"q": "expense", "limit": 2}, headers=auth).json
+    second = client.get("/chats/search", query_string={"q": "expense", "limit": 2, "cursor": first["next_cursor"]},
+                        headers=auth).json
+
+    assert [result["seq"] for result in first["results"] + second["results"]] == [4, 3, 2, 1]
+    assert len({result["rank"] for result in first["results"] + second["results"]}) == 1
+
+
+def test_search_needs_a_query(client, auth):
+    assert client.get("/chats/search", headers=auth).status_code == 400
+    assert client.get("/chats/search", query_string={"q": "x", "cursor": "bad"}, headers=auth).status_code == 400
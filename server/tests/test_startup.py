@@ -0,0 +1,21 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ("ollama", "numpy", "torch", "transformers", "pypdf", "alembic", "langchain_text_splitters",
+                 "fastembed", "chromadb")
+
+
+@pytest.mark.parametrize("module", ["app.main", "app.asgi"])
+def test_importing_the_server_loads_no_heavy_module(module):
+    script = f"import json, sys, {module}; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True, text=True, check=True,
+    )
+
+    assert json.loads(result.stdout.splitlines()[-1]) == []
@@ -0,0 +1,207 @@
+import json
+
+from conftest import FAKE_TOKENS, add_chat, add_user, auth_headers, sse_events, stored_messages, turns
+
+
+def reply_text(events: list) -> str:
+    return "".join(json.loads(data).get("content", "") for _, data in events if data != "[DONE]")
+
+
+def streamed_reply(tokens: int = FAKE_TOKENS):
+    from app.streaming import StreamAccumulator
+
+    reply = StreamAccumulator()
+    for number in range(tokens):
+        reply.add({"message": {"content": f"token{number} "}, "done": False})
+    reply.add({"message": {"content": ""}, "done": True, "eval_count": tokens, "prompt_eval_count": 5})
+    return reply
+
+
+def test_reply_streams_numbered_events_and_ends_with_done(client, auth, fake_ollama):
+    response = client.post("/chats", json={"messages": turns(1)}, headers=auth)
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "text/event-stream"
+    events = sse_events(response.get_data(as_text=True))
+    assert [event_id for event_id, _ in events] == list(range(1, len(events) + 1))
+    assert events[-1][1] == "[DONE]"
+    assert reply_text(events) == "".join(f"token{number} " for number in range(FAKE_TOKENS))
+
+
+def test_reply_is_stored_with_its_stats_before_done(client, auth, app, user, fake_ollama):
+    from app.extensions import db
+    from app.models import ChatMessage
+
+    chat_id = add_chat(app, user, [])
+    response = client.post("/chats", json={"messages": turns(1), "chat_id": chat_id}, headers=auth)
+    events = sse_events(response.get_data(as_text=True))
+
+    assert stored_messages(app, chat_id) == turns(1) + [{"role": "assistant", "content": reply_text(events)}]
+    with app.app_context():
+        reply = db.session.query(ChatMessage).filter(ChatMessage.chat_id == chat_id, ChatMessage.seq == 1).one()
+        assert reply.completion_tokens == FAKE_TOKENS
+        assert reply.prompt_tokens and reply.latency_ms is not None
+
+
+def test_accumulator_joins_the_chunks_and_keeps_the_stats():
+    reply = streamed_reply()
+
+    assert reply.done
+    assert reply.content == "".join(f"token{number} " for number in range(FAKE_TOKENS))
+    assert (reply.prompt_tokens, reply.completion_tokens) == (5, FAKE_TOKENS)
+    assert reply.latency_ms is not None
+
+
+def test_finished_turn_is_stored_in_one_write_with_its_stats(app, user):
+    from app.extensions import db
+    from app.main import persist_chat_turn_repo
+    from app.models import ChatMessage
+
+    chat_id = add_chat(app, user, [])
+    reply = streamed_reply()
+    with app.app_context():
+        assert persist_chat_turn_repo(chat_id, user, turns(1), reply) == 2
+        stored = db.session.query(ChatMessage).filter(ChatMessage.chat_id == chat_id, ChatMessage.seq == 1).one()
+        assert stored.completion_tokens == FAKE_TOKENS
+        assert stored.prompt_tokens == 5 and stored.latency_ms is not None
+
+    assert stored_messages(app, chat_id) == turns(1) + [{"role": "assistant", "content": reply.content}]
+
+
+def test_turn_of_another_users_chat_is_not_stored(app, user):
+    from app.main import persist_chat_turn_repo
+
+    chat_id = add_chat(app, user, [])
+    with app.app_context():
+        assert persist_chat_turn_repo(chat_id, "someone else", turns(1), streamed_reply()) is None
+
+    assert stored_messages(app, chat_id) == []
+
+
+def finished_reply(content: str):
+    from app.streaming import StreamAccumulator
+
+    reply = StreamAccumulator()
+    reply.add({"message": {"content": content}})
+    reply.add({"done": True, "eval_count": 7, "prompt_eval_count": 3})
+    return reply
+
+
+def test_reply_saved_by_the_client_only_gets_its_stats(app, user):
+    from app.extensions import db
+    from app.main import persist_chat_turn_repo
+    from app.models import ChatMessage
+
+    chat_id = add_chat(app, user, turns(2))
+    with app.app_context():
+        assert persist_chat_turn_repo(chat_id, user, turns(1), finished_reply("message 1")) == 2
+        reply = db.session.query(ChatMessage).filter(ChatMessage.chat_id == chat_id, ChatMessage.seq == 1).one()
+        assert reply.completion_tokens == 7
+
+    assert stored_messages(app, chat_id) == turns(2)
+
+
+def test_reply_never_overwrites_another_turn(app, user):
+    from app.extensions import db
+    from app.main import persist_chat_turn_repo
+    from app.models import ChatMessage
+
+    # The client edited the chat while the reply to its first turn was generated
+    chat_id = add_chat(app, user, turns(3))
+    with app.app_context():
+        assert persist_chat_turn_repo(chat_id, user, turns(1), finished_reply("another reply")) == 4
+        edited = db.session.query(ChatMessage).filter(ChatMessage.chat_id == chat_id, ChatMessage.seq == 1).one()
+        assert edited.completion_tokens is None
+
+    assert stored_messages(app, chat_id) == turns(3) + [{"role": "assistant", "content": "another reply"}]
+
+
+def test_turn_reads_the_history_from_storage(client, auth, app, user, fake_ollama):
+    chat_id = add_chat(app, user, turns(2))
+
+    response = client.post(f"/chats/{chat_id}/turns", json={"content": "next question"}, headers=auth)
+    events = sse_events(response.get_data(as_text=True))
+
+    assert events[-1][1] == "[DONE]"
+    assert stored_messages(app, chat_id) == turns(2) + [
+        {"role": "user", "content": "next question"},
+        {"role": "assistant", "content": reply_text(events)},
+    ]
+
+
+def test_turn_needs_content(client, auth, app, user):
+    chat_id = add_chat(app, user, turns(2))
+
+    assert client.post(f"/chats/{chat_id}/turns", json={"content": " "}, headers=auth).status_code == 400
+
+
+def test_resume_replays_the_events_after_last_event_id(client, auth, fake_ollama):
+    response = client.post("/chats", json={"messages": turns(1)}, headers=auth)
+    events = sse_events(response.get_data(as_text=True))
+    generation_id = response.headers["X-Generation-Id"]
+
+    resumed = client.get(f"/generations/{generation_id}", headers={**auth, "Last-Event-ID": "3"})
+
+    assert resumed.status_code == 200
+    assert sse_events(resumed.get_data(as_text=True)) == events[3:]
+
+
+def test_resume_with_query_parameter_and_by_chat(client, auth, app, user, fake_ollama):
+    chat_id = add_chat(app, user, [])
+    response = client.post("/chats", json={"messages": turns(1), "chat_id": chat_id}, headers=auth)
+    events = sse_events(response.get_data(as_text=True))
+    generation_id = response.headers["X-Generation-Id"]
+
+    resumed = client.get(f"/generations/{generation_id}", query_string={"last_event_id": len(events) - 1}, headers=auth)
+    followed = client.get(f"/chats/{chat_id}/generation", headers=auth)
+
+    assert sse_events(resumed.get_data(as_text=True)) == events[-1:]
+    assert sse_events(followed.get_data(as_text=True)) == events
+
+
+def test_generations_of_other_users_are_not_found(client, auth, app, fake_ollama):
+    response = client.post("/chats", json={"messages": turns(1)}, headers=auth)
+    response.get_data()
+    other = auth_headers(app, add_user(app))
+
+    assert client.get(f"/generations/{response.headers['X-Generation-Id']}", headers=other).status_code == 404
+
+
+def test_cached_history_picks_up_turns_stored_since(client, auth, app, user):
+    from app.main import load_chat_history_repo
+
+    chat_id = add_chat(app, user, turns(2))
+    with app.app_context():
+        assert load_chat_history_repo(chat_id, user) == turns(2)
+    client.post(f"/chats/{chat_id}/messages", json={"messages": turns(1, start=2)}, headers=auth)
+
+    with app.app_context():
+        assert load_chat_history_repo(chat_id, user) == turns(3)
+        assert load_chat_history_repo(chat_id, "someone else") is None
+
+
+def test_cached_history_drops_turns_deleted_by_another_worker(app, user):
+    from app.extensions import db
+    from app.main import bump_chat_version, load_chat_history_repo
+    from app.models import ChatMessage
+
+    chat_id = add_chat(app, user, turns(4))
+    with app.app_context():
+        assert load_chat_history_repo(chat_id, user) == turns(4)
+        # Another worker truncates the chat, its history cache isn't this one
+        db.session.query(ChatMessage).filter(ChatMessage.chat_id == chat_id, ChatMessage.seq >= 2).delete()
+        bump_chat_version(chat_id)
+        db.session.commit()
+
+        assert load_chat_history_repo(chat_id, user) == turns(2)
+
+
+def test_reply_replaces_the_turns_the_client_changed(app, user):
+    from app.main import persist_chat_turn_repo
+
+    chat_id = add_chat(app, user, turns(3))
+    edited = turns(1) + [{"role": "assistant", "content": "edited"}, {"role": "user", "content": "again"}]
+    with app.app_context():
+        assert persist_chat_turn_repo(chat_id, user, edited, finished_reply("new reply")) == 4
+
+    assert stored_messages(app, chat_id) == edited + [{"role": "assistant", "content": "new reply"}]
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+from conftest import add_chat, add_user, auth_headers, stored_messages, turns
+
+
+def export(app, user_id=None) -> str:
+    from app.main import export_chats_repo
+
+    with app.app_context():
+        return "".join(export_chats_repo(user_id))
+
+
+def test_export_is_ndjson_with_chats_followed_by_their_messages(client, auth, app, user):
+    chat_id = add_chat(app, user, turns(2))
+    add_chat(app, user, [])
+
+    response = client.get("/export", headers=auth)
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert "attachment" in response.headers["Content-Disposition"]
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    # Oldest chat first
+    assert [record["type"] for record in records] == ["export", "user", "chat", "message", "message", "chat"]
+    messages = [record for record in records if record["type"] == "message"]
+    assert [(message["chat_id"], message["seq"], message["content"]) for message in messages] == [
+        (chat_id, 0, "message 0"), (chat_id, 1, "message 1"),
+    ]
+
+
+def test_import_gives_chats_fresh_ids_and_the_importing_user(client, app, user):
+    add_chat(app, user, turns(3), title="Original")
+    other = add_user(app)
+
+    response = client.post("/import", data=export(app, user), headers=auth_headers(app, other))
+
+    assert response.status_code == 201
+    assert response.json == {"users": 0, "chats": 1, "messages": 3}
+    listing = client.get("/chats", headers=auth_headers(app, other)).json["chats"]
+    assert [chat["title"] for chat in listing] == ["Original"]
+    assert stored_messages(app, listing[0]["id"]) == turns(3)
+
+
+def test_org_round_trip_keeps_ids_and_a_second_import_adds_nothing(app, tmp_path, monkeypatch):
+    from app.extensions import db
+    from app.main import import_chats_repo
+
+    user_id = add_user(app, "someone@example.com")
+    add_chat(app, user_id, turns(2))
+    original = export(app)
+
+    # Into an empty database
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'other.db'}")
+    from app.main import create_app
+
+    other = create_app()
+    with other.app_context():
+        db.create_all()
+        assert import_chats_repo(original.splitlines(keepends=True)) == {"users": 1, "chats": 1, "messages": 2}
+        assert import_chats_repo(original.splitlines(keepends=True)) == {"users": 1, "chats": 1, "messages": 2}
+    # Same records but for the header's timestamp
+    assert export(other).splitlines()[1:] == original.splitlines()[1:]
+
+
+def test_import_into_a_stored_chat_changes_its_etag(client, auth, app, user, shared_cache):
+    from app.main import import_chats_repo
+
+    chat_id = add_chat(app, user, turns(2))
+    etag = client.get(f"/chats/{chat_id}", headers=auth).headers["ETag"]
+    records = [json.loads(line) for line in export(app).splitlines()]
+    records.append({**records[-1], "seq": 2, "role": "user", "content": "message 2"})
+
+    with app.app_context():
+        import_chats_repo([json.dumps(record) + "\n" for record in records])
+    response = client.get(f"/chats/{chat_id}", headers={**auth, "If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.json == turns(3)
+
+
+def test_malformed_import_names_the_line_and_stores_nothing(client, auth, app, user):
+    lines = export(app, add_user(app)).splitlines()
+    lines += [json.dumps({"type": "chat", "id": "c1", "title": "Half"}), "{not json"]
+
+    response = client.post("/import", data="\n".join(lines), headers=auth)
+
+    assert response.status_code == 400
+    assert response.json["error"].startswith(f"line {len(lines)}:")
+    assert client.get("/chats", headers=auth).json["chats"] == []
+
+
+@pytest.mark.parametrize("record, error", [
+    ({"type": "message", "chat_id": "c1", "seq": 0, "role": "user"}, "a message has to follow its chat"),
+    ({"type": "export", "version": 99}, "export version 99 is not supported"),
+])
+def test_import_rejects_records_out_of_place(client, auth, record, error):
+    response = client.post("/import", data=json.dumps(record), headers=auth)
+
+    assert response.status_code == 400
+    assert error in response.json["error"]
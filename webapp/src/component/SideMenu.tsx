@@ -1,11 +1,16 @@
-import React, { useCallback, useEffect } from 'react';
+import React, { useCallback, useEffect, useRef, useState } from 'react';
 import sidebarIcon from '../assets/sidebar.png';
 import { logoutUser } from '../features/auth/authSlice';
 import { useNavigate } from 'react-router-dom';
 import { baseURL } from '../service';
 import { useAppDispatch, useAppSelector } from '../hooks';
 import { AppDispatch, RootState } from '../store';
-import { MessageResponse, setChat } from '../features/chat/chatSlice';
+import { ChatPage, MessageResponse, appendChatPage, setFirstChatPage } from '../features/chat/chatSlice';
+
+// Titles are generated in the background after a chat's first reply
+const NEW_CHAT_TITLE = 'New chat';
+const TITLE_POLL_INTERVAL_MS = 3000;
+const TITLE_POLL_ATTEMPTS = 5;
 
 interface SideMenuProps {
   selectedChatService: 'ollama' | 'bedrock';
@@ -19,33 +24,64 @@ const SideMenu: React.FC<SideMenuProps> = ({ selectedChatService, handleSelected
   const dispatch: AppDispatch = useAppDispatch();
   const { auth: {user}, chat } = useAppSelector((select: RootState) => select)
 
-  const fetchUserChats = useCallback(async () => {
-    try {
-      const response = await fetch(`${baseURL}/chats`, {
-        headers: {
-          'Content-Type': 'applicaiton/json',
-          'Authorization': `Bearer ${user?.access_token as string}`
-        }
-      })
-
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
-      }
+  const [loadingMore, setLoadingMore] = useState(false)
 
-      const fetchedChats: MessageResponse[] = await response.json();
-      console.log(fetchedChats)
+  // One page of the chat list, newest first; `cursor` is the previous page's next_cursor
+  const fetchChatPage = useCallback(async (cursor?: string): Promise<ChatPage> => {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : ''
+    const response = await fetch(`${baseURL}/chats${query}`, {
+      headers: {
+        'Content-Type': 'applicaiton/json',
+        'Authorization': `Bearer ${user?.access_token as string}`
+      }
+    })
 
-      dispatch(setChat(fetchedChats))
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    return response.json()
+  }, [user?.access_token])
 
+  const fetchUserChats = useCallback(async () => {
+    try {
+      dispatch(setFirstChatPage(await fetchChatPage()))
     } catch (e) {
       throw Error(`Something happened: ${e}`)
     }
-  }, [dispatch, user?.access_token])
+  }, [dispatch, fetchChatPage])
+
+  const loadMoreChats = async () => {
+    if (!chat.nextCursor || loadingMore) return
+    setLoadingMore(true)
+    try {
+      dispatch(appendChatPage(await fetchChatPage(chat.nextCursor)))
+    } catch (e) {
+      console.error(`Could not load more chats: ${e}`)
+    } finally {
+      setLoadingMore(false)
+    }
+  }
 
   useEffect(()=>{
     fetchUserChats()
   }, [fetchUserChats])
 
+  // Refresh the list until the new chats have their generated titles
+  const titlePolls = useRef(0)
+  useEffect(() => {
+    const waiting = chat.chat?.some((m: MessageResponse) => m.title === NEW_CHAT_TITLE)
+    if (!waiting) {
+      titlePolls.current = 0
+      return
+    }
+    if (titlePolls.current >= TITLE_POLL_ATTEMPTS) return
+    const timer = setTimeout(() => {
+      titlePolls.current += 1
+      fetchUserChats()
+    }, TITLE_POLL_INTERVAL_MS)
+    return () => clearTimeout(timer)
+  }, [chat.chat, fetchUserChats])
+
   const logUserOut = () => {
     dispatch(logoutUser())
     navigate('/')
@@ -88,6 +124,13 @@ const SideMenu: React.FC<SideMenuProps> = ({ selectedChatService, handleSelected
                     navigate(`/c/${m.id}`)
                   }}>{m?.title}</div>
                   )) : <div>Empy chat</div>}
+                {chat.nextCursor && (
+                  <button
+                    className='mt-2 p-2 text-sm text-gray-600 hover:text-gray-900 disabled:opacity-50'
+                    disabled={loadingMore}
+                    onClick={loadMoreChats}
+                  >{loadingMore ? 'Loading…' : 'Load more'}</button>
+                )}
               </div>
             </div>
 
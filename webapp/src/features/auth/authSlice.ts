@@ -22,7 +22,10 @@ const initialState: AuthState = {
   loading: true,
 };
 
-const removeAccessToken = () => localStorage.removeItem("access_token")
+const removeAccessToken = () => {
+  localStorage.removeItem("access_token")
+  localStorage.removeItem("refresh_token")
+}
 
 const authSlice = createSlice({
   name: 'auth',
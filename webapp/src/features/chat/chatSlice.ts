@@ -12,15 +12,25 @@ export interface MessageResponse {
   messages?: Message[];
   title?: string;
   user_id?: string
+  created_at?: string;
+  preview?: string;
+}
+
+export interface ChatPage {
+  chats: MessageResponse[];
+  next_cursor: string | null;
 }
 
 interface MessagState {
   chat: MessageResponse[];
+  // Cursor of the sidebar's next page, null once every chat is listed
+  nextCursor: string | null;
   loading: boolean;
 }
 
 const initialState: MessagState = {
   chat: [],
+  nextCursor: null,
   loading: true,
 };
 
@@ -32,11 +42,27 @@ const authSlice = createSlice({
       state.chat = action.payload;
       state.loading = false;
     },
+    // The newest chats, refreshed. Older pages that were already loaded are kept after them.
+    setFirstChatPage: (state, action: PayloadAction<ChatPage>) => {
+      const { chats, next_cursor } = action.payload;
+      const fresh = new Set(chats.map((c) => c.id));
+      const older = state.chat.filter((c) => !fresh.has(c.id));
+      if (!older.length) state.nextCursor = next_cursor;
+      state.chat = [...chats, ...older];
+      state.loading = false;
+    },
+    appendChatPage: (state, action: PayloadAction<ChatPage>) => {
+      const { chats, next_cursor } = action.payload;
+      const listed = new Set(state.chat.map((c) => c.id));
+      state.chat = [...state.chat, ...chats.filter((c) => !listed.has(c.id))];
+      state.nextCursor = next_cursor;
+      state.loading = false;
+    },
     setLoading: (state, action: PayloadAction<boolean>) => {
       state.loading = action.payload;
     },
   },
 });
 
-export const { setChat, setLoading } = authSlice.actions;
+export const { setChat, setFirstChatPage, appendChatPage, setLoading } = authSlice.actions;
 export default authSlice.reducer;
@@ -7,47 +7,85 @@ export const useAppSelector: TypedUseSelectorHook<RootState> = useSelector;
 import { useEffect } from 'react';
 import { setUser, User } from "./features/auth/authSlice";
 import { jwtDecode } from 'jwt-decode';
+import { baseURL } from './service';
 
 
+// Renew the access token this long before it expires
+const REFRESH_MARGIN_SECONDS = 60;
+
+const refreshAccessToken = async (): Promise<string | null> => {
+  const refreshToken = localStorage.getItem('refresh_token');
+  if (!refreshToken) {
+    return null;
+  }
+  const response = await fetch(`${baseURL}/auth/refresh`, {
+    method: 'POST',
+    headers: {
+      'Authorization': `Bearer ${refreshToken}`
+    },
+  });
+  if (!response.ok) {
+    localStorage.removeItem('refresh_token');
+    return null;
+  }
+  const data = await response.json();
+  localStorage.setItem('access_token', data.access_token as string);
+  return data.access_token as string;
+};
+
 export const useAuthCheck = (): User | null => {
   const dispatch = useAppDispatch();
 
   useEffect(() => {
-    const checkAuth = () => {
-      const accessToken = localStorage.getItem('access_token');
-      if (accessToken) {
-        try {
-          const decoded = jwtDecode(accessToken) as User;
-          
-          // Check if the token is expired
-          const currentTime = Date.now() / 1000;
-          if (decoded.exp < currentTime) {
-            console.log("Token is expired");
-            localStorage.removeItem('access_token');
-            return null;
-          }
-
-          const user: User = {
-            id: decoded.id,
-            email: decoded.email,
-            photo_url: decoded.photo_url,
-            display_name: decoded.display_name,
-            access_token: accessToken,
-            user_google_id: decoded.user_google_id,
-            exp: decoded.exp,
-          };
-
-          dispatch(setUser(user));
-          return user;
-        } catch (error) {
-          console.error("Error decoding token:", error);
+    let timer: ReturnType<typeof setTimeout> | undefined;
+
+    const checkAuth = async () => {
+      let accessToken = localStorage.getItem('access_token');
+      try {
+        // The token only carries the user id, the profile comes from /me
+        const currentTime = Date.now() / 1000;
+        if (!accessToken || jwtDecode(accessToken).exp! - REFRESH_MARGIN_SECONDS < currentTime) {
+          accessToken = await refreshAccessToken();
+        }
+        if (!accessToken) {
+          console.log("Token is expired");
+          localStorage.removeItem('access_token');
+          return null;
         }
+
+        const response = await fetch(`${baseURL}/me`, {
+          headers: {
+            'Authorization': `Bearer ${accessToken}`
+          },
+        });
+        if (!response.ok) {
+          return null;
+        }
+        const profile = await response.json();
+        const exp = jwtDecode(accessToken).exp!;
+
+        const user: User = {
+          id: profile.id,
+          email: profile.email,
+          photo_url: profile.photo_url,
+          display_name: profile.display_name,
+          access_token: accessToken,
+          user_google_id: profile.user_google_id,
+          exp: exp,
+        };
+
+        dispatch(setUser(user));
+        timer = setTimeout(checkAuth, Math.max(exp - REFRESH_MARGIN_SECONDS - currentTime, 1) * 1000);
+        return user;
+      } catch (error) {
+        console.error("Error decoding token:", error);
       }
       return null;
     };
 
     checkAuth();
+    return () => clearTimeout(timer);
   }, [dispatch]);
 
   return null;
-};
\ No newline at end of file
+};
@@ -4,6 +4,7 @@ import { setUser, User } from "../features/auth/authSlice";
 import { useNavigate } from "react-router-dom";
 import { auth } from "../firebaseConfig"; // Import your firebase configuration
 import { baseURL } from "../service";
+import { jwtDecode } from "jwt-decode";
 
 
 const AccountAccess = () => {
@@ -42,11 +43,13 @@ const AccountAccess = () => {
                     email: data.user.email,
                     photo_url: data.user.photo_url,
                     display_name: data.user.display_name,
-                    access_token: data.user.access_token,
+                    access_token: data.access_token,
                     user_google_id: data.user.user_google_id,
+                    exp: jwtDecode(data.access_token).exp!,
                 }
                 dispatch(setUser(user));
                 localStorage.setItem('access_token', data.access_token as string);
+                localStorage.setItem('refresh_token', data.refresh_token as string);
                 navigate("/new", {replace: true});
             } else {
                 console.error('Error during sign-in:', data.error);
@@ -16,6 +16,47 @@ import { useAppDispatch, useAppSelector } from '../hooks';
 import { Message, setChat } from '../features/chat/chatSlice';
 import { useNavigate, useParams } from 'react-router-dom';
 
+// How often, and how far apart, a dropped chat stream is resumed
+const MAX_RESUME_ATTEMPTS = 5;
+const RESUME_DELAY_MS = 1000;
+
+interface EventStreamState {
+  lastEventId: string
+  finished: boolean
+}
+
+// Reads server-sent events until the stream ends, passing each event's data to `onData`.
+// The id of the last event read is kept in `state`, to resume the stream from there.
+const readEventStream = async (response: Response, onData: (data: string) => void, state: EventStreamState) => {
+  const reader = response.body?.getReader();
+  if (!reader) {
+    throw new Error('Response body is not readable');
+  }
+
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) return;
+    buffer += decoder.decode(value, { stream: true });
+    // Events end with a blank line; the last piece may be the start of the next one
+    const events = buffer.split('\n\n');
+    buffer = events.pop() ?? '';
+
+    for (const event of events) {
+      let data: string | null = null;
+      for (const line of event.split('\n')) {
+        if (line.startsWith('id: ')) {
+          state.lastEventId = line.slice(4);
+        } else if (line.startsWith('data: ')) {
+          data = line.slice(6);
+        }
+      }
+      if (data !== null) onData(data);
+    }
+  }
+};
+
 interface ChatMessagesProps {
   messages: Message[]
   markdownComponents: Components
@@ -96,31 +137,6 @@ const MainChat: React.FC = () => {
   
   }, [chatId, fetchChats]);
 
-  // Call this when the chat is done loading
-  const updateChat = useCallback(async () => {
-    try {
-      const response = await fetch(`${baseURL}/chats/${chatId}`, {
-        method: 'PATCH',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${user?.access_token}`
-        },
-        body: JSON.stringify({ messages: messages })
-      });
-
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
-      }
-
-      const fetchedChat = await response.json();
-      console.log(fetchedChat);
-      setMessages(fetchedChat);
-    } catch (error) {
-      console.error('Error fetching chat:', error);
-      toast.error('Failed to fetch chat. Please try again.');
-    }
-  }, [chatId, messages, user?.access_token]);
-
   const handleSubmit = useCallback(async (event?: React.FormEvent<HTMLFormElement | KeyboardEvent | HTMLTextAreaElement>, inputMessage?: string) => {
     event?.preventDefault();
     const messageToSend = inputMessage || inputValue;
@@ -142,15 +158,26 @@ const MainChat: React.FC = () => {
       let response: Response;
       switch (selectedChatService) {
         case 'ollama':
-          response = await fetch(`${baseURL}/chats`, {
-            method: 'POST',
-            headers: {
-              'Content-Type': 'application/json',
-              'Authorization': `Bearer ${user?.access_token}`
-            },
-            body: JSON.stringify({ messages: [...messages, userMessage] }),
-            signal,
-          });
+          // The server keeps the history of saved chats, only the new message is sent
+          response = chatId
+            ? await fetch(`${baseURL}/chats/${chatId}/turns`, {
+                method: 'POST',
+                headers: {
+                  'Content-Type': 'application/json',
+                  'Authorization': `Bearer ${user?.access_token}`
+                },
+                body: JSON.stringify({ content: messageToSend }),
+                signal,
+              })
+            : await fetch(`${baseURL}/chats`, {
+                method: 'POST',
+                headers: {
+                  'Content-Type': 'application/json',
+                  'Authorization': `Bearer ${user?.access_token}`
+                },
+                body: JSON.stringify({ messages: [...messages, userMessage] }),
+                signal,
+              });
           break;
         default:
           throw new Error(`Unknown chat service: ${selectedChatService}`);
@@ -160,48 +187,74 @@ const MainChat: React.FC = () => {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
-      const reader = response.body?.getReader();
-      if (!reader) {
-        throw new Error('Response body is not readable');
-      }
-
       const assistantMessage: Message = { role: 'assistant', content: '' };
       setMessages(prevMessages => [...prevMessages, assistantMessage]);
 
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-        const chunk = new TextDecoder().decode(value);
-        const lines = chunk.split('\n\n');
-
-        for (const line of lines) {
-          if (line.startsWith('data: ')) {
-            const data = line.slice(6);
-            if (data === '[DONE]') {
-              setIsLoading(false);
-              break;
-            }
-
-            try {
-              const parsedData = JSON.parse(data);
-              if (parsedData.content) {
-                const processedChunks = new Set();
-                setMessages(prevMessages => {
-                  const newMessages = [...prevMessages];
-                  const lastMessage = newMessages[newMessages.length - 1];
-                  if (lastMessage.role === 'assistant' && !processedChunks.has(parsedData.id)) {
-                    processedChunks.add(parsedData.id);
-                    lastMessage.content += parsedData.content;
-                  }
-                  return newMessages;
-                });
+      const generationId = response.headers.get('X-Generation-Id');
+      const stream: EventStreamState = { lastEventId: '0', finished: false };
+      const handleData = (data: string) => {
+        if (data === '[DONE]') {
+          stream.finished = true;
+          setIsLoading(false);
+          return;
+        }
+
+        try {
+          const parsedData = JSON.parse(data);
+          if (parsedData.error) {
+            stream.finished = true;
+            toast.error('The reply could not be generated. Please try again.');
+          } else if (parsedData.content || parsedData.replace) {
+            setMessages(prevMessages => {
+              const newMessages = [...prevMessages];
+              const lastMessage = newMessages[newMessages.length - 1];
+              if (lastMessage.role === 'assistant') {
+                // A resumed stream that fell too far behind sends the whole reply so far
+                newMessages[newMessages.length - 1] = {
+                  ...lastMessage,
+                  content: parsedData.replace ? parsedData.content : lastMessage.content + parsedData.content,
+                };
               }
-            } catch (error) {
-              console.error('Error parsing SSE data:', error);
-            }
+              return newMessages;
+            });
           }
+        } catch (error) {
+          console.error('Error parsing SSE data:', error);
         }
+      };
+
+      // The reply keeps being generated if the connection drops, pick it up where it left off
+      let current: Response | null = response;
+      for (let attempt = 0; ; attempt++) {
+        if (current) {
+          try {
+            await readEventStream(current, handleData, stream);
+          } catch (error) {
+            if (signal.aborted) throw error;
+            console.warn('Chat stream interrupted:', error);
+          }
+        }
+        if (stream.finished || !generationId || attempt >= MAX_RESUME_ATTEMPTS) break;
 
+        await new Promise(resolve => setTimeout(resolve, RESUME_DELAY_MS));
+        try {
+          current = await fetch(`${baseURL}/generations/${generationId}`, {
+            method: 'GET',
+            headers: {
+              'Authorization': `Bearer ${user?.access_token}`,
+              'Last-Event-ID': stream.lastEventId,
+            },
+            signal,
+          });
+          if (current.status === 404) break;
+          if (!current.ok) current = null;
+        } catch (error) {
+          if (signal.aborted) throw error;
+          current = null;
+        }
+      }
+      if (!stream.finished) {
+        toast.error('The connection was lost before the reply finished. Reload the chat to see it.');
       }
     } catch (error) {
 
@@ -214,9 +267,8 @@ const MainChat: React.FC = () => {
       setIsLoading(false);
     }
 
-    if (chatId) {
-      await updateChat();
-    } else {
+    // Turns of an existing chat are saved by the server as they are streamed
+    if (!chatId) {
       await startNewChat();
     }
   }, [
@@ -225,7 +277,6 @@ const MainChat: React.FC = () => {
     messages,
     selectedChatService,
     startNewChat,
-    updateChat,
     chatId,
     user?.access_token,
   ])